@@ -3,6 +3,7 @@
 
 from collections import namedtuple
 import _sys
+from Languages.structural import Structural
 
 ################################
 # Exceptions
@@ -19,7 +20,7 @@ class FunctionNotDefined(Exception):
 ################################
 # Abstract classes
 
-class SyntaxObject:
+class SyntaxObject(Structural):
     pass
 
 class Expression(SyntaxObject):
@@ -41,6 +42,8 @@ class Type(Terminal):
 # Program
 
 class Program(SyntaxObject):
+    _fields = ('main', 'funcs')
+
     def __init__(self, main, *funcs):
         self.main = main
         self.funcs = funcs
@@ -57,7 +60,8 @@ class Program(SyntaxObject):
         pass # not defined
 
 class Function(SyntaxObject):
-    
+    _fields = ('name', 'arguments', 'variables', 'instrs')
+
     def __init__(self, name, arguments, variables, *instrs):
         self.name = name
         self.arguments = arguments
@@ -71,6 +75,7 @@ class Function(SyntaxObject):
 
     def interpret(self, fcns, *args):
         env = dict.fromkeys(self.variables | set(self.arguments))
+        env.update(zip(self.arguments, args))
 
         self.checkForm()
         for instr in self.instrs[:-1]:
@@ -89,25 +94,28 @@ class Function(SyntaxObject):
         assert isinstance(self.instrs[-1], Return)
         self.instrs[-1].checkForm()
 
-class Call(SyntaxObject):
+class Call(Expression):
+    _fields = ('name', 'args')
+
     def __init__(self, name, *args):
         self.name = name
         self.args = args
 
     def __str__(self):
-        return "(%s %s)" % (self.name, self.args)
+        return "(%s %s)" % (self.name, ' '.join(str(arg) for arg in self.args))
 
     def interpret(self, fcns, env):
         try:
             f = fcns[self.name]
         except KeyError as e:
             raise FunctionNotDefined from e
-        return f(*(arg.interpret(fcns, env) for arg in self.args))
+        return f.interpret(fcns, *(arg.interpret(fcns, env) for arg in self.args))
 
     def checkForm(self):
         pass # not defined
 
 class Return(SyntaxObject):
+    _fields = ('out',)
 
     def __init__(self, out):
         self.out = out
@@ -125,6 +133,7 @@ class Return(SyntaxObject):
 ####
 # I/0
 class Read(Expression):
+    _fields = ()
 
     def __str__(self):
         return '(read)'
@@ -138,6 +147,7 @@ class Read(Expression):
 ####
 # Types
 class Int(Expression):
+    _fields = ('val',)
 
     def __init__(self, val):
         self.val = val
@@ -203,6 +213,7 @@ class Assign(Instruction, namedtuple('Assign', 'var expr')):
         
 
 class Var(Terminal):
+    _fields = ('name',)
 
     def __init__(self, name):
         self.name = name
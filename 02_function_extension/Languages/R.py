@@ -1,8 +1,8 @@
 ################################
 # Author: Wesley Nuzzo
 
-from collections import namedtuple
 import _sys
+from Languages.structural import Structural
 
 ################################
 # Exceptions #
@@ -13,22 +13,34 @@ class VarNotDefined(Exception):
 ################################
 # Abstract classes #
 
-class SyntaxObject:
-    pass
+class SyntaxObject(Structural):
+    __slots__ = ()
 
 class Expression(SyntaxObject):
-    pass
+    __slots__ = ()
 
 class Type(Expression):
-    pass
+    __slots__ = ()
 
 class Operator(Expression):
-    pass
+    ''' Operators unpack like a tuple of their operands.'''
+    __slots__ = ()
+
+    def __iter__(self):
+        return iter([getattr(self, field) for field in self._fields])
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, i):
+        return getattr(self, self._fields[i])
 
 ################################
 # Program #
 
 class Program(SyntaxObject):
+    _fields = ('functions', 'body')
+    __slots__ = _fields + ('_hash',)
 
     def __init__(self, functions, body):
         self.functions = functions
@@ -66,6 +78,9 @@ class WrongNumberOfArgs(Exception):
     pass
 
 class Function(SyntaxObject):
+    _fields = ('name', 'arguments', 'body')
+    __slots__ = _fields + ('_hash',)
+
     def __init__(self, name, arguments, body):
         self.name = name
         self.arguments = arguments
@@ -95,6 +110,8 @@ class Function(SyntaxObject):
         self.body.checkForm()
 
 class Fname(SyntaxObject):
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
     def __repr__(self):
@@ -111,6 +128,9 @@ class Fname(SyntaxObject):
         assert isinstance(self.name, str)
 
 class Call(Expression):
+    _fields = ('fname', 'args')
+    __slots__ = _fields + ('_hash',)
+
     def __init__(self, fname, *args):
         self.fname = fname
         self.args = args
@@ -147,6 +167,8 @@ class Call(Expression):
 ####
 # I/O
 class Read(Expression):
+    _fields = ()
+    __slots__ = ()
 
     def __str__(self):
         return '(read)'
@@ -163,6 +185,8 @@ class Read(Expression):
 ####
 # Types
 class Int(Type):
+    _fields = ('val',)
+    __slots__ = _fields
     
     def __init__(self, val):
         self.val = val
@@ -181,13 +205,18 @@ class Int(Type):
 
 ####
 # Operators
-class Negative(Operator, namedtuple('Negative', 'expr')):
+class Negative(Operator):
+    _fields = ('expr',)
+    __slots__ = _fields + ('_hash',)
+
+    def __init__(self, expr):
+        self.expr = expr
 
     def __repr__(self):
-        return 'R.Negative(%r)' % self
+        return 'R.Negative(%r)' % (self.expr,)
 
     def __str__(self):
-        return '(- %s)' % self
+        return '(- %s)' % (self.expr,)
 
     def interpret(self, env):
         expr = self.expr.interpret(env)
@@ -198,17 +227,22 @@ class Negative(Operator, namedtuple('Negative', 'expr')):
             assert isinstance(subexpr, Expression)
             subexpr.checkForm()
 
-class Sum(Operator, namedtuple('Sum', 'lhs rhs')):
+class Sum(Operator):
+    _fields = ('lhs', 'rhs')
+    __slots__ = _fields + ('_hash',)
+
+    def __init__(self, lhs, rhs):
+        self.lhs = lhs
+        self.rhs = rhs
 
     def __repr__(self):
-        return 'R.Sum(%r, %r)' % self
+        return 'R.Sum(%r, %r)' % (self.lhs, self.rhs)
 
     def __str__(self):
-        return '(+ %s %s)' % self
+        return '(+ %s %s)' % (self.lhs, self.rhs)
 
     def interpret(self, env):
-        lhs, rhs = (expr.interpret(env) for expr in self)
-        return lhs + rhs
+        return self.lhs.interpret(env) + self.rhs.interpret(env)
 
     def checkForm(self):
         for subexpr in self:
@@ -219,6 +253,8 @@ class Sum(Operator, namedtuple('Sum', 'lhs rhs')):
 # Variables and Frames
 
 class Let(Expression):
+    _fields = ('binding', 'body')
+    __slots__ = _fields + ('_hash',)
 
     def __init__(self, binding, body):
         self.body = body
@@ -247,6 +283,7 @@ class Let(Expression):
         self.body.checkForm()
 
 class Var(Expression):
+    __slots__ = ('name',)
 
     def __init__(self, name):
         self.name = name
@@ -6,6 +6,7 @@ Provides an interpreter for x86, along with some intermediate forms.
 
 from collections import namedtuple
 from enum import *
+from Languages.structural import Structural
 
 ########
 # Input function
@@ -17,7 +18,7 @@ input:
 ################################
 # Abstract classes #
 
-class SyntaxObject:
+class SyntaxObject(Structural):
     pass
 
 class Source(SyntaxObject):
@@ -33,7 +34,8 @@ class Instruction(SyntaxObject):
 # Helper for interpret functions
 class Env:
     def __init__(self):
-        stackPtr = Addr.SPACE // 2
+        # registers hold byte addresses; mem holds one word per cell
+        stackPtr = Addr.SPACE // 2 * Addr.WORD_SIZE
         self.regs = {Reg.RSP:stackPtr,
                      Reg.RBP:stackPtr}
         self.mem = [None]*Addr.SPACE
@@ -41,6 +43,7 @@ class Env:
 ####
 # Program and Retq
 class Program(SyntaxObject):
+    _fields = ('instrs',)
 
     def __init__(self, *instrs):
         self.instrs = instrs
@@ -53,9 +56,35 @@ class Program(SyntaxObject):
     def interpret(self):
         self.checkForm()
         env = Env()
-        for instr in self.instrs[:-1]:
+        # retq ends the program, even if it is not the last instruction
+        for instr in self.instrs:
+            if isinstance(instr, Retq):
+                return instr.interpret(env)
             instr.interpret(env)
-        return self.instrs[-1].interpret(env)
+
+    def compile_to_closure(self):
+        ''' Decode every instruction once into a Python closure, and return a
+        function that runs them and gives the same result as interpret().
+
+        Registers are kept in a list indexed by Reg.value rather than a dict,
+        and each closure has its operands' indices bound in advance, so the
+        returned function can be called repeatedly at much lower cost.'''
+        self.checkForm()
+        # as in interpret, nothing after the first retq is run
+        end = next(i for i, instr in enumerate(self.instrs)
+                   if isinstance(instr, Retq))
+        steps = [instr.compile() for instr in self.instrs[:end]]
+        retq = self.instrs[end].compile()
+        stackPtr = Addr.SPACE // 2 * Addr.WORD_SIZE
+        rsp, rbp = Reg.RSP.value, Reg.RBP.value
+        def run():
+            regs = [None] * (len(Reg)+1)
+            regs[rsp] = regs[rbp] = stackPtr
+            mem = [None] * Addr.SPACE
+            for step in steps:
+                step(regs, mem)
+            return retq(regs, mem)
+        return run
 
     def checkForm(self):
         for instr in self.instrs:
@@ -64,6 +93,7 @@ class Program(SyntaxObject):
         assert isinstance(self.instrs[-1], Retq)
 
 class Retq(Instruction):
+    _fields = ()
 
     def __str__(self):
         return 'retq'
@@ -71,12 +101,17 @@ class Retq(Instruction):
     def interpret(self, env):
         return Reg.RAX.getVal(env)
 
+    def compile(self):
+        rax = Reg.RAX.value
+        return lambda regs, mem: regs[rax]
+
     def checkForm(self):
         return
 
 ####
 # Types
 class Int(Source):
+    _fields = ('val',)
 
     def __init__(self, val):
         self.val = val
@@ -87,6 +122,10 @@ class Int(Source):
     def getVal(self, env):
         return self.val
 
+    def compileGet(self):
+        val = self.val
+        return lambda regs, mem: val
+
     def checkForm(self):
         assert isinstance(self.val, int)
 
@@ -101,6 +140,27 @@ class Movq(Instruction, namedtuple('Movq', 'src dest')):
     def interpret(self, env):
         self.dest.setVal(self.src.getVal(env), env)
 
+    def compile(self):
+        if isinstance(self.dest, Reg):
+            d = self.dest.value
+            if isinstance(self.src, Reg):
+                s = self.src.value
+                def step(regs, mem):
+                    regs[d] = regs[s]
+            elif isinstance(self.src, Int):
+                val = self.src.val
+                def step(regs, mem):
+                    regs[d] = val
+            else:
+                get = self.src.compileGet()
+                def step(regs, mem):
+                    regs[d] = get(regs, mem)
+            return step
+        get, put = self.src.compileGet(), self.dest.compileSet()
+        def step(regs, mem):
+            put(regs, mem, get(regs, mem))
+        return step
+
     def checkForm(self):
         assert isinstance(self.src, Source)
         self.src.checkForm()
@@ -118,6 +178,17 @@ class Negq(Instruction, namedtuple('Negq', 'dest')):
     def interpret(self, env):
         self.dest.setVal(-self.dest.getVal(env), env)
 
+    def compile(self):
+        if isinstance(self.dest, Reg):
+            d = self.dest.value
+            def step(regs, mem):
+                regs[d] = -regs[d]
+            return step
+        get, put = self.dest.compileGet(), self.dest.compileSet()
+        def step(regs, mem):
+            put(regs, mem, -get(regs, mem))
+        return step
+
     def checkForm(self):
         assert isinstance(self.dest, Destination)
         self.dest.checkForm()
@@ -132,6 +203,28 @@ class Subq(Instruction, namedtuple('Subq', 'src dest')):
         self.dest.setVal(self.dest.getVal(env) - self.src.getVal(env),
                          env)
 
+    def compile(self):
+        if isinstance(self.dest, Reg):
+            d = self.dest.value
+            if isinstance(self.src, Reg):
+                s = self.src.value
+                def step(regs, mem):
+                    regs[d] -= regs[s]
+            elif isinstance(self.src, Int):
+                val = self.src.val
+                def step(regs, mem):
+                    regs[d] -= val
+            else:
+                get = self.src.compileGet()
+                def step(regs, mem):
+                    regs[d] -= get(regs, mem)
+            return step
+        src = self.src.compileGet()
+        get, put = self.dest.compileGet(), self.dest.compileSet()
+        def step(regs, mem):
+            put(regs, mem, get(regs, mem) - src(regs, mem))
+        return step
+
     def checkForm(self):
         assert isinstance(self.src, Source)
         self.src.checkForm()
@@ -149,6 +242,28 @@ class Addq(Instruction, namedtuple('Addq', 'src dest')):
         self.dest.setVal(self.dest.getVal(env) + self.src.getVal(env),
                          env)
 
+    def compile(self):
+        if isinstance(self.dest, Reg):
+            d = self.dest.value
+            if isinstance(self.src, Reg):
+                s = self.src.value
+                def step(regs, mem):
+                    regs[d] += regs[s]
+            elif isinstance(self.src, Int):
+                val = self.src.val
+                def step(regs, mem):
+                    regs[d] += val
+            else:
+                get = self.src.compileGet()
+                def step(regs, mem):
+                    regs[d] += get(regs, mem)
+            return step
+        src = self.src.compileGet()
+        get, put = self.dest.compileGet(), self.dest.compileSet()
+        def step(regs, mem):
+            put(regs, mem, get(regs, mem) + src(regs, mem))
+        return step
+
     def checkForm(self):
         assert isinstance(self.src, Source)
         self.src.checkForm()
@@ -163,11 +278,20 @@ class Pushq(Instruction, namedtuple('Pushq', 'src')):
         return 'pushq %s' % self
 
     def interpret(self, env):
+        val = self.src.getVal(env)
         base = Reg.RSP
-        base.setVal(base.getVal(env)-1,
+        base.setVal(base.getVal(env)-Addr.WORD_SIZE,
                     env)
-        Addr(base, 0).setVal(self.src.getVal(env),
-                             env)
+        Addr(base, 0).setVal(val, env)
+
+    def compile(self):
+        rsp, size = Reg.RSP.value, Addr.WORD_SIZE
+        get = self.src.compileGet()
+        def step(regs, mem):
+            val = get(regs, mem)
+            regs[rsp] -= size
+            mem[regs[rsp] // size] = val
+        return step
 
     def checkForm(self):
         assert isinstance(self.src, Source)
@@ -184,9 +308,18 @@ class Popq(Instruction, namedtuple('Popq', 'dest')):
         self.dest.setVal(Addr(base, 0).getVal(env),
                          env)
         assert self.dest.getVal(env) != None
-        base.setVal(base.getVal(env)+1,
+        base.setVal(base.getVal(env)+Addr.WORD_SIZE,
                     env)
 
+    def compile(self):
+        rsp, size = Reg.RSP.value, Addr.WORD_SIZE
+        get, put = self.dest.compileGet(), self.dest.compileSet()
+        def step(regs, mem):
+            put(regs, mem, mem[regs[rsp] // size])
+            assert get(regs, mem) != None
+            regs[rsp] += size
+        return step
+
     def checkForm(self):
         assert isinstance(self.dest, Destination)
         self.dest.checkForm()
@@ -212,6 +345,11 @@ class Reg(Source, Destination, Enum):
     R14 = auto()
     R15 = auto()
 
+    # registers are compared by identity, like other enum members
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = Enum.__hash__
+
     def __str__(self):
         return '%%%s' % self.name.lower()
 
@@ -221,33 +359,46 @@ class Reg(Source, Destination, Enum):
     def setVal(self, val, env):
         env.regs[self] = val
 
+    def compileGet(self):
+        i = self.value
+        return lambda regs, mem: regs[i]
+
+    def compileSet(self):
+        i = self.value
+        def put(regs, mem, val):
+            regs[i] = val
+        return put
+
     def checkForm(self):
         return
 
 class Addr(Source, Destination):
+    _fields = ('base', 'offset')
     SPACE = 2**8
-    WORD_SIZE = 4
+    WORD_SIZE = 8
 
     def __init__(self, base, offset):
         self.base = base
         self.offset = offset
-        # for interpreter methods
-        self._offset = offset // self.WORD_SIZE
 
     def __str__(self):
         return '%d(%s)' % (self.offset, self.base)
 
-    def __eq__(self, other):
-        return self.base == other.base and self.offset == other.offset
-
-    def __hash__(self):
-        return hash((self.base, offset))
-
     def getVal(self, env):
-        return env.mem[self.base.getVal(env) + self._offset]
+        return env.mem[(self.base.getVal(env) + self.offset) // self.WORD_SIZE]
 
     def setVal(self, val, env):
-        env.mem[self.base.getVal(env) + self._offset] = val
+        env.mem[(self.base.getVal(env) + self.offset) // self.WORD_SIZE] = val
+
+    def compileGet(self):
+        base, offset, size = self.base.value, self.offset, self.WORD_SIZE
+        return lambda regs, mem: mem[(regs[base] + offset) // size]
+
+    def compileSet(self):
+        base, offset, size = self.base.value, self.offset, self.WORD_SIZE
+        def put(regs, mem, val):
+            mem[(regs[base] + offset) // size] = val
+        return put
 
     def checkForm(self):
         assert isinstance(self.base, Reg)
@@ -6,11 +6,12 @@ Provides an interpreter for x86, along with some intermediate forms.
 
 from collections import namedtuple
 from enum import *
+from Languages.structural import Structural
 
 ################################
 # Abstract classes #
 
-class SyntaxObject:
+class SyntaxObject(Structural):
     pass
 
 class Source(SyntaxObject):
@@ -26,7 +27,8 @@ class Instruction(SyntaxObject):
 # Helper for interpret functions
 class Env:
     def __init__(self):
-        stackPtr = Addr.SPACE // 2
+        # registers hold byte addresses; mem holds one word per cell
+        stackPtr = Addr.SPACE // 2 * Addr.WORD_SIZE
         self.regs = {Reg.RSP:stackPtr,
                      Reg.RBP:stackPtr}
         self.mem = [None]*Addr.SPACE
@@ -34,6 +36,7 @@ class Env:
 ####
 # Program and Retq
 class Program(SyntaxObject):
+    _fields = ('instrs',)
 
     def __init__(self, *instrs):
         self.instrs = instrs
@@ -57,6 +60,7 @@ class Program(SyntaxObject):
         assert isinstance(self.instrs[-1], Retq)
 
 class Retq(Instruction):
+    _fields = ()
 
     def __str__(self):
         return 'retq'
@@ -70,6 +74,7 @@ class Retq(Instruction):
 ####
 # Types
 class Int(Source):
+    _fields = ('val',)
 
     def __init__(self, val):
         self.val = val
@@ -151,11 +156,11 @@ class Pushq(Instruction, namedtuple('Pushq', 'src')):
         return 'pushq %s' % self
 
     def interpret(self, env):
+        val = self.src.getVal(env)
         base = Reg.RSP
-        base.setVal(base.getVal(env)-1,
+        base.setVal(base.getVal(env)-Addr.WORD_SIZE,
                     env)
-        Addr(base, 0).setVal(self.src.getVal(env),
-                             env)
+        Addr(base, 0).setVal(val, env)
 
     def checkForm(self):
         assert isinstance(self.src, Source)
@@ -172,7 +177,7 @@ class Popq(Instruction, namedtuple('Popq', 'dest')):
         self.dest.setVal(Addr(base, 0).getVal(env),
                          env)
         assert self.dest.getVal(env) != None
-        base.setVal(base.getVal(env)+1,
+        base.setVal(base.getVal(env)+Addr.WORD_SIZE,
                     env)
 
     def checkForm(self):
@@ -200,6 +205,11 @@ class Reg(Source, Destination, Enum):
     R14 = auto()
     R15 = auto()
 
+    # registers are compared by identity, like other enum members
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = Enum.__hash__
+
     def __str__(self):
         return '%%%s' % self.name.lower()
 
@@ -213,29 +223,22 @@ class Reg(Source, Destination, Enum):
         return
 
 class Addr(Source, Destination):
+    _fields = ('base', 'offset')
     SPACE = 2**8
-    WORD_SIZE = 4
+    WORD_SIZE = 8
 
     def __init__(self, base, offset):
         self.base = base
         self.offset = offset
-        # for interpreter methods
-        self._offset = offset // self.WORD_SIZE
 
     def __str__(self):
         return '%d(%s)' % (self.offset, self.base)
 
-    def __eq__(self, other):
-        return self.base == other.base and self.offset == other.offset
-
-    def __hash__(self):
-        return hash((self.base, offset))
-
     def getVal(self, env):
-        return env.mem[self.base.getVal(env) + self._offset]
+        return env.mem[(self.base.getVal(env) + self.offset) // self.WORD_SIZE]
 
     def setVal(self, val, env):
-        env.mem[self.base.getVal(env) + self._offset] = val
+        env.mem[(self.base.getVal(env) + self.offset) // self.WORD_SIZE] = val
 
     def checkForm(self):
         assert isinstance(self.base, Reg)
@@ -5,11 +5,12 @@ Provides an interpreter for x86, along with some intermediate forms.
 '''
 
 from collections import namedtuple
+from Languages.structural import Structural
 
 ################################
 # Abstract classes #
 
-class SyntaxObject:
+class SyntaxObject(Structural):
     pass
 
 class Source(SyntaxObject):
@@ -24,6 +25,7 @@ class Instruction(SyntaxObject):
 ####
 # Program and Retq
 class Program(SyntaxObject):
+    _fields = ('instrs',)
 
     def __init__(self, *instrs):
         self.instrs = instrs
@@ -47,6 +49,7 @@ class Program(SyntaxObject):
         assert isinstance(self.instrs[-1], Retq)
 
 class Retq(Instruction):
+    _fields = ()
     RETURN_VAR = 'retvar'
 
     def __str__(self):
@@ -61,6 +64,7 @@ class Retq(Instruction):
 ####
 # Types
 class Int(Source):
+    _fields = ('val',)
 
     def __init__(self, val):
         self.val = val
@@ -147,6 +151,7 @@ class Var(Source, Destination):
     def __eq__(self, other):
         if isinstance(other, Var):
             return self.name == other.name
+        return False
     def __hash__(self):
         return hash(self.name)
     
@@ -0,0 +1,117 @@
+################################
+# Interning factory for R and R_uniq
+
+class Interner:
+    ''' Builds the nodes of language (R or R_uniq), handing out the same
+    object for every equal leaf: Int, Var, Fname and Read. With subtrees,
+    every expression is also shared with any equal one built before.
+
+    The methods take the same arguments as the language's constructors, so
+    an Interner can stand in for the language module wherever nodes are
+    built, as parsers.parse_R does. Shared nodes must not be modified.'''
+
+    def __init__(self, language, subtrees = False):
+        self.language = language
+        self.subtrees = subtrees
+        self.table = {}
+        self.read = language.Read()
+
+    def _get(self, key, cls, *args):
+        # a node is keyed by the ids of its children; they can't be reused
+        # for anything else while the node, which holds them, is in the table
+        node = self.table.get(key)
+        if node is None:
+            node = self.table[key] = cls(*args)
+        return node
+
+    def Program(self, functions, body):
+        return self.language.Program(functions, body)
+
+    def Function(self, name, arguments, body):
+        return self.language.Function(name, arguments, body)
+
+    def Fname(self, name):
+        return self._get(('Fname', name), self.language.Fname, name)
+
+    def Var(self, name):
+        return self._get(('Var', name), self.language.Var, name)
+
+    def Int(self, val):
+        return self._get(('Int', val), self.language.Int, val)
+
+    def Read(self):
+        return self.read
+
+    def Negative(self, expr):
+        if not self.subtrees:
+            return self.language.Negative(expr)
+        return self._get(('Negative', id(expr)), self.language.Negative, expr)
+
+    def Sum(self, lhs, rhs):
+        if not self.subtrees:
+            return self.language.Sum(lhs, rhs)
+        return self._get(('Sum', id(lhs), id(rhs)), self.language.Sum, lhs, rhs)
+
+    def Let(self, binding, body):
+        if not self.subtrees:
+            return self.language.Let(binding, body)
+        var, expr = binding
+        return self._get(('Let', id(var), id(expr), id(body)),
+                         self.language.Let, binding, body)
+
+    def Call(self, fname, *args):
+        if not self.subtrees:
+            return self.language.Call(fname, *args)
+        return self._get(('Call', id(fname)) + tuple(id(arg) for arg in args),
+                         self.language.Call, fname, *args)
+
+    def intern(self, node):
+        ''' A copy of node, which may be a whole program, built from interned
+        nodes.'''
+        L = self.language
+        work = [(False, node)]
+        values = []
+        while work:
+            built, node = work.pop()
+            ty = type(node)
+            if ty == L.Program:
+                children = list(node.functions) + [node.body]
+            elif ty == L.Function:
+                children = [node.name] + list(node.arguments) + [node.body]
+            elif ty == L.Let:
+                children = [node.binding[0], node.binding[1], node.body]
+            elif ty == L.Call:
+                children = [node.fname] + list(node.args)
+            elif ty == L.Negative or ty == L.Sum:
+                children = list(node)
+            else:
+                children = []
+            if not built and children:
+                work.append((True, node))
+                work.extend((False, child) for child in reversed(children))
+                continue
+            args = values[len(values)-len(children):]
+            del values[len(values)-len(children):]
+            if ty == L.Program:
+                values.append(self.Program(args[:-1], args[-1]))
+            elif ty == L.Function:
+                values.append(self.Function(args[0], args[1:-1], args[-1]))
+            elif ty == L.Let:
+                values.append(self.Let((args[0], args[1]), args[2]))
+            elif ty == L.Call:
+                values.append(self.Call(*args))
+            elif ty == L.Negative:
+                values.append(self.Negative(*args))
+            elif ty == L.Sum:
+                values.append(self.Sum(*args))
+            elif ty == L.Int:
+                values.append(self.Int(node.val))
+            elif ty == L.Var:
+                values.append(self.Var(node.name))
+            elif ty == L.Fname:
+                values.append(self.Fname(node.name))
+            elif ty == L.Read:
+                values.append(self.Read())
+            else:
+                raise TypeError('intern: %s' % str(node))
+        return values[0]
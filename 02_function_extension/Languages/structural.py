@@ -0,0 +1,89 @@
+################################
+# Structural equality and hashing for the nodes of every language
+
+_VISIT, _BUILD = range(2)
+
+class Structural:
+    ''' Base for syntax objects: two nodes are equal when they are of the
+    same class and the fields named by the class's _fields are equal, and
+    equal nodes hash alike. Fields may hold nodes, lists and tuples of them,
+    sets of names, or plain values.
+
+    Neither method recurses, so trees of any depth can be compared and
+    hashed. The hash is cached on nodes with room for it (an instance
+    __dict__ or a _hash slot), so a node must not be modified once it has
+    been hashed. Classes defining their own __eq__ and __hash__, as the
+    leaves may, are compared with those.'''
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return _equal(self, other)
+
+    def __ne__(self, other):
+        return not _equal(self, other)
+
+    def __hash__(self):
+        return _hash(self)
+
+def _structural(obj):
+    return type(obj).__hash__ is Structural.__hash__
+
+def _values(node):
+    if isinstance(node, tuple):
+        return node
+    return [getattr(node, field) for field in node._fields]
+
+def _equal(a, b):
+    work = [(a, b)]
+    while work:
+        a, b = work.pop()
+        if a is b:
+            continue
+        if type(a) is not type(b):
+            return False
+        if _structural(a):
+            ha = getattr(a, '_hash', None)
+            hb = getattr(b, '_hash', None)
+            if ha is not None and hb is not None and ha != hb:
+                return False
+            work.extend(zip(_values(a), _values(b)))
+        elif type(a) in (list, tuple):
+            if len(a) != len(b):
+                return False
+            work.extend(zip(a, b))
+        elif not a == b:
+            return False
+    return True
+
+def _hash(root):
+    work = [(_VISIT, root, 0)]
+    values = []
+    while work:
+        op, node, n = work.pop()
+        if op == _VISIT:
+            if _structural(node):
+                h = getattr(node, '_hash', None)
+                if h is not None:
+                    values.append(h)
+                    continue
+                children = _values(node)
+            elif type(node) in (list, tuple):
+                children = node
+            elif isinstance(node, (set, frozenset)):
+                values.append(hash(frozenset(node)))
+                continue
+            else:
+                values.append(hash(node))
+                continue
+            work.append((_BUILD, node, len(children)))
+            work.extend((_VISIT, child, 0) for child in reversed(children))
+        else:
+            h = hash((type(node),) + tuple(values[len(values)-n:]))
+            del values[len(values)-n:]
+            if _structural(node):
+                try:
+                    node._hash = h
+                except AttributeError:
+                    pass
+            values.append(h)
+    return values[0]
@@ -0,0 +1,20 @@
+'''
+Benchmarks for the compiler passes. Run from this directory;
+
+    python3 -m bench
+
+times every pass and interpreter on generated programs of up to 10^6 nodes
+and saves the results under bench/results (see bench/__main__.py). The
+benchmarks for single passes are run on their own, e.g.
+
+    python3 -m bench.liveness
+    python3 -m bench.interference
+    python3 -m bench.allocation
+    python3 -m bench.coalesce
+    python3 -m bench.x_interpret
+    python3 -m bench.resolve
+    python3 -m bench.parse
+    python3 -m bench.serialize
+    python3 -m bench.incremental
+    python3 -m bench.parallel
+'''
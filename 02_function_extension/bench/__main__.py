@@ -0,0 +1,200 @@
+################################
+# The whole pipeline, and interpret() on every stage's output, over the
+# programs from bench.generators at sizes from 10^2 to 10^6 nodes.
+#
+# Results are saved to bench/results/<commit>.json; pass --compare with
+# another commit (or a results file) to print how each time has changed.
+# A measurement is skipped at every larger size once it looks like it would
+# take longer than --budget seconds, guessing from how its time has grown so
+# far. X has no call instruction, so select_instr rejects programs with
+# calls (a TypeError) and their later stages are reported as failing.
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+from compiler import uniquify, circleFlatten, select_instr, assign_homes, patch
+from profiling import size
+from bench.generators import GENERATORS
+
+RESULTS = os.path.join(os.path.dirname(__file__), 'results')
+SIZES = [10**k for k in range(2, 7)]
+
+STEPS = [('uniquify', uniquify),
+         ('circleFlatten', circleFlatten),
+         ('select_instr', select_instr),
+         ('assign_homes', assign_homes),
+         ('patch', patch)]
+LANGUAGES = ['R', 'R_uniq', 'C_flat', 'X_var', 'X_approx', 'X']
+MEASURES = ([name for name, step in STEPS] +
+            ['interpret ' + language for language in LANGUAGES])
+
+def commit():
+    ''' The current commit, marked dirty if there are uncommitted changes.'''
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output = True, text = True,
+                              check = True).stdout.strip()
+        dirty = subprocess.run(['git', 'diff', '--quiet', 'HEAD']).returncode
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return head + '-dirty' if dirty else head
+
+def timed(f, *args):
+    ''' (result, seconds, None), or (None, seconds, error) if f raised.'''
+    start = time.perf_counter()
+    try:
+        result = f(*args)
+    except (Exception, RecursionError, MemoryError) as e:
+        return None, time.perf_counter() - start, type(e).__name__
+    return result, time.perf_counter() - start, None
+
+class Budget:
+    ''' Decides which measurements are still worth making at each size.'''
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.history = {}
+
+    def allows(self, measure, n):
+        points = self.history.get(measure, [])
+        if not points:
+            return True
+        (n1, t1), (n2, t2) = ([(1, 0.0)] + points)[-2:]
+        if t2 > self.seconds:
+            return False
+        # at least linear growth, at most cubic
+        exponent = 1.0
+        if len(points) > 1 and t1 > 0 and t2 > 0:
+            exponent = min(3.0, max(1.0, math.log(t2/t1) / math.log(n2/n1)))
+        return t2 * (n / n2) ** exponent <= self.seconds
+
+    def record(self, measure, n, seconds):
+        self.history.setdefault(measure, []).append((n, seconds))
+
+def run(generators, sizes, budget, report):
+    results = []
+    for name in generators:
+        limits = Budget(budget)
+        for n in sizes:
+            if not any(limits.allows(measure, n) for measure in MEASURES):
+                break
+            program = GENERATORS[name](n)
+            row = {'generator': name, 'size': n, 'nodes': size(program),
+                   'seconds': {}, 'errors': {}}
+            stages = [program]
+            for step_name, step in STEPS:
+                if not limits.allows(step_name, n):
+                    break
+                program, seconds, error = timed(step, program)
+                if error:
+                    row['errors'][step_name] = error
+                    break
+                row['seconds'][step_name] = seconds
+                limits.record(step_name, n, seconds)
+                stages.append(program)
+            for language, program in zip(LANGUAGES, stages):
+                measure = 'interpret ' + language
+                if not limits.allows(measure, n):
+                    continue
+                value, seconds, error = timed(program.interpret)
+                if error:
+                    row['errors'][measure] = error
+                    continue
+                row['seconds'][measure] = seconds
+                limits.record(measure, n, seconds)
+            if row['seconds'] or row['errors']:
+                results.append(row)
+                report(row)
+    return results
+
+def load(ref):
+    ''' Results saved for a commit, or from a path.'''
+    if os.path.exists(ref):
+        path = ref
+    else:
+        names = sorted(name for name in os.listdir(RESULTS)
+                       if name.startswith(ref) and name.endswith('.json'))
+        if not names:
+            sys.exit('no results saved for %s' % ref)
+        path = os.path.join(RESULTS, names[-1])
+    with open(path) as fi:
+        return json.load(fi)
+
+def table(rows, baseline = None):
+    ''' For each generator, a line per measurement and a column per size,
+    with the ratio to baseline's time after each if there is one.'''
+    old = {}
+    for row in (baseline or {}).get('results', []):
+        for measure, seconds in row['seconds'].items():
+            old[row['generator'], row['size'], measure] = seconds
+    lines = []
+    for name in dict.fromkeys(row['generator'] for row in rows):
+        group = [row for row in rows if row['generator'] == name]
+        width = 17 if baseline else 10
+        lines.append('%-20s' % name +
+                     ''.join('%*d' % (width, row['nodes']) for row in group))
+        for measure in MEASURES:
+            cells = []
+            for row in group:
+                if measure in row['seconds']:
+                    seconds = row['seconds'][measure]
+                    cell = '%8.2fms' % (seconds * 1e3)
+                    before = old.get((name, row['size'], measure))
+                    if baseline:
+                        cell += ' %6s' % ('%.2fx' % (seconds / before)
+                                          if before else '')
+                else:
+                    cell = row['errors'].get(measure, '-')[:width-1]
+                cells.append('%*s' % (width, cell))
+            lines.append('  %-18s' % measure + ''.join(cells))
+        lines.append('')
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(prog = 'python3 -m bench')
+    parser.add_argument('--generators', nargs = '+', choices = GENERATORS,
+                        default = list(GENERATORS))
+    parser.add_argument('--sizes', nargs = '+', type = int, default = SIZES)
+    parser.add_argument('--budget', type = float, default = 10.0,
+                        help = 'seconds a single measurement may take')
+    parser.add_argument('--compare', metavar = 'COMMIT',
+                        help = 'show times relative to the results saved '
+                        'for COMMIT, or in the given file')
+    parser.add_argument('--no-save', action = 'store_true')
+    args = parser.parse_args()
+
+    baseline = load(args.compare) if args.compare else None
+    report = lambda row: print('%-16s %8d nodes %8.2fs' %
+                               (row['generator'], row['nodes'],
+                                sum(row['seconds'].values())),
+                               file = sys.stderr)
+    # interpret() and some passes recurse over the syntax tree
+    sys.setrecursionlimit(10**7)
+    threading.stack_size(1 << 29)
+    out = []
+    worker = threading.Thread(target = lambda: out.extend(
+        run(args.generators, sorted(args.sizes), args.budget, report)))
+    worker.start()
+    worker.join()
+
+    results = {'commit': commit(),
+               'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+               'python': platform.python_version(),
+               'results': out}
+    print(table(out, baseline))
+    if not args.no_save:
+        os.makedirs(RESULTS, exist_ok = True)
+        path = os.path.join(RESULTS, results['commit'] + '.json')
+        with open(path, 'w') as fi:
+            json.dump(results, fi, indent = 1)
+        print('saved to %s' % path)
+
+if __name__ == '__main__':
+    main()
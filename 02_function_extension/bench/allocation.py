@@ -0,0 +1,78 @@
+################################
+# Compare DSatur allocation against the original allocator, which colored
+# variables in arbitrary set order, on spill.py-style programs.
+
+import string
+import time
+
+from Languages import R, X_var, X_approx
+from compiler import uniquify, circleFlatten, select_instr
+from r_alloc import get_vars, Liveness, calc_interference, saturationAlloc
+
+def set_order_alloc(variables, interference):
+    ''' The original saturationAlloc, kept for comparison.'''
+    variables = set(variables)
+    saturation = {var:set() for var in variables}
+    out = {}
+    rvar = X_var.Var('retvar')
+    out[rvar] = X_approx.Reg.RAX
+    for var in interference.neighbours(rvar):
+        saturation[var] |= {X_approx.Reg.RAX}
+    variables -= {rvar}
+    stackIndex = 0
+    for var in variables:
+        for i in range(3, 16):
+            reg = X_approx.Reg(i)
+            if reg not in saturation[var]:
+                out[var] = reg
+                for v in interference.neighbours(var):
+                    saturation[v] |= {reg}
+                break
+        if var not in out.keys():
+            out[var] = X_approx.Addr(X_approx.Reg.RBP, stackIndex)
+            stackIndex -= X_approx.Addr.WORD_SIZE
+    return out, stackIndex // -X_approx.Addr.WORD_SIZE
+
+def spill_program(names, repeat):
+    ''' spill.py's let-chain over names, repeated so each block's variables
+    die before the next block starts.'''
+    def helper(_vars):
+        body = R.Int(0)
+        for i, var in reversed(list(enumerate(_vars))):
+            body = R.Let((R.Var(var), R.Int(len(_vars) - i)),
+                         R.Sum(R.Var(var), body))
+        return body
+    body = helper(names)
+    for _ in range(repeat - 1):
+        body = R.Let((R.Var('acc'), body), R.Sum(R.Var('acc'), helper(names)))
+    return R.Program([], body)
+
+def x_var(program):
+    return select_instr(circleFlatten(uniquify(program)).main)
+
+def measure(alloc, program):
+    variables = get_vars(program.instrs)
+    interference = calc_interference(Liveness(program.instrs))
+    start = time.perf_counter()
+    homes, k = alloc(variables, interference)
+    elapsed = time.perf_counter() - start
+    spills = sum(isinstance(home, X_approx.Addr) for home in homes.values())
+    return spills, k, elapsed
+
+def main():
+    cases = [('spill.py', string.ascii_lowercase, 1),
+             ('non_spill.py', string.ascii_lowercase[:13], 1),
+             ('spill.py x8', string.ascii_lowercase, 8),
+             ('spill.py x64', string.ascii_lowercase, 64)]
+    print('%-14s %6s | %6s %6s %10s | %6s %6s %10s' %
+          ('program', 'vars', 'spills', 'k', 'time (s)', 'spills', 'k', 'time (s)'))
+    print('%-14s %6s | %-25s | %-25s' % ('', '', 'set order', 'DSatur'))
+    for name, names, repeat in cases:
+        program = x_var(spill_program(names, repeat))
+        old = measure(set_order_alloc, program)
+        new = measure(saturationAlloc, program)
+        print('%-14s %6d | %6d %6d %10.4f | %6d %6d %10.4f' %
+              ((name, len(get_vars(program.instrs))) + old + new))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+################################
+# Measure the effect of move coalescing in assign_homes on the size and
+# interpretation time of the final x86 programs.
+
+import string
+import time
+
+from compiler import assign_homes, patch
+from bench.allocation import spill_program, x_var
+
+def timed(f, *args):
+    start = time.perf_counter()
+    out = f(*args)
+    return out, time.perf_counter() - start
+
+def main(repeats=(1, 8, 64)):
+    print('%-14s | %8s %10s | %8s %10s' %
+          ('program', 'instrs', 'run (s)', 'instrs', 'run (s)'))
+    print('%-14s | %-19s | %-19s' % ('', 'no coalescing', 'coalescing'))
+    for repeat in repeats:
+        program = x_var(spill_program(string.ascii_lowercase, repeat))
+        row = []
+        for coalescing in (False, True):
+            x86 = patch(assign_homes(program, coalescing))
+            _, elapsed = timed(x86.interpret)
+            row += [len(x86.instrs), elapsed]
+        print('%-14s | %8d %10.4f | %8d %10.4f' %
+              (('spill.py x%d' % repeat,) + tuple(row)))
+
+if __name__ == '__main__':
+    main()
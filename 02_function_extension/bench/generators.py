@@ -0,0 +1,65 @@
+################################
+# Synthetic R programs of a given size, each stressing a different part of
+# the compiler. Every generator takes a node count n and returns an R.Program
+# of about n nodes (as counted by profiling.size) with no (read)s, so it can
+# be interpreted without input.
+
+from Languages import R
+
+def let_chain(n):
+    ''' Lets nested n/4 deep, each adding its variable to the rest.'''
+    body = R.Int(0)
+    for i in range(max(1, n // 4)):
+        var = R.Var('x%d' % i)
+        body = R.Let((var, R.Int(i)), R.Sum(var, body))
+    return R.Program([], body)
+
+def wide_sum(n):
+    ''' A balanced tree of sums over 2n/5 constants, every other one negated.'''
+    terms = [R.Int(i) if i % 2 else R.Negative(R.Int(i))
+             for i in range(max(2, 2 * n // 5))]
+    while len(terms) > 1:
+        pairs = [R.Sum(a, b) for a, b in zip(terms[::2], terms[1::2])]
+        if len(terms) % 2:
+            pairs.append(terms[-1])
+        terms = pairs
+    return R.Program([], terms[0])
+
+def interfering(n):
+    ''' n/4 variables all bound before any is used, so that every one is
+    live at once and interferes with every other.'''
+    count = max(2, n // 4)
+    body = R.Var('v0')
+    for i in range(1, count):
+        body = R.Sum(R.Var('v%d' % i), body)
+    for i in reversed(range(count)):
+        body = R.Let((R.Var('v%d' % i), R.Int(i)), body)
+    return R.Program([], body)
+
+def many_functions(n):
+    ''' n/12 small independent functions, main adding up a call to each.'''
+    count = max(1, n // 12)
+    a, b, c = R.Var('a'), R.Var('b'), R.Var('c')
+    fs = [R.Function(R.Fname('f%d' % i), [a, b],
+                     R.Let((c, R.Sum(a, b)), R.Sum(c, R.Negative(b))))
+          for i in range(count)]
+    body = R.Int(0)
+    for i in range(count):
+        body = R.Sum(R.Call(R.Fname('f%d' % i), R.Int(i), R.Int(1)), body)
+    return R.Program(fs, body)
+
+def call_nesting(n):
+    ''' A chain of n/7 functions, each calling the one before it, so that
+    running main nests every call.'''
+    count = max(1, n // 7)
+    a = R.Var('a')
+    fs = [R.Function(R.Fname('f0'), [a], a)]
+    for i in range(1, count):
+        fs.append(R.Function(R.Fname('f%d' % i), [a],
+                             R.Sum(R.Call(R.Fname('f%d' % (i-1)),
+                                          R.Sum(a, R.Int(1))),
+                                   R.Int(i))))
+    return R.Program(fs, R.Call(R.Fname('f%d' % (count-1)), R.Int(0)))
+
+GENERATORS = {f.__name__: f for f in (let_chain, wide_sum, interfering,
+                                      many_functions, call_nesting)}
@@ -0,0 +1,50 @@
+################################
+# Recompiling a many-function program after editing one function, with and
+# without the per-function cache in flatten_program.
+
+import shutil
+import tempfile
+import time
+
+from Languages import R
+from compiler import uniquify, circleFlatten, flatten_program
+from cache import Cache
+
+def program(functions, size = 20, edited = -1):
+    ''' functions functions of size lets each, every one calling the previous
+    one. The function numbered edited gets a different constant.'''
+    fs = []
+    for i in range(functions):
+        body = R.Call(R.Fname('f%d' % (i-1)), R.Var('a')) if i else R.Var('a')
+        for j in range(size):
+            body = R.Let((R.Var('x%d' % j), R.Int(j + (i == edited))),
+                         R.Sum(R.Var('x%d' % j), body))
+        fs.append(R.Function(R.Fname('f%d' % i), [R.Var('a')], body))
+    return R.Program(fs, R.Call(R.Fname('f%d' % (functions-1)), R.Int(1)))
+
+def timed(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+def main():
+    print('%9s | %10s %10s %10s %10s %10s' %
+          ('functions', 'whole', 'cold', 'from disk', 'unchanged', 'one edit'))
+    for n in (50, 200, 500):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = Cache(directory)
+            base, edit = program(n), program(n, edited = n // 2)
+            whole = timed(lambda: circleFlatten(uniquify(base)))
+            cold = timed(lambda: flatten_program(base, cache))
+            # a new process, with nothing loaded yet
+            disk = timed(lambda: flatten_program(base, Cache(directory)))
+            warm = timed(lambda: flatten_program(base, cache))
+            edited = timed(lambda: flatten_program(edit, cache))
+        finally:
+            shutil.rmtree(directory)
+        print('%9d | %8.1fms %8.1fms %8.1fms %8.1fms %8.1fms' %
+              (n, whole*1e3, cold*1e3, disk*1e3, warm*1e3, edited*1e3))
+
+if __name__ == '__main__':
+    main()
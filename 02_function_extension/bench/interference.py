@@ -0,0 +1,32 @@
+################################
+# Time interference graph construction for programs in which every
+# temporary is live at once, the densest case for calc_interference.
+
+import time
+
+from Languages import X_var
+from r_alloc import Liveness, calc_interference
+
+def all_live(n):
+    ''' Define n temporaries, then add them all to retvar.'''
+    instrs = [X_var.Movq(X_var.Int(i), X_var.Var('t%d' % i)) for i in range(n)]
+    instrs.append(X_var.Movq(X_var.Int(0), X_var.Var('retvar')))
+    instrs += [X_var.Addq(X_var.Var('t%d' % i), X_var.Var('retvar'))
+               for i in range(n)]
+    instrs.append(X_var.Retq())
+    return tuple(instrs)
+
+def main(sizes=(10**3, 3*10**3, 10**4)):
+    print('%10s %12s %12s %14s' % ('temps', 'edges', 'liveness (s)', 'interference (s)'))
+    for n in sizes:
+        instrs = all_live(n)
+        start = time.perf_counter()
+        liveness = Liveness(instrs)
+        middle = time.perf_counter()
+        graph = calc_interference(liveness)
+        end = time.perf_counter()
+        edges = sum(row.bit_count() for row in graph.rows) // 2
+        print('%10d %12d %12.4f %14.4f' % (n, edges, middle - start, end - middle))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+################################
+# Compare the bitset liveness analysis in r_alloc against the original
+# set-based implementation on long straight-line X_var programs.
+
+import time
+
+from Languages import X_var
+from r_alloc import Liveness
+
+def set_liveness(instrs):
+    ''' The original annotate_liveness, kept for comparison.'''
+    out = []
+    live = set()
+    for instr in reversed(instrs):
+        out.insert(0, (instr, live.copy()))
+        ty = type(instr)
+        if ty == X_var.Retq:
+            live |= {X_var.Var('retvar')}
+        if ty in (X_var.Movq,):
+            if type(instr.dest) == X_var.Var:
+                live -= {instr.dest}
+        elif ty in (X_var.Negq, X_var.Addq, X_var.Subq):
+            if type(instr.dest) == X_var.Var:
+                live |= {instr.dest}
+        if ty in (X_var.Movq, X_var.Addq, X_var.Subq):
+            if type(instr.src) == X_var.Var:
+                live |= {instr.src}
+    return out
+
+def straight_line(n, width=8):
+    ''' A program of about n instructions keeping roughly width variables live.'''
+    instrs = [X_var.Movq(X_var.Int(0), X_var.Var('retvar'))]
+    for i in range((n-2) // 2):
+        instrs.append(X_var.Movq(X_var.Int(i), X_var.Var('t%d' % i)))
+        if i >= width:
+            instrs.append(X_var.Addq(X_var.Var('t%d' % (i-width)),
+                                     X_var.Var('retvar')))
+    instrs.append(X_var.Retq())
+    return instrs
+
+def timed(f, *args):
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+def main(sizes=(10**4, 10**5)):
+    print('%10s %12s %12s %8s' % ('instrs', 'sets (s)', 'bitsets (s)', 'speedup'))
+    for n in sizes:
+        instrs = straight_line(n)
+        old = timed(set_liveness, instrs)
+        new = timed(Liveness, instrs)
+        print('%10d %12.4f %12.4f %7.1fx' % (len(instrs), old, new, old / new))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+################################
+# Flattening a many-function program serially and across worker processes.
+# The speedup is bounded by the number of cores, printed first.
+
+import os
+import time
+
+from compiler import flatten_program
+from bench.incremental import program
+
+def timed(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+def main():
+    print('cores: %d' % os.cpu_count())
+    print('%9s | %10s %10s %10s %10s' % ('functions', 'serial', '1 worker',
+                                         '2 workers', '4 workers'))
+    for n in (100, 500):
+        p = program(n, size = 50)
+        times = [timed(lambda: flatten_program(p))]
+        for workers in (1, 2, 4):
+            times.append(timed(lambda: flatten_program(p, workers = workers)))
+        print('%9d | %s' % (n, ' '.join('%8.1fms' % (t*1e3) for t in times)))
+
+if __name__ == '__main__':
+    main()
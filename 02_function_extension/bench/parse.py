@@ -0,0 +1,86 @@
+################################
+# Tokenizer throughput, in MB/s, of the original character-at-a-time
+# parse_sexpr against the regex tokenizer, from a string and from a file, and
+# the time parse_R takes per node on let-chains of increasing depth.
+
+import os
+import tempfile
+import time
+
+from parsers import parse_sexpr, build_sexpr, tokenize_file, parse_R
+
+def char_parse_sexpr(source):
+    ''' The original parse_sexpr, kept for comparison.'''
+    out = [[]]
+    token = ''
+    for char in source:
+        if char in '([':
+            if token:
+                out[-1].append(token)
+            out.append([])
+            token = ''
+        elif char in '])':
+            if token:
+                out[-1].append(token)
+            l = out.pop()
+            out[-1].append(l)
+            token = ''
+        else:
+            if char in ' \t\n':
+                if token:
+                    out[-1].append(token)
+                    token = ''
+            else:
+                token += char
+    if token:
+        out[-1].append(token)
+    assert len(out) == 1
+    return out[0]
+
+def let_source(size, name = 'x'):
+    ''' About size characters of s-expressions, one short let per line.'''
+    block = '(let ([%s%%d 12345]) (+ %s%%d (let ([y 6789]) (- y))))' % (name, name)
+    lines = []
+    length = 0
+    while length < size:
+        lines.append(block % (len(lines), len(lines)))
+        length += len(lines[-1]) + 1
+    return '(program ()\n%s)\n' % '\n'.join(lines)
+
+def throughput(f, source, size):
+    start = time.perf_counter()
+    f(source)
+    return size / (time.perf_counter() - start) / 1e6
+
+def main():
+    print('%-12s %4s | %12s %12s %12s' %
+          ('names', 'MB', 'char loop', 'regex', 'file'))
+    for label, name in [('short', 'x'), ('long', 'accumulated-sum-rhs-')]:
+        for mb in (1, 8):
+            source = let_source(mb * 10**6, name)
+            size = len(source)
+            with tempfile.NamedTemporaryFile('w', suffix='.r',
+                                             delete=False) as fi:
+                fi.write(source)
+            try:
+                old = throughput(char_parse_sexpr, source, size)
+                new = throughput(parse_sexpr, source, size)
+                disk = throughput(lambda path: build_sexpr(tokenize_file(path)),
+                                  fi.name, size)
+            finally:
+                os.remove(fi.name)
+            print('%-12s %4d | %7.1f MB/s %7.1f MB/s %7.1f MB/s' %
+                  (label, mb, old, new, disk))
+    print()
+    print('%8s | %12s %12s' % ('depth', 'parse_R', 'per node'))
+    for depth in (10**3, 10**4, 10**5):
+        sexpr = parse_sexpr('(program () %s0%s)' %
+                            ('(let ([x 1]) (+ x ' * depth, '))' * depth))[0]
+        start = time.perf_counter()
+        parse_R(sexpr)
+        elapsed = time.perf_counter() - start
+        print('%8d | %10.3fs %10.2fus' % (depth, elapsed,
+                                          elapsed / (4 * depth) * 1e6))
+
+if __name__ == '__main__':
+    main()
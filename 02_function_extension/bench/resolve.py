@@ -0,0 +1,54 @@
+################################
+# Compare Program.interpret() against the slot-resolved interpreter on long
+# let-chains and on call-heavy programs.
+
+import sys
+import time
+
+from Languages import R
+from compiler import uniquify
+from resolve import resolve
+
+def let_chain(depth):
+    body = R.Int(0)
+    for i in range(depth):
+        body = R.Let((R.Var('x%d' % (i % 26)), R.Int(i)),
+                     R.Sum(R.Var('x%d' % (i % 26)), body))
+    return R.Program([], body)
+
+def call_chain(calls, functions=20):
+    ''' A program calling a small function many times, with many other
+    functions in scope.'''
+    fs = [R.Function(R.Fname('f%d' % i), [R.Var('a'), R.Var('b')],
+                     R.Let((R.Var('c'), R.Sum(R.Var('a'), R.Var('b'))),
+                           R.Sum(R.Var('c'), R.Negative(R.Var('b')))))
+          for i in range(functions)]
+    body = R.Int(0)
+    for i in range(calls):
+        body = R.Let((R.Var('acc'), R.Call(R.Fname('f%d' % (i % functions)),
+                                           R.Int(i), R.Int(1))),
+                     R.Sum(R.Var('acc'), body))
+    return R.Program(fs, body)
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return result, time.perf_counter() - start
+
+def main():
+    sys.setrecursionlimit(100000)
+    print('%-18s | %12s %12s %12s %8s' %
+          ('program', 'interpret', 'resolve', 'run', 'speedup'))
+    for name, program in [('let chain 1000', let_chain(1000)),
+                          ('let chain 4000', let_chain(4000)),
+                          ('call chain 1000', call_chain(1000)),
+                          ('uniq calls 1000', uniquify(call_chain(1000)))]:
+        old, slow = timed(program.interpret)
+        run, build = timed(lambda: resolve(program))
+        new, fast = timed(run)
+        assert old == new
+        print('%-18s | %10.2fms %10.2fms %10.2fms %7.1fx' %
+              (name, slow*1e3, build*1e3, fast*1e3, slow / fast))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+################################
+# Size and load time of the binary format for every stage of a large
+# program, against re-parsing the R source or re-running the pipeline up to
+# that stage.
+
+import string
+import time
+
+import serialize
+from compiler import uniquify, circleFlatten, select_instr, assign_homes, patch
+from parsers import parse_R_from_string
+from bench.allocation import spill_program
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return result, time.perf_counter() - start
+
+def stages(program):
+    ''' Each stage's output, and the time taken to get there from R.'''
+    steps = [('R_uniq', uniquify), ('C_flat', circleFlatten),
+             ('X_var', lambda p: select_instr(p.main)),
+             ('X_approx', assign_homes), ('X', patch)]
+    total = 0
+    for name, step in steps:
+        program, elapsed = timed(lambda: step(program))
+        total += elapsed
+        yield name, program, total
+
+def main(repeat=64):
+    program = spill_program(string.ascii_lowercase, repeat)
+    source = str(program)
+    _, parse = timed(lambda: parse_R_from_string(source))
+    print('%-9s | %9s %9s | %10s %10s | %10s %9s' %
+          ('stage', 'text', 'binary', 'dumps', 'loads', 'rebuild', 'speedup'))
+    rows = [('R', program, parse)]
+    rows.extend(stages(program))
+    for name, prog, rebuild in rows:
+        data, dump = timed(lambda: serialize.dumps(prog))
+        _, load = timed(lambda: serialize.loads(data))
+        print('%-9s | %8dB %8dB | %8.1fms %8.1fms | %8.1fms %8.1fx' %
+              (name, len(str(prog)), len(data), dump*1e3, load*1e3,
+               rebuild*1e3, rebuild / load))
+
+if __name__ == '__main__':
+    main()
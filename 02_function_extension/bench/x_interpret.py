@@ -0,0 +1,34 @@
+################################
+# Compare X.Program.interpret() against the pre-decoded closures from
+# compile_to_closure() on spill.py-style programs.
+
+import string
+import time
+
+from compiler import assign_homes, patch
+from bench.allocation import spill_program, x_var
+
+def timed(f, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = f()
+    return result, (time.perf_counter() - start) / runs
+
+def main(runs=50):
+    cases = [('spill.py', string.ascii_lowercase, 1),
+             ('spill.py x8', string.ascii_lowercase, 8),
+             ('spill.py x64', string.ascii_lowercase, 64)]
+    print('%-14s %7s | %12s %12s %12s %8s' %
+          ('program', 'instrs', 'interpret', 'compile', 'closure', 'speedup'))
+    for name, names, repeat in cases:
+        program = patch(assign_homes(x_var(spill_program(names, repeat))))
+        old, slow = timed(program.interpret, runs)
+        run, build = timed(program.compile_to_closure, 1)
+        new, fast = timed(run, runs)
+        assert old == new
+        print('%-14s %7d | %10.1fus %10.1fus %10.1fus %7.1fx' %
+              (name, len(program.instrs), slow*1e6, build*1e6, fast*1e6,
+               slow / fast))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+################################
+# Content-addressed compilation cache
+#
+# Entries are keyed by a hash of the serialized input program together with
+# COMPILER_VERSION, a hash of the compiler's own source, so editing any pass
+# invalidates everything compiled by the old one. Each entry is a single file
+# holding every stage's output in the binary format from serialize.py.
+
+import hashlib
+import os
+import struct
+import tempfile
+from collections import OrderedDict
+
+import serialize
+
+def _compiler_version():
+    import compiler, optimize, r_alloc, Languages
+    digest = hashlib.sha256(b'%d' % serialize.VERSION)
+    paths = [compiler.__file__, optimize.__file__, r_alloc.__file__,
+             serialize.__file__]
+    languages = os.path.dirname(Languages.__file__)
+    paths += sorted(os.path.join(languages, name)
+                    for name in os.listdir(languages) if name.endswith('.py'))
+    for path in paths:
+        with open(path, 'rb') as fi:
+            digest.update(fi.read())
+    return digest.hexdigest()
+
+COMPILER_VERSION = None
+
+def digest(data, *context):
+    ''' Hash of data, the strings in context and COMPILER_VERSION.'''
+    global COMPILER_VERSION
+    if COMPILER_VERSION is None:
+        COMPILER_VERSION = _compiler_version()
+    digest = hashlib.sha256(COMPILER_VERSION.encode())
+    digest.update(data)
+    for string in context:
+        digest.update(b'\0' + string.encode())
+    return digest.hexdigest()
+
+def fingerprint(program, *context):
+    ''' Structural hash of a program, or of any node, under this compiler.'''
+    return digest(serialize.dumps(program), *context)
+
+class Cache:
+    ''' Pipeline results on disk, evicting the least recently used entries
+    once their total size goes over max_bytes.
+
+    Recency is kept in the files' modification times, so it carries over to
+    the next process using the same directory. The last `memory` entries
+    used are also kept loaded; results handed out from there are shared, so
+    callers must not modify them.'''
+
+    SUFFIX = '.irc'
+
+    def __init__(self, directory, max_bytes = 64 * 2**20, memory = 1024):
+        os.makedirs(directory, exist_ok = True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory = memory
+        self.loaded = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+        # key -> size, least recently used first
+        self.entries = OrderedDict()
+        listing = []
+        for name in os.listdir(directory):
+            if name.endswith(self.SUFFIX):
+                stat = os.stat(os.path.join(directory, name))
+                listing.append((stat.st_mtime, name[:-len(self.SUFFIX)],
+                                stat.st_size))
+        for mtime, key, size in sorted(listing):
+            self.entries[key] = size
+        self.size = sum(self.entries.values())
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key):
+        ''' The list of stage outputs stored under key, or None.'''
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        if key in self.loaded:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            self.loaded.move_to_end(key)
+            return self.loaded[key]
+        try:
+            with open(self.path(key), 'rb') as fi:
+                data = fi.read()
+            count, = struct.unpack_from('<I', data)
+            lengths = struct.unpack_from('<%dQ' % count, data, 4)
+            pos = 4 + 8 * count
+            results = []
+            for length in lengths:
+                results.append(serialize.loads(data[pos:pos+length]))
+                pos += length
+            if not results or pos != len(data):
+                raise serialize.FormatError('bad cache entry')
+        except (OSError, struct.error, IndexError, ValueError,
+                serialize.FormatError):
+            # removed or damaged by someone else
+            self.discard(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        os.utime(self.path(key))
+        self.remember(key, results)
+        return results
+
+    def remember(self, key, results):
+        self.loaded[key] = results
+        self.loaded.move_to_end(key)
+        while len(self.loaded) > self.memory:
+            self.loaded.popitem(last = False)
+
+    def put(self, key, results):
+        blobs = [serialize.dumps(result) for result in results]
+        data = struct.pack('<I%dQ' % len(blobs), len(blobs),
+                           *(len(blob) for blob in blobs))
+        data += b''.join(blobs)
+        # written under a temporary name so readers never see half an entry
+        fd, tmp = tempfile.mkstemp(dir = self.directory)
+        with os.fdopen(fd, 'wb') as fi:
+            fi.write(data)
+        os.replace(tmp, self.path(key))
+        self.size += len(data) - self.entries.pop(key, 0)
+        self.entries[key] = len(data)
+        self.remember(key, results)
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            self.discard(next(iter(self.entries)))
+            self.evictions += 1
+
+    def discard(self, key):
+        self.size -= self.entries.pop(key, 0)
+        self.loaded.pop(key, None)
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size}
@@ -1,78 +1,226 @@
 
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from Languages import R, R_uniq, C_flat, X_var, X_approx, X
-from functools import reduce
+import parsers
+import serialize
+from cache import fingerprint, digest
+from optimize import (partial_eval, eliminate_common_subexprs,
+                      eliminate_dead_assigns, eliminate_dead_instrs, peephole)
 
 ########
 # Uniquify
 
-def uniquify(expr, used_v = {}, used_f = {}):
-    ''' Naming convention: variable name followed by number of used var names.'''
+def uniquify(expr, used_v = None, used_f = None):
+    ''' Naming convention: variable name followed by number of used var names.
+
+    The traversal uses an explicit stack rather than recursion, so deeply
+    nested programs do not hit the interpreter's recursion limit. Scopes are
+    tracked by pushing and popping shadow records on a single environment
+    instead of copying it at every binding.'''
+    used_v = {} if used_v is None else used_v.copy()
+    used_f = {} if used_f is None else used_f
     ty = type(expr)
     if ty == R.Program:
-        fcns = []
+        names = []
         for f in expr.functions:
             name = f.name.name
             used_f[name] = used_f.get(name, 0) + 1
-            name = name + '-f' + str(used_f[name])
-            fcns.append(R_uniq.Function(R_uniq.Fname(name),
-                                        f.arguments,
-                                        f.body))
-        for f in fcns:
-            args = []
-            local_v = used_v.copy()
-            for arg in f.arguments:
-                local_v[arg.name] = local_v.get(arg.name, 0) + 1
-                name = arg.name + '-v' + str(local_v[arg.name])
-                args.append(R_uniq.Var(name))
-            f.arguments = args
-            f.body = uniquify(f.body, local_v, used_f)
-        return R_uniq.Program(fcns, uniquify(expr.body, used_v, used_f))
-    # I/0
-    elif ty == R.Read:
-        return R_uniq.Read()
-    # Type
-    elif ty == R.Int:
-        return R_uniq.Int(expr.val)
-    # Operators
-    elif ty == R.Negative:
-        return R_uniq.Negative(uniquify(expr.expr, used_v, used_f))
-    elif ty == R.Sum:
-        return R_uniq.Sum(uniquify(expr.lhs, used_v, used_f),
-                          uniquify(expr.rhs, used_v, used_f))
-    # Variables
-    elif ty == R.Var:
-        try:
-            name = expr.name + '-v' + str(used_v[expr.name])
-            return R_uniq.Var(name)
-        except KeyError as e:
-            raise R.VarNotDefined from e
-    elif ty == R.Let:
-        new = used_v.copy()
-        var, subexpr = expr.binding
-        name = var.name
-        if name in used_v:
-            new[name] += 1
+            names.append(name + '-f' + str(used_f[name]))
+        fcns = [_uniquify_function(f, name, used_v, used_f)
+                for f, name in zip(expr.functions, names)]
+        return R_uniq.Program(fcns, _uniquify_expr(expr.body, used_v, used_f))
+    return _uniquify_expr(expr, used_v, used_f)
+
+def _uniquify_function(f, name, used_v, used_f):
+    ''' Uniquify a single R.Function, renamed to name. used_f must already
+    hold every function in the program.'''
+    shadows = []
+    args = []
+    for arg in f.arguments:
+        shadows.append((arg.name, used_v.get(arg.name)))
+        used_v[arg.name] = used_v.get(arg.name, 0) + 1
+        args.append(R_uniq.Var(arg.name + '-v' + str(used_v[arg.name])))
+    body = _uniquify_expr(f.body, used_v, used_f)
+    _unshadow(used_v, shadows)
+    return R_uniq.Function(R_uniq.Fname(name), args, body)
+
+def _unshadow(env, shadows):
+    ''' Restore the bindings recorded in shadows, most recent first.'''
+    while shadows:
+        name, old = shadows.pop()
+        if old is None:
+            del env[name]
         else:
-            new[name] = 0
-        new_binding = (R_uniq.Var(name + '-v' + str(new[name])),
-                       uniquify(subexpr, used_v, used_f))
-        return R_uniq.Let(new_binding,
-                          uniquify(expr.body, new, used_f))
-    elif ty == R.Call:
-        args = [uniquify(arg, used_v, used_f) for arg in expr.args]
-        try:
-            name = expr.fname.name + '-f' + str(used_f[expr.fname.name])
-            name = R_uniq.Fname(name)
-            return R_uniq.Call(name, *args)
-        except KeyError as e:
-            raise R.FunctionNotDefined from e
-    else:
-        raise TypeError('uniquify: %s' % str(expr))
+            env[name] = old
+
+# work items for _uniquify_expr
+_VISIT, _BIND, _UNBIND, _BUILD = range(4)
+
+def _uniquify_expr(expr, used_v, used_f):
+    ''' Uniquify a single expression. used_v is modified in place; each
+    binding is undone when its scope closes.'''
+    work = [(_VISIT, expr)]
+    values = []
+    shadows = []
+    # the last suffix handed out for each name; unlike used_v this is never
+    # rolled back, so lets that are not nested still get distinct names
+    fresh = dict(used_v)
+    while work:
+        op, item = work.pop()
+        if op == _VISIT:
+            ty = type(item)
+            # I/0
+            if ty == R.Read:
+                values.append(R_uniq.Read())
+            # Type
+            elif ty == R.Int:
+                values.append(R_uniq.Int(item.val))
+            # Operators
+            elif ty == R.Negative:
+                work.append((_BUILD, item))
+                work.append((_VISIT, item.expr))
+            elif ty == R.Sum:
+                work.append((_BUILD, item))
+                work.append((_VISIT, item.rhs))
+                work.append((_VISIT, item.lhs))
+            # Variables
+            elif ty == R.Var:
+                try:
+                    name = item.name + '-v' + str(used_v[item.name])
+                    values.append(R_uniq.Var(name))
+                except KeyError as e:
+                    raise R.VarNotDefined from e
+            elif ty == R.Let:
+                var, subexpr = item.binding
+                # the binding is visited in the enclosing scope, the body
+                # in the new one
+                work.append((_BUILD, item))
+                work.append((_UNBIND, None))
+                work.append((_VISIT, item.body))
+                work.append((_BIND, var.name))
+                work.append((_VISIT, subexpr))
+            elif ty == R.Call:
+                if item.fname.name not in used_f:
+                    raise R.FunctionNotDefined(item.fname.name)
+                work.append((_BUILD, item))
+                for arg in reversed(item.args):
+                    work.append((_VISIT, arg))
+            else:
+                raise TypeError('uniquify: %s' % str(item))
+        elif op == _BIND:
+            shadows.append((item, used_v.get(item)))
+            if item in fresh:
+                fresh[item] += 1
+            else:
+                fresh[item] = 0
+            used_v[item] = fresh[item]
+            values.append(R_uniq.Var(item + '-v' + str(used_v[item])))
+        elif op == _UNBIND:
+            name, old = shadows.pop()
+            if old is None:
+                del used_v[name]
+            else:
+                used_v[name] = old
+        else:
+            ty = type(item)
+            if ty == R.Negative:
+                values.append(R_uniq.Negative(values.pop()))
+            elif ty == R.Sum:
+                rhs = values.pop()
+                lhs = values.pop()
+                values.append(R_uniq.Sum(lhs, rhs))
+            elif ty == R.Let:
+                body = values.pop()
+                var = values.pop()
+                subexpr = values.pop()
+                values.append(R_uniq.Let((var, subexpr), body))
+            else:
+                n = len(item.args)
+                args = values[len(values)-n:]
+                del values[len(values)-n:]
+                name = item.fname.name + '-f' + str(used_f[item.fname.name])
+                values.append(R_uniq.Call(R_uniq.Fname(name), *args))
+    assert len(values) == 1
+    return values[0]
 
 
 ########
 # Flatten
 
+class Emitter:
+    ''' Shared instruction buffer and variable set for circleFlatten.
+
+    Every subexpression appends to the same list, so flattening is linear in
+    the size of the program. Temporaries are numbered rather than derived
+    from the name of the enclosing destination, so their names stay short.'''
+
+    def __init__(self):
+        self.instrs = []
+        self.variables = set()
+        self.temps = 0
+
+    def temp(self, kind):
+        self.temps += 1
+        return kind + '-' + str(self.temps)
+
+    def assign(self, dest, expr):
+        self.variables.add(dest)
+        self.instrs.append(C_flat.Assign(C_flat.Var(dest), expr))
+
+    def flatten(self, expr, ans):
+        ''' Emit instructions that store the value of expr in ans.'''
+        work = [(expr, ans)]
+        while work:
+            expr, ans = work.pop()
+            ty = type(expr)
+            # pending instruction, emitted once its operands are computed
+            if ty == C_flat.Assign:
+                self.assign(expr.var.name, expr.expr)
+            # I/0
+            elif ty == R_uniq.Read:
+                self.assign(ans, C_flat.Read())
+            # Type
+            elif ty == R_uniq.Int:
+                self.assign(ans, C_flat.Int(expr.val))
+            # Operators
+            elif ty == R_uniq.Negative:
+                work.append((C_flat.Assign(C_flat.Var(ans),
+                                           C_flat.Negative(C_flat.Var(ans))),
+                             None))
+                work.append((expr.expr, ans))
+            elif ty == R_uniq.Sum:
+                helper = self.temp('sum-rhs')
+                work.append((C_flat.Assign(C_flat.Var(ans),
+                                           C_flat.Sum(C_flat.Var(ans),
+                                                      C_flat.Var(helper))),
+                             None))
+                work.append((expr.rhs, helper))
+                work.append((expr.lhs, ans))
+            # Variables
+            elif ty == R_uniq.Var:
+                self.variables.add(expr.name)
+                self.assign(ans, C_flat.Var(expr.name))
+            elif ty == R_uniq.Let:
+                var, subexpr = expr.binding
+                work.append((expr.body, ans))
+                work.append((subexpr, var.name))
+            elif ty == R_uniq.Call:
+                name, args = expr.fname, expr.args
+                arg_names = [self.temp('arg') for arg in args]
+                work.append((C_flat.Assign(C_flat.Var(ans),
+                                           C_flat.Call(name,
+                                                       *[C_flat.Var(arg)
+                                                         for arg in arg_names])),
+                             None))
+                for arg, arg_name in reversed(list(zip(args, arg_names))):
+                    work.append((arg, arg_name))
+            else:
+                raise Exception('circleFlatten: %s' % str(expr))
+
 def circleFlatten(expr, ans=None):
     ty = type(expr)
     # idea: functions are translated exactly as normal, just with args
@@ -86,60 +234,19 @@ def circleFlatten(expr, ans=None):
     elif ty == R_uniq.Function:
         assert ans == None
         ans = 'retvar'
-        body = circleFlatten(expr.body, ans)
-        return C_flat.Function(expr.name, expr.arguments,
-                               {ans}|body.variables,
-                               *body.instrs + [C_flat.Return(C_flat.Var(ans))])
-    # I/0
-    elif ty == R_uniq.Read:
-        return C_flat.Function(None, set(), {ans},
-                               C_flat.Assign(C_flat.Var(ans), C_flat.Read()))
-    # Type
-    elif ty == R_uniq.Int:
-        return C_flat.Function(None, set(), {ans},
-                              C_flat.Assign(C_flat.Var(ans), C_flat.Int(expr.val)))
-    elif ty == R_uniq.Negative:
-        subexpr = circleFlatten(expr.expr, ans)
-        return C_flat.Function(None, set(),
-                               subexpr.variables,
-                               *subexpr.instrs +
-                               [C_flat.Assign(C_flat.Var(ans),
-                                              C_flat.Negative(C_flat.Var(ans)))])
-    elif ty == R_uniq.Sum:
-        helper = ans + '-sum-rhs'
-        lhs, rhs = (circleFlatten(expr.lhs, ans),
-                    circleFlatten(expr.rhs, helper))
-        return C_flat.Function(None, set(),
-                               lhs.variables|rhs.variables,
-                               *lhs.instrs+rhs.instrs+
-                               [C_flat.Assign(C_flat.Var(ans),
-                                              C_flat.Sum(C_flat.Var(ans),
-                                                         C_flat.Var(helper)))])
-    elif ty == R_uniq.Var:
-        return C_flat.Function(None, set(),
-                               {ans, expr.name},
-                               C_flat.Assign(C_flat.Var(ans),
-                                             C_flat.Var(expr.name)))
-    elif ty == R_uniq.Let:
-        var, subexpr = expr.binding
-        bindingExpr = circleFlatten(subexpr, var.name)
-        bodyExpr = circleFlatten(expr.body, ans)
-        return C_flat.Function(None, set(),
-                               bindingExpr.variables|bodyExpr.variables,
-                               *bindingExpr.instrs + bodyExpr.instrs)
-    elif ty == R_uniq.Call:
-        name, args = expr.name, expr.args
-        arg_stmts = [circleFlatten(arg, name + '-arg-' + str(i))
-                     for i, arg in enumerate(args)]
-        return C_flat.Function(None, set(),
-                               reduce(lambda a,b:a|b,
-                                      [arg.variables for arg in arg_stmts],
-                                      set()),
-                               *(reduce(lambda a,b:a+b, (arg.instrs for arg in arg_stmts), []) +
-                                 C_flat.Call(name, *[name + '-arg-' + str(i)
-                                                     for i, _ in enumerate(args)])))
+        emitter = Emitter()
+        emitter.flatten(expr.body, ans)
+        emitter.variables.add(ans)
+        emitter.instrs.append(C_flat.Return(C_flat.Var(ans)))
+        return C_flat.Function(expr.name,
+                               [arg.name for arg in expr.arguments],
+                               emitter.variables,
+                               *emitter.instrs)
     else:
-        raise Exception('circleFlatten: %s' % str(expr))
+        emitter = Emitter()
+        emitter.flatten(expr, ans)
+        return C_flat.Function(None, set(), emitter.variables,
+                               *emitter.instrs)
 
 def squareFlatten(expr):
     raise TypeError('circleFlatten: %s' % str(expr))
@@ -149,6 +256,10 @@ def squareFlatten(expr):
 # Select Instruction
 
 def select_instr(program):
+    ''' X has no functions yet, so a C_flat.Program is lowered through its
+    main function alone, and a call is an error.'''
+    if type(program) == C_flat.Program:
+        program = program.main
     instrs = []
     for instr in program.instrs:
         if type(instr) == C_flat.Assign:
@@ -205,27 +316,42 @@ ah_dict = {
     X_var.Addq: X_approx.Addq,
     X_var.Subq: X_approx.Subq
     }
-def assign_homes(program):
+def assign_homes(program, coalescing=True, stats=None):
+    ''' If stats is a dict, what the allocator decided is added to it: the
+    number of variables, interference edges and spills, and the frame
+    size in bytes.'''
     ## Register allocation / other analysis
 
+    # merge move-related variables, dropping the moves between them
+    if coalescing:
+        program = coalesce(program)
+
     # count variables in program
     _vars = get_vars(program.instrs)
 
     # analyze in preparation for register allocation
-    annotated_instrs = annotate_liveness(program.instrs)
-    interference = calc_interference(annotated_instrs)
+    liveness = Liveness(program.instrs)
+    interference = calc_interference(liveness)
 
     # allocate
     homes, k = saturationAlloc(_vars, interference)
     #homes, k = simpleAlloc(_vars), len(_vars)
-    k = k+1 if k%2 else k
+    # k slots of one word each, rounded up to keep %rsp 16-byte aligned
+    frame = -(-k * X_approx.Addr.WORD_SIZE // 16) * 16
+    if stats is not None:
+        stats.update(variables = len(_vars),
+                     interference_edges = sum(row.bit_count()
+                                              for row in interference.rows)//2,
+                     spills = sum(isinstance(home, X_approx.Addr)
+                                  for home in homes.values()),
+                     frame_size = frame)
 
     ## Output
 
     instrs =[X_approx.Pushq(X_approx.Reg.RBP),
              X_approx.Movq(X_approx.Reg.RSP,
                            X_approx.Reg.RBP),
-             X_approx.Subq(X_approx.Int(k),
+             X_approx.Subq(X_approx.Int(frame),
                            X_approx.Reg.RSP)]
     assert isinstance(program.instrs[-1], X_var.Retq)
     for line in program.instrs[:-1]:
@@ -239,7 +365,7 @@ def assign_homes(program):
                 raise TypeError('assignHomes: %s' % str(instr))
         ty = type(line)
         instrs.append(ah_dict[ty](*args))
-    instrs += [X_approx.Addq(X_approx.Int(k),
+    instrs += [X_approx.Addq(X_approx.Int(frame),
                              X_approx.Reg.RSP),
                X_approx.Popq(X_approx.Reg.RBP),
                X_approx.Retq()]
@@ -287,6 +413,10 @@ def patch(program):
 # Pipeline
 
 def readIn(path):
+    ''' Python sources are run and must define `program`; anything else is
+    parsed as the text of an R program.'''
+    if not path.endswith('.py'):
+        return parsers.parse_R_from_file(path)
     with open(path, 'r') as fi:
         data = fi.read()
     namespace = locals().copy()
@@ -295,20 +425,184 @@ def readIn(path):
     out.checkForm()
     return out
 
-def pipeline(program):
-    steps = (uniquify, circleFlatten, select_instr, assign_homes, patch)
+def _called(expr):
+    ''' Names of the functions called in an R expression.'''
+    names = set()
+    work = [expr]
+    while work:
+        expr = work.pop()
+        ty = type(expr)
+        if ty == R.Call:
+            names.add(expr.fname.name)
+            work.extend(expr.args)
+        elif ty == R.Negative or ty == R.Sum:
+            work.extend(expr)
+        elif ty == R.Let:
+            work.append(expr.binding[1])
+            work.append(expr.body)
+    return names
+
+def _compile_unit(f, name, used_f):
+    ''' uniquify and flatten one function, or main if name is None.'''
+    if name is None:
+        unique = R_uniq.Function('main', [], _uniquify_expr(f.body, {}, used_f))
+    else:
+        unique = _uniquify_function(f, name, {}, used_f)
+    return [unique, circleFlatten(unique)]
+
+def _compile_unit_data(data):
+    ''' _compile_unit in a worker process. Programs cross the process
+    boundary in the binary format, which is smaller and quicker to pickle
+    than the objects.'''
+    f, name, used_f = data
+    return [serialize.dumps(result)
+            for result in _compile_unit(serialize.loads(f), name, used_f)]
+
+def flatten_program(program, cache = None, workers = None):
+    ''' uniquify and circleFlatten an R.Program one function at a time,
+    giving the same R_uniq.Program and C_flat.Program.
+
+    A function's output depends only on its own source and the names its
+    calls resolve to, so each function is a unit of its own in the cache and
+    only edited functions are compiled again. With workers, the functions
+    that are compiled are shared out among that many processes. The later
+    stages are not: select_instr lowers main alone, as X has no calls.'''
+    used_f = {}
+    names = []
+    for f in program.functions:
+        name = f.name.name
+        used_f[name] = used_f.get(name, 0) + 1
+        names.append(name + '-f' + str(used_f[name]))
+    # main is compiled as a function without arguments, as circleFlatten does
+    units = list(zip(program.functions, names))
+    units.append((R.Function(None, [], program.body), None))
+    results = [None] * len(units)
+    keys = [None] * len(units)
+    todo = []
+    for i, (f, name) in enumerate(units):
+        if cache is not None:
+            calls = sorted(_called(f.body))
+            # repr is much cheaper than serializing, and as exact for R
+            keys[i] = digest(repr(f).encode(), str(name),
+                             *('%s=%s' % (call, used_f.get(call))
+                               for call in calls))
+            results[i] = cache.get(keys[i])
+        if results[i] is None:
+            todo.append(i)
+    if workers is not None and len(todo) > 1:
+        payloads = []
+        for i in todo:
+            f, name = units[i]
+            # only the functions it calls, rather than the whole table
+            called = {call: used_f[call] for call in _called(f.body)
+                      if call in used_f}
+            payloads.append((serialize.dumps(f), name, called))
+        chunksize = max(1, len(todo) // (4 * workers))
+        with ProcessPoolExecutor(workers) as pool:
+            done = pool.map(_compile_unit_data, payloads, chunksize = chunksize)
+            for i, result in zip(todo, done):
+                results[i] = [serialize.loads(data) for data in result]
+    else:
+        for i in todo:
+            results[i] = _compile_unit(*units[i], used_f)
+    if cache is not None:
+        for i in todo:
+            cache.put(keys[i], results[i])
+    main_uniq, main_flat = results.pop()
+    return (R_uniq.Program([uniq for uniq, flat in results], main_uniq.body),
+            C_flat.Program(main_flat, *[flat for uniq, flat in results]))
+
+# steps that take a stats dict to fill in as they run
+_REPORTING = ('assign_homes', 'peephole')
+
+def _run_step(step, program, timings, hooks):
+    ''' step(program), telling hooks and recording the time it took. If there
+    are hooks, steps in _REPORTING are given a stats dict, which is passed to
+    hook.report before hook.after.'''
+    name = step.__name__
+    for hook in hooks:
+        hook.before(name, program)
+    result = None
+    stats = {} if hooks and name in _REPORTING else None
+    start = time.perf_counter()
+    try:
+        if stats is None:
+            result = step(program)
+        else:
+            result = step(program, stats = stats)
+        return result
+    finally:
+        if timings is not None:
+            timings.append((name, time.perf_counter() - start))
+        for hook in hooks:
+            if stats is not None and result is not None:
+                hook.report(name, stats)
+            hook.after(name, program, result)
+
+def _steps(optimize):
+    ''' The pipeline's steps, with the optimization passes if optimize.'''
+    if optimize:
+        return (uniquify, partial_eval, circleFlatten,
+                eliminate_common_subexprs, eliminate_dead_assigns,
+                select_instr, eliminate_dead_instrs, assign_homes, patch,
+                peephole)
+    return (uniquify, circleFlatten, select_instr, assign_homes, patch)
+
+def pipeline(program, cache = None, workers = None, timings = None, hooks = (),
+             optimize = False):
+    ''' Every stage's output, starting from program. With a cache.Cache,
+    results for a program compiled before are loaded instead of rebuilt;
+    otherwise the functions of an R.Program are flattened through
+    flatten_program, so only edited ones are compiled again, and the stages
+    after C_flat are reused while main's C_flat code is unchanged. With
+    workers, the functions of an R.Program are flattened in that many
+    processes. If timings is a list, (step name, seconds) is appended to it
+    for each step. Each of hooks (see profiling.Hook) is called before and
+    after every step. With optimize, the output of each optimization pass
+    follows that of the step before it; partial_eval needs the whole program
+    at once, so neither workers nor per-function caching are used.'''
+    if cache is not None:
+        start = time.perf_counter()
+        key = fingerprint(program, *(('optimize',) if optimize else ()))
+        out = cache.get(key)
+        if out is None:
+            out = _pipeline(program, cache, workers, timings, hooks, optimize)
+            cache.put(key, out)
+        elif timings is not None:
+            timings.append(('cache', time.perf_counter() - start))
+        return out
+    return _pipeline(program, None, workers, timings, hooks, optimize)
+
+def _pipeline(program, cache, workers, timings, hooks, optimize):
+    ''' pipeline, without looking up the whole program in cache.'''
+    steps = _steps(optimize)
     out = [program]
+    units = not optimize and type(program) == R.Program
+    if units and (workers is not None or cache is not None):
+        flatten = lambda program: flatten_program(program, cache, workers)
+        flatten.__name__ = 'flatten_program'
+        out.extend(_run_step(flatten, program, timings, hooks))
+        program = out[-1]
+        steps = steps[2:]
+        if cache is not None:
+            # select_instr lowers main alone, so nothing else can change
+            # what comes after C_flat
+            key = fingerprint(program.main, 'lowered')
+            lowered = cache.get(key)
+            if lowered is not None:
+                return out + lowered
     for step in steps:
-        program = step(program)
+        program = _run_step(step, program, timings, hooks)
         out.append(program)
+    if units and cache is not None:
+        cache.put(key, out[3:])
     return out
 
-def partial_pipeline(program):
-    steps = (uniquify, circleFlatten, select_instr, assign_homes, patch)
+def partial_pipeline(program, timings = None, hooks = (), optimize = False):
     out = [program]
-    for step in steps:
+    for step in _steps(optimize):
         try:
-            program = step(program)
+            program = _run_step(step, program, timings, hooks)
             out.append(program)
         except Exception as e:
             return out, e
@@ -320,27 +614,202 @@ def writeOut(program, path):
         fi.write(out)
 
 
-def log(results, infile, outfile):
-    with open('compilation.log', 'a') as fi:
-        fi.write('='*32+'\n')
-        fi.write(infile + ' -> ' + outfile + '\n')
-        fi.write('='*32+'\n')
+########
+# Logging
+#
+# compilation.log holds one JSON object per line for each compilation, with
+# the time each step took. Higher levels add every stage's program text and
+# the result of interpreting it, which may prompt for input.
+
+LOG_NONE, LOG_SUMMARY, LOG_IR, LOG_INTERPRET = range(4)
+LOG_LEVELS = {'none': LOG_NONE, 'summary': LOG_SUMMARY,
+              'ir': LOG_IR, 'interpret': LOG_INTERPRET}
+
+def log_record(results, infile, outfile, level = LOG_SUMMARY, timings = (),
+               error = None):
+    ''' The log entry for one compilation, ready for json.dumps.'''
+    record = {'infile': infile,
+              'outfile': outfile,
+              'seconds': sum(seconds for step, seconds in timings),
+              'steps': [{'step': step, 'seconds': seconds}
+                        for step, seconds in timings]}
+    if error is not None:
+        record['error'] = error
+    if level >= LOG_IR:
+        record['ir'] = [str(result) for result in results]
+    if level >= LOG_INTERPRET:
+        record['values'] = []
         for result in results:
-            fi.write(str(result))
-            fi.write('\n')
-            fi.write(str(result.interpret()))
-            fi.write('\n')
-            fi.write('\n')
+            try:
+                record['values'].append(result.interpret())
+            except Exception as e:
+                record['values'].append('%s: %s' % (type(e).__name__, e))
+    return record
 
-if __name__ == '__main__':
-    import sys
-    if len(sys.argv) == 3:
-        infile, outfile = sys.argv[1:]
+class CompilationLog:
+    ''' Appends records to path as JSON lines. They are held in memory and
+    written buffer at a time, so the file is opened once per buffer rather
+    than once per compilation. Use as a context manager, or call close.'''
+
+    def __init__(self, path = 'compilation.log', level = LOG_SUMMARY,
+                 buffer = 64):
+        self.path = path
+        self.level = level
+        self.buffer = buffer
+        self.lines = []
+
+    def write(self, record):
+        if self.level == LOG_NONE:
+            return
+        self.lines.append(json.dumps(record))
+        if len(self.lines) >= self.buffer:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            with open(self.path, 'a') as fi:
+                fi.write('\n'.join(self.lines) + '\n')
+            self.lines = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def log(results, infile, outfile, level = LOG_INTERPRET, timings = ()):
+    ''' Append a single entry to compilation.log.'''
+    with CompilationLog(level = level) as compilation_log:
+        if level != LOG_NONE:
+            compilation_log.write(log_record(results, infile, outfile, level,
+                                             timings))
+
+########
+# Batch compilation
+
+# readIn would run Python sources, so only R sources are compiled in batch
+SOURCE_SUFFIXES = ('.r',)
+
+def compile_file(infile, outfile, level = LOG_NONE, optimize = False):
+    ''' Compile one file for batch. Returns the time taken, the step that
+    failed and its error as strings, or None and None, and the log record
+    for level, so that all of it can be sent back from a worker process.'''
+    start = time.perf_counter()
+    timings = []
+    results = []
+    try:
         program = readIn(infile)
-        results = pipeline(program)
-        log(results, infile, outfile)
-        program = str(results[-1])
-        writeOut(program, outfile)
+        results, error = partial_pipeline(program, timings,
+                                          optimize = optimize)
+        if error is None:
+            writeOut(results[-1], outfile)
+    except Exception as e:
+        error = e
+    elapsed = time.perf_counter() - start
+    step = timings[-1][0] if timings else 'readIn'
+    if error is not None:
+        error = '%s: %s' % (type(error).__name__, error)
+    record = None
+    if level != LOG_NONE:
+        record = log_record(results, infile, outfile, level, timings, error)
+    if error is None:
+        return elapsed, None, None, record
+    return elapsed, step, error, record
+
+def batch(src_dir, out_dir, jobs = 1, report = print, compilation_log = None,
+          optimize = False):
+    ''' Compile every .r source in src_dir to an assembly file of the same name
+    in out_dir, in jobs processes. Each file is reported as soon as it is
+    done, and written to compilation_log if there is one; the number of
+    failures is returned.'''
+    os.makedirs(out_dir, exist_ok = True)
+    names = sorted(name for name in os.listdir(src_dir)
+                   if name.endswith(SOURCE_SUFFIXES))
+    level = LOG_NONE if compilation_log is None else compilation_log.level
+    tasks = [(os.path.join(src_dir, name),
+              os.path.join(out_dir, os.path.splitext(name)[0] + '.s'),
+              level, optimize)
+             for name in names]
+    start = time.perf_counter()
+    failures = 0
+    def done(infile, result):
+        nonlocal failures
+        elapsed, step, error, record = result
+        if record is not None:
+            compilation_log.write(record)
+        if error is None:
+            report('%-32s %9.1fms  ok' % (infile, elapsed * 1e3))
+        else:
+            failures += 1
+            report('%-32s %9.1fms  failed in %s: %s' %
+                   (infile, elapsed * 1e3, step, error))
+    if jobs > 1:
+        with ProcessPoolExecutor(jobs) as pool:
+            futures = {pool.submit(compile_file, *task): task[0]
+                       for task in tasks}
+            for future in as_completed(futures):
+                done(futures[future], future.result())
     else:
-        print('usage:\n  python3 -m compiler source_file target_file')
-        
+        for task in tasks:
+            done(task[0], compile_file(*task))
+    report('%d compiled, %d failed in %.2fs' %
+           (len(tasks) - failures, failures, time.perf_counter() - start))
+    return failures
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(prog = 'python3 -m compiler')
+    parser.add_argument('source_file', nargs = '?')
+    parser.add_argument('target_file', nargs = '?')
+    parser.add_argument('--batch', nargs = 2, metavar = ('SRC_DIR', 'OUT_DIR'),
+                        help = 'compile every .r source in SRC_DIR into OUT_DIR')
+    parser.add_argument('-j', '--jobs', type = int, default = 1,
+                        help = 'number of processes for --batch')
+    parser.add_argument('--log', choices = LOG_LEVELS, default = 'summary',
+                        help = 'what to append to compilation.log: step '
+                        'timings (summary), every stage\'s program (ir), '
+                        'and the result of interpreting each (interpret)')
+    parser.add_argument('--profile', action = 'store_true',
+                        help = 'print the time, memory and size of each step')
+    parser.add_argument('--profile-json', metavar = 'JSON_FILE',
+                        help = 'profile as --profile does, and also write '
+                        'the figures to JSON_FILE')
+    parser.add_argument('-O', '--optimize', action = 'store_true',
+                        help = 'run the optimization passes: partial '
+                        'evaluation, dead code elimination and peephole')
+    args = parser.parse_args()
+    if not args.batch and not (args.source_file and args.target_file):
+        parser.error('give a source_file and target_file, or --batch')
+    profile = args.profile or args.profile_json is not None
+    with CompilationLog(level = LOG_LEVELS[args.log]) as compilation_log:
+        if args.batch:
+            failures = batch(*args.batch, jobs = args.jobs,
+                             compilation_log = compilation_log,
+                             optimize = args.optimize)
+            sys.exit(1 if failures else 0)
+        else:
+            infile, outfile = args.source_file, args.target_file
+            program = readIn(infile)
+            timings = []
+            hooks = ()
+            if profile:
+                from profiling import Profiler
+                profiler = Profiler()
+                hooks = (profiler,)
+            results = pipeline(program, timings = timings, hooks = hooks,
+                               optimize = args.optimize)
+            if profile:
+                profiler.close()
+                print(profiler.table())
+                if args.profile_json is not None:
+                    with open(args.profile_json, 'w') as fi:
+                        fi.write(profiler.to_json())
+            if compilation_log.level != LOG_NONE:
+                compilation_log.write(log_record(results, infile, outfile,
+                                                 compilation_log.level,
+                                                 timings))
+            writeOut(results[-1], outfile)
@@ -4,8 +4,21 @@
 import unittest
 from unittest import mock
 from compiler import *
+from resolve import resolve
+import parsers
+import serialize
+import cache
+import profiling
+from Languages.interning import Interner
 
+import json
+import os
+import platform
+import shutil
 import string
+import subprocess
+import sys
+import tempfile
 
 ################################
 # Uniquify Tests
@@ -76,6 +89,91 @@ class TestUniquify(unittest.TestCase):
             self.checkProgram(let)
             self.checkProgram(nest)
 
+    def testSiblings(self):
+        ''' Lets that are not nested in one another still get distinct names,
+        since they share a single namespace once flattened.'''
+        inner = R.Let((R.Var('a'), R.Read()), R.Int(0))
+        prog = R.Program([], R.Let((R.Var('a'), R.Sum(R.Int(0), inner)),
+                                   R.Var('a')))
+        unique = uniquify(prog)
+        self.assertNotEqual(unique.body.binding[0],
+                            unique.body.binding[1].rhs.binding[0])
+        with mock.patch('_sys.readInt', return_value = 7):
+            self.assertEqual(prog.interpret(), 0)
+            self.assertEqual(circleFlatten(unique).interpret(), 0)
+
+    def testDeep(self):
+        ''' Long let-chains should not exceed the recursion limit.'''
+        depth = 4 * sys.getrecursionlimit()
+        body = R.Int(0)
+        for i in range(depth):
+            body = R.Let((R.Var('x'), R.Int(i)),
+                         R.Sum(R.Var('x'), body))
+        unique = uniquify(R.Program([], body))
+
+        self.assertIsInstance(unique, R_uniq.Program)
+        expr = unique.body
+        for i in range(depth):
+            self.assertIsInstance(expr, R_uniq.Let)
+            self.assertEqual(expr.binding[0].name, 'x-v%d' % i)
+            self.assertEqual(expr.body.lhs.name, 'x-v%d' % i)
+            expr = expr.body.rhs
+        self.assertIsInstance(expr, R_uniq.Int)
+
+
+class TestResolve(unittest.TestCase):
+    ''' Test cases for the slot-resolved interpreter'''
+
+    def checkProgram(self, program):
+        self.assertEqual(program.interpret(), resolve(program)())
+        unique = uniquify(program)
+        self.assertEqual(unique.interpret(), resolve(unique)())
+
+    def testShadowing(self):
+        for i in range(-4, 4):
+            prog = R.Program([], R.Let((R.Var('x'), R.Int(i)),
+                                       R.Sum(R.Let((R.Var('x'),
+                                                    R.Negative(R.Var('x'))),
+                                                   R.Var('x')),
+                                             R.Let((R.Var('y'), R.Int(3)),
+                                                   R.Sum(R.Var('x'),
+                                                         R.Var('y'))))))
+            self.checkProgram(prog)
+
+    def testCalls(self):
+        add = R.Function(R.Fname('add'), [R.Var('x'), R.Var('y')],
+                         R.Let((R.Var('z'), R.Sum(R.Var('x'), R.Var('y'))),
+                               R.Sum(R.Var('z'), R.Var('x'))))
+        twice = R.Function(R.Fname('twice'), [R.Var('x')],
+                           R.Call(R.Fname('add'), R.Var('x'), R.Var('x')))
+        for i in range(-4, 4):
+            prog = R.Program([add, twice],
+                             R.Let((R.Var('x'), R.Int(i)),
+                                   R.Call(R.Fname('add'),
+                                          R.Call(R.Fname('twice'), R.Var('x')),
+                                          R.Read())))
+            with mock.patch('_sys.readInt', return_value = 1):
+                self.checkProgram(prog)
+
+    def testErrors(self):
+        f = R.Function(R.Fname('f'), [R.Var('x')], R.Var('y'))
+        calls = [(R.VarNotDefined, R.Call(R.Fname('f'), R.Int(1))),
+                 (R.FunctionNotDefined, R.Call(R.Fname('g'))),
+                 (R.WrongNumberOfArgs, R.Call(R.Fname('f')))]
+        for error, call in calls:
+            # nothing is raised until the call is reached
+            run = resolve(R.Program([f], call))
+            with self.assertRaises(error):
+                run()
+
+    def testDeep(self):
+        depth = 4 * sys.getrecursionlimit()
+        body = R.Int(0)
+        for i in range(depth):
+            body = R.Let((R.Var('x'), R.Int(i)),
+                         R.Sum(R.Var('x'), body))
+        self.assertEqual(resolve(R.Program([], body))(), sum(range(depth)))
+
 
 ################################
 # Flatten Tests
@@ -141,6 +239,32 @@ class TestFlatten(unittest.TestCase):
             self.checkProgram(let)
             self.checkProgram(nest)
 
+    def testCalls(self):
+        add = R_uniq.Function(R_uniq.Fname('add-f1'),
+                              [R_uniq.Var('a-v1'), R_uniq.Var('b-v1')],
+                              R_uniq.Sum(R_uniq.Var('a-v1'),
+                                         R_uniq.Var('b-v1')))
+        for i in range(-8, 8):
+            call = R_uniq.Program([add],
+                                  R_uniq.Call(R_uniq.Fname('add-f1'),
+                                              R_uniq.Int(i),
+                                              R_uniq.Call(R_uniq.Fname('add-f1'),
+                                                          R_uniq.Int(i),
+                                                          R_uniq.Int(1))))
+            self.checkProgram(call)
+
+    def testDeep(self):
+        ''' Long let-chains should be flattened into a single instruction list.'''
+        depth = 4 * sys.getrecursionlimit()
+        body = R_uniq.Int(0)
+        for i in range(depth):
+            body = R_uniq.Let((R_uniq.Var('x-v%d' % i), R_uniq.Int(i)),
+                              R_uniq.Sum(R_uniq.Var('x-v%d' % i), body))
+        circle = circleFlatten(R_uniq.Program([], body))
+
+        self.assertIsInstance(circle, C_flat.Program)
+        self.assertEqual(circle.interpret(), sum(range(depth)))
+
 
 ################################
 # Instruction Selection Tests
@@ -193,6 +317,143 @@ class TestSelectInstruction(unittest.TestCase):
                                     C_flat.Return(C_flat.Var('x')))
                 self.checkProgram(xx)
                                 
+    def testProgram(self):
+        # what circleFlatten hands on is lowered through its main function
+        program = R.Program([], R.Let((R.Var('x'), R.Int(4)),
+                                      R.Sum(R.Var('x'), R.Negative(R.Int(6)))))
+        flat = circleFlatten(uniquify(program))
+        self.assertIsInstance(flat, C_flat.Program)
+        result = select_instr(flat)
+        self.assertIsInstance(result, X_var.Program)
+        self.assertEqual(result.interpret(), -2)
+        calls = R.Program([R.Function(R.Fname('f'), [R.Var('x')], R.Var('x'))],
+                          R.Call(R.Fname('f'), R.Int(1)))
+        with self.assertRaises(TypeError):
+            select_instr(circleFlatten(uniquify(calls)))
+
+################################
+# Liveness Tests
+class TestLiveness(unittest.TestCase):
+
+    def testStraightLine(self):
+        x, y, retvar = X_var.Var('x'), X_var.Var('y'), X_var.Var('retvar')
+        instrs = (X_var.Movq(X_var.Int(1), x),
+                  X_var.Movq(X_var.Int(2), y),
+                  X_var.Addq(x, y),
+                  X_var.Movq(y, retvar),
+                  X_var.Negq(retvar),
+                  X_var.Retq())
+        liveness = Liveness(instrs)
+        expected = [set(), {x}, {x, y}, {y}, {retvar}, {retvar}, set()]
+        for i in range(len(instrs)):
+            self.assertEqual(liveness.live_before(i), expected[i])
+            self.assertEqual(liveness.live_after(i), expected[i+1])
+        self.assertEqual(annotate_liveness(instrs),
+                         [(instr, expected[i+1])
+                          for i, instr in enumerate(instrs)])
+
+    def testRedefinition(self):
+        x, retvar = X_var.Var('x'), X_var.Var('retvar')
+        instrs = (X_var.Movq(X_var.Int(1), x),
+                  X_var.Movq(x, retvar),
+                  X_var.Movq(X_var.Int(2), x),
+                  X_var.Addq(x, retvar),
+                  X_var.Retq())
+        liveness = Liveness(instrs)
+        self.assertEqual(liveness.live_after(1), {retvar})
+        self.assertEqual(liveness.live_after(2), {x, retvar})
+
+
+################################
+# Interference Tests
+class TestInterference(unittest.TestCase):
+
+    def testGraph(self):
+        graph = Graph(['a', 'b'])
+        graph.add_edge('a', 'b')
+        graph.add_edge('a', 'c')
+        self.assertTrue(graph.has_edge('b', 'a'))
+        self.assertFalse(graph.has_edge('b', 'c'))
+        self.assertEqual(graph.degree('a'), 2)
+        self.assertEqual(graph.get_adjacent('a'), {'b', 'c'})
+        graph.remove_edge('a', 'b')
+        self.assertEqual(graph.get_adjacent('b'), set())
+
+    def testMove(self):
+        ''' A move does not make its source and destination interfere.'''
+        x, y, z = X_var.Var('x'), X_var.Var('y'), X_var.Var('z')
+        retvar = X_var.Var('retvar')
+        instrs = (X_var.Movq(X_var.Int(1), x),
+                  X_var.Movq(X_var.Int(2), z),
+                  X_var.Movq(x, y),
+                  X_var.Addq(x, y),
+                  X_var.Addq(z, y),
+                  X_var.Movq(y, retvar),
+                  X_var.Retq())
+        graph = calc_interference(Liveness(instrs))
+        self.assertEqual(graph.get_adjacent(x), {z})
+        self.assertEqual(graph.get_adjacent(y), {z})
+        self.assertEqual(graph.get_adjacent(z), {x, y})
+        self.assertEqual(graph.get_adjacent(retvar), set())
+
+    def testSaturationAlloc(self):
+        ''' Interfering variables get different homes, and spilled variables
+        that do not interfere share stack slots.'''
+        instrs = []
+        for block in range(4):
+            names = ['%s%d' % (char, block) for char in string.ascii_lowercase]
+            for i, name in enumerate(names):
+                instrs.append(X_var.Movq(X_var.Int(i), X_var.Var(name)))
+            for name in names:
+                instrs.append(X_var.Addq(X_var.Var(name), X_var.Var('retvar')))
+        instrs.append(X_var.Retq())
+        variables = get_vars(instrs)
+        graph = calc_interference(Liveness(instrs))
+        homes, k = saturationAlloc(variables, graph)
+
+        self.assertEqual(set(homes), variables)
+        for var in variables:
+            for other in graph.neighbours(var):
+                self.assertNotEqual(str(homes[var]), str(homes[other]))
+        spills = [home for home in homes.values()
+                  if isinstance(home, X_approx.Addr)]
+        # 27 variables live at once, 13 registers
+        self.assertEqual(len(spills), 4 * 14)
+        self.assertEqual(k, 14)
+
+
+################################
+# Coalescing Tests
+class TestCoalesce(unittest.TestCase):
+
+    def testMoves(self):
+        x, y, retvar = X_var.Var('x'), X_var.Var('y'), X_var.Var('retvar')
+        prog = X_var.Program(X_var.Movq(X_var.Int(1), x),
+                             X_var.Movq(x, y),
+                             X_var.Addq(X_var.Int(2), y),
+                             X_var.Movq(y, retvar),
+                             X_var.Retq())
+        result = coalesce(prog)
+        self.assertEqual(prog.interpret(), result.interpret())
+        self.assertEqual([str(instr) for instr in result.instrs],
+                         ['movq $1, retvar', 'addq $2, retvar', 'retq'])
+
+    def testInterfering(self):
+        ''' Variables that are both live after a move are not merged.'''
+        x, y, retvar = X_var.Var('x'), X_var.Var('y'), X_var.Var('retvar')
+        prog = X_var.Program(X_var.Movq(X_var.Int(1), x),
+                             X_var.Movq(x, y),
+                             X_var.Addq(X_var.Int(2), y),
+                             X_var.Movq(y, retvar),
+                             X_var.Addq(x, retvar),
+                             X_var.Retq())
+        result = coalesce(prog)
+        self.assertEqual(prog.interpret(), result.interpret())
+        # y can still be merged with retvar
+        self.assertEqual([str(instr) for instr in result.instrs],
+                         ['movq $1, x', 'movq x, retvar', 'addq $2, retvar',
+                          'addq x, retvar', 'retq'])
+
 
 ################################
 # Assign Homes Tests
@@ -259,11 +520,31 @@ class TestAssignHomes(unittest.TestCase):
         result = assign_homes(prog)
         self.checkProgram(prog)
 
+    def testSlots(self):
+        # every spilled variable gets its own word inside the frame
+        instrs = [X_var.Movq(X_var.Int(i), X_var.Var(char))
+                  for i, char in enumerate(string.ascii_lowercase)]
+        instrs.append(X_var.Movq(X_var.Int(0), X_var.Var('retvar')))
+        instrs += [X_var.Addq(X_var.Var(char), X_var.Var('retvar'))
+                   for char in string.ascii_lowercase]
+        instrs.append(X_var.Retq())
+        result = assign_homes(X_var.Program(*instrs))
+        frame = result.instrs[2].src.val
+        offsets = {arg.offset for instr in result.instrs[:-1] for arg in instr
+                   if isinstance(arg, X_approx.Addr)}
+        self.assertTrue(offsets)
+        self.assertEqual(frame % 16, 0)
+        for offset in offsets:
+            self.assertEqual(offset % X_approx.Addr.WORD_SIZE, 0)
+            self.assertLessEqual(-frame, offset)
+            self.assertLess(offset, 0)
+
 class TestPatch(unittest.TestCase):
 
     def checkProgram(self, program):
         result = patch(program)
         self.assertEqual(program.interpret(), result.interpret())
+        self.assertEqual(result.interpret(), result.compile_to_closure()())
         self.assertIsInstance(result, X.Program)
 
     #######
@@ -300,16 +581,58 @@ class TestPatch(unittest.TestCase):
         for i in range(8):
             for j in range(8):
                 prog = X_approx.Program(X_approx.Movq(X_approx.Int(i*j),
-                                                      X_approx.Addr(X_approx.Reg.RBP, -4*i)),
-                                        X_approx.Movq(X_approx.Addr(X_approx.Reg.RBP, -4*i),
-                                                      X_approx.Addr(X_approx.Reg.RBP, -4*j)),
-                                        X_approx.Movq(X_approx.Addr(X_approx.Reg.RBP, -4*j),
+                                                      X_approx.Addr(X_approx.Reg.RBP, -8*i)),
+                                        X_approx.Movq(X_approx.Addr(X_approx.Reg.RBP, -8*i),
+                                                      X_approx.Addr(X_approx.Reg.RBP, -8*j)),
+                                        X_approx.Movq(X_approx.Addr(X_approx.Reg.RBP, -8*j),
                                                       X_approx.Reg.RAX),
                                         X_approx.Retq())
                 prog.checkForm()
                 self.checkProgram(prog)
 
 
+class TestCompileToClosure(unittest.TestCase):
+
+    def checkProgram(self, program):
+        run = program.compile_to_closure()
+        self.assertEqual(program.interpret(), run())
+        # The closures hold no state between runs
+        self.assertEqual(program.interpret(), run())
+
+    #######
+    # Tests
+    def testStack(self):
+        prog = X.Program(X.Pushq(X.Reg.RBP),
+                         X.Movq(X.Reg.RSP, X.Reg.RBP),
+                         X.Movq(X.Int(5), X.Addr(X.Reg.RBP, -8)),
+                         X.Pushq(X.Addr(X.Reg.RBP, -8)),
+                         X.Pushq(X.Int(7)),
+                         X.Popq(X.Reg.RAX),
+                         X.Popq(X.Reg.RCX),
+                         X.Subq(X.Reg.RCX, X.Reg.RAX),
+                         X.Negq(X.Addr(X.Reg.RBP, -8)),
+                         X.Addq(X.Addr(X.Reg.RBP, -8), X.Reg.RAX),
+                         X.Popq(X.Reg.RBP),
+                         X.Retq())
+        self.checkProgram(prog)
+
+    def testEarlyReturn(self):
+        prog = X.Program(X.Movq(X.Int(3), X.Reg.RAX),
+                         X.Retq(),
+                         X.Negq(X.Reg.RAX),
+                         X.Retq())
+        self.assertEqual(prog.interpret(), 3)
+        self.checkProgram(prog)
+
+    def testSpills(self):
+        body = R.Int(0)
+        for i, var in reversed(list(enumerate(string.ascii_lowercase))):
+            body = R.Let((R.Var(var), R.Int(i)), R.Sum(R.Var(var), body))
+        program = R.Program([], body)
+        x_var = select_instr(circleFlatten(uniquify(program)).main)
+        self.checkProgram(patch(assign_homes(x_var)))
+
+
 class TestPipeline(unittest.TestCase):
 
     def checkProgram(self, program, a=False):
@@ -379,5 +702,979 @@ class TestPipeline(unittest.TestCase):
         spill = R.Program(helper(string.ascii_lowercase))
         self.checkProgram(spill, False)
 
+    @unittest.skipUnless(shutil.which('gcc') and sys.platform == 'linux'
+                         and platform.machine() == 'x86_64',
+                         'needs gcc on x86-64 Linux')
+    def testNative(self):
+        # the exit status of the assembled program is its value mod 256
+        names = [R.Var(c) for c in string.ascii_lowercase]
+        body = names[0]
+        for var in names[1:]:
+            body = R.Sum(body, var)
+        for i, var in enumerate(reversed(names)):
+            body = R.Let((var, R.Int(i)), body)
+        program = R.Program([], body)
+        out = pipeline(program)[-1]
+        with tempfile.TemporaryDirectory() as tmp:
+            asm, exe = os.path.join(tmp, 'spill.s'), os.path.join(tmp, 'spill')
+            with open(asm, 'w') as f:
+                f.write(str(out).replace('_main', 'main') + '\n')
+            subprocess.run(['gcc', asm, '-o', exe], check = True,
+                           capture_output = True)
+            status = subprocess.run([exe]).returncode
+        self.assertEqual(status, program.interpret() % 256)
+
+################################
+# Parser Tests
+
+class TestParse(unittest.TestCase):
+
+    source = '(program ()\n\t(let ([x-v0 12]) (+ x-v0 (- [read]))))'
+    sexpr = [['program', [],
+              ['let', [['x-v0', '12']], ['+', 'x-v0', ['-', ['read']]]]]]
+
+    def testTokenize(self):
+        tokens = ['(', 'program', '(', ')', '(', 'let', '(', '[', 'x-v0',
+                  '12', ']', ')', '(', '+', 'x-v0', '(', '-', '[', 'read',
+                  ']', ')', ')', ')', ')']
+        self.assertEqual(list(parsers.tokenize(self.source)), tokens)
+        # tokens split across chunk boundaries are put back together
+        for size in range(1, 8):
+            self.assertEqual(list(parsers.tokenize(self.source, size)), tokens)
+
+    def testSexpr(self):
+        self.assertEqual(parsers.parse_sexpr(self.source), self.sexpr)
+        with self.assertRaises(AssertionError):
+            parsers.parse_sexpr('(+ 1 2')
+        with self.assertRaises(AssertionError):
+            parsers.parse_sexpr('(+ 1 2))')
+
+    def testFile(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'prog.r')
+            with open(path, 'w') as fi:
+                fi.write(self.source)
+            for size in (1, 3, parsers.CHUNK_SIZE):
+                tokens = parsers.tokenize_file(path, size)
+                self.assertEqual(parsers.build_sexpr(tokens), self.sexpr)
+
+    def testR(self):
+        add = R.Function(R.Fname('add'), [R.Var('x'), R.Var('y')],
+                         R.Sum(R.Var('x'), R.Var('y')))
+        zero = R.Function(R.Fname('zero'), [], R.Int(0))
+        prog = R.Program([add, zero],
+                         R.Let((R.Var('x'), R.Negative(R.Read())),
+                               R.Call(R.Fname('add'), R.Var('x'),
+                                      R.Call(R.Fname('zero')))))
+        parsed = parsers.parse_R_from_string(str(prog))
+        self.assertEqual(repr(parsed), repr(prog))
+        # the original grammar, without a function list
+        parsed = parsers.parse_R_from_string('(program (+ 1 2))')
+        self.assertEqual(repr(parsed), repr(R.Program([], R.Sum(R.Int(1),
+                                                                R.Int(2)))))
+        with self.assertRaises(ValueError):
+            parsers.parse_R_from_string('(program (() 1))')
+
+    def testDeep(self):
+        depth = 4 * sys.getrecursionlimit()
+        source = '(program () %s0%s)' % ('(let ([x 1]) (+ x ' * depth,
+                                         '))' * depth)
+        expr = parsers.parse_R_from_string(source).body
+        for i in range(depth):
+            self.assertIsInstance(expr, R.Let)
+            expr = expr.body.rhs
+        self.assertIsInstance(expr, R.Int)
+
+    def testReadIn(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'prog.r')
+            with open(path, 'w') as fi:
+                fi.write('(program ((function f (x) (- x))) (f 3))')
+            self.assertEqual(readIn(path).interpret(), -3)
+
+class TestInterning(unittest.TestCase):
+
+    source = ('(program ((function f (x) (+ x (- 1))))'
+              ' (let ([x 1]) (+ (f (+ x (- 1))) (+ x (- 1)))))')
+
+    def testSlots(self):
+        for node in (R.Int(1), R.Var('x'), R.Read(), R.Fname('f'),
+                     R.Negative(R.Int(1)), R.Let((R.Var('x'), R.Int(1)),
+                                                 R.Var('x')),
+                     R_uniq.Var('x-v1'), R_uniq.Sum(R_uniq.Int(1),
+                                                    R_uniq.Int(2))):
+            self.assertFalse(hasattr(node, '__dict__'), type(node))
+
+    def testLeaves(self):
+        interner = Interner(R)
+        prog = parsers.parse_R_from_string(self.source, interner)
+        self.assertEqual(str(prog), str(parsers.parse_R_from_string(
+            self.source)))
+        self.assertEqual(prog.interpret(), -1)
+        function = prog.functions[0]
+        let = prog.body
+        self.assertIs(function.arguments[0], let.binding[0])
+        self.assertIs(let.binding[1], function.body.rhs.expr)
+        self.assertIs(let.body.lhs.fname, function.name)
+        # only leaves are shared
+        self.assertIsNot(let.body.rhs, let.body.lhs.args[0])
+
+    def testSubtrees(self):
+        interner = Interner(R, subtrees = True)
+        prog = parsers.parse_R_from_string(self.source, interner)
+        self.assertEqual(prog.interpret(), -1)
+        let = prog.body
+        self.assertIs(let.body.rhs, let.body.lhs.args[0])
+        self.assertIs(let.body.rhs.rhs, prog.functions[0].body.rhs)
+
+    def testIntern(self):
+        prog = uniquify(parsers.parse_R_from_string(self.source))
+        interner = Interner(R_uniq, subtrees = True)
+        shared = interner.intern(prog)
+        self.assertEqual(str(shared), str(prog))
+        self.assertEqual(shared.interpret(), prog.interpret())
+        self.assertIs(interner.intern(prog.body), shared.body)
+        # the tree can be deeper than the recursion limit
+        depth = 4 * sys.getrecursionlimit()
+        expr = R.Int(0)
+        for i in range(depth):
+            expr = R.Sum(R.Int(i % 3), expr)
+        expr = Interner(R).intern(expr)
+        for i in range(depth):
+            expr = expr.rhs
+        self.assertEqual(expr.val, 0)
+
+
+################################
+# Equality Tests
+
+class TestEquality(unittest.TestCase):
+
+    source = TestInterning.source
+
+    def testR(self):
+        a = parsers.parse_R_from_string(self.source)
+        b = parsers.parse_R_from_string(self.source)
+        self.assertIsNot(a, b)
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertNotEqual(a, parsers.parse_R_from_string(
+            self.source.replace('(- 1)', '(- 2)')))
+        self.assertNotEqual(a.body, uniquify(a).body)
+        self.assertNotEqual(R.Sum(R.Int(1), R.Int(2)),
+                            R_uniq.Sum(R_uniq.Int(1), R_uniq.Int(2)))
+        self.assertNotEqual(R.Negative(R.Int(1)), (R.Int(1),))
+        self.assertNotEqual(R_uniq.Var('x'), R_uniq.Int(1))
+        # usable as keys
+        memo = {a.body: 'a'}
+        self.assertEqual(memo[b.body], 'a')
+
+    def testCached(self):
+        let = parsers.parse_R_from_string(self.source).body
+        h = hash(let)
+        self.assertEqual(let._hash, h)
+        self.assertEqual(hash(let), h)
+
+    def testX(self):
+        for L in (X_approx, X):
+            a, b = L.Addr(L.Reg.RBP, -8), L.Addr(L.Reg.RBP, -8)
+            self.assertEqual(a, b)
+            self.assertEqual(hash(a), hash(b))
+            self.assertNotEqual(a, L.Addr(L.Reg.RSP, -8))
+            self.assertNotEqual(L.Movq(L.Int(1), a), L.Addq(L.Int(1), a))
+            self.assertEqual(L.Movq(L.Int(1), a), L.Movq(L.Int(1), b))
+            self.assertEqual(len({L.Negq(a), L.Negq(b), L.Negq(L.Reg.RAX)}), 2)
+            self.assertEqual(L.Reg.RAX, L.Reg.RAX)
+            self.assertNotEqual(L.Reg.RAX, L.Reg.RBX)
+
+    def testPipeline(self):
+        program = R.Program([], R.Let((R.Var('x'), R.Int(3)),
+                                      R.Sum(R.Var('x'), R.Negative(R.Int(1)))))
+        a = pipeline(program)
+        b = pipeline(parsers.parse_R_from_string(str(program)))
+        self.assertEqual(len(a), 6)
+        for x, y in zip(a, b):
+            self.assertEqual(x, y)
+            self.assertEqual(hash(x), hash(y))
+
+    def testDeep(self):
+        depth = 4 * sys.getrecursionlimit()
+        def chain(last):
+            expr = R.Int(last)
+            for i in range(depth):
+                expr = R.Let((R.Var('x'), R.Int(i)),
+                             R.Sum(R.Var('x'), R.Negative(expr)))
+            return expr
+        self.assertEqual(chain(0), chain(0))
+        self.assertEqual(hash(chain(0)), hash(chain(0)))
+        self.assertNotEqual(chain(0), chain(1))
+
+
+################################
+# Serialization Tests
+
+class TestSerialize(unittest.TestCase):
+
+    def roundTrip(self, program):
+        data = serialize.dumps(program)
+        loaded = serialize.loads(data)
+        self.assertIs(type(loaded), type(program))
+        self.assertEqual(serialize.dumps(loaded), data)
+        return loaded
+
+    def testPipeline(self):
+        f = R.Function(R.Fname('f'), [R.Var('x')], R.Negative(R.Var('x')))
+        prog = R.Program([f], R.Let((R.Var('y'), R.Int(-2**70)),
+                                    R.Sum(R.Var('y'),
+                                          R.Call(R.Fname('f'), R.Int(3)))))
+        self.assertEqual(repr(self.roundTrip(prog)), repr(prog))
+        for stage in (uniquify, circleFlatten):
+            prog = stage(prog)
+            self.assertEqual(self.roundTrip(prog).interpret(), prog.interpret())
+
+    def testX(self):
+        body = R.Int(0)
+        for i, var in reversed(list(enumerate(string.ascii_lowercase))):
+            body = R.Let((R.Var(var), R.Int(i)), R.Sum(R.Var(var), body))
+        prog = select_instr(circleFlatten(uniquify(R.Program([], body))).main)
+        for stage in (assign_homes, patch, None):
+            loaded = self.roundTrip(prog)
+            self.assertEqual(str(loaded), str(prog))
+            self.assertEqual(loaded.interpret(), prog.interpret())
+            if stage:
+                prog = stage(prog)
+
+    def testFile(self):
+        prog = R.Program([], R.Sum(R.Read(), R.Int(1)))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'prog.irb')
+            serialize.dump(prog, path)
+            self.assertEqual(repr(serialize.load(path)), repr(prog))
+            with open(path, 'r+b') as fi:
+                fi.write(b'XXX')
+            with self.assertRaises(serialize.FormatError):
+                serialize.load(path)
+
+################################
+# Cache Tests
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def program(self, i):
+        return R.Program([], R.Let((R.Var('x'), R.Int(i)),
+                                   R.Sum(R.Var('x'), R.Negative(R.Int(i+1)))))
+
+    def testHits(self):
+        store = cache.Cache(self.directory)
+        first = pipeline(self.program(1), cache = store)
+        second = pipeline(self.program(1), cache = store)
+        self.assertEqual(store.stats()['hits'], 1)
+        # the whole program, main and the stages after C_flat
+        self.assertEqual(store.stats()['misses'], 3)
+        self.assertEqual([serialize.dumps(p) for p in first],
+                         [serialize.dumps(p) for p in second])
+        # every stage is the real one, down to an X program that runs
+        self.assertEqual([type(p) for p in second],
+                         [R.Program, R_uniq.Program, C_flat.Program,
+                          X_var.Program, X_approx.Program, X.Program])
+        self.assertEqual(str(second[-1]), str(pipeline(self.program(1))[-1]))
+        self.assertEqual(second[-1].interpret(), -1)
+        # a new Cache over the same directory sees the entry
+        store = cache.Cache(self.directory)
+        pipeline(self.program(1), cache = store)
+        self.assertEqual(store.stats()['hits'], 1)
+
+    def testEviction(self):
+        store = cache.Cache(self.directory)
+        pipeline(self.program(0), cache = store)
+        size = store.size
+        store = cache.Cache(self.directory, max_bytes = 3 * size)
+        for i in range(1, 4):
+            pipeline(self.program(i), cache = store)
+        # program 0's three entries were least recently used
+        self.assertEqual(store.stats()['evictions'], 3)
+        self.assertIsNone(store.get(cache.fingerprint(self.program(0))))
+        self.assertIsNotNone(store.get(cache.fingerprint(self.program(1))))
+        self.assertLessEqual(store.size, 3 * size)
+        self.assertEqual(len(os.listdir(self.directory)), 9)
+
+    def testDamaged(self):
+        store = cache.Cache(self.directory)
+        key = cache.fingerprint(self.program(0))
+        pipeline(self.program(0), cache = store)
+        with open(store.path(key), 'wb') as fi:
+            fi.write(b'\0' * 16)
+        store = cache.Cache(self.directory)
+        self.assertIsNone(store.get(key))
+        self.assertEqual(pipeline(self.program(0), cache = store)[-1].interpret(),
+                         -1)
+
+    def testFunctions(self):
+        def prog(k):
+            fs = [R.Function(R.Fname('f%d' % i), [R.Var('x')],
+                             R.Sum(R.Call(R.Fname('f%d' % (i-1)), R.Var('x'))
+                                   if i else R.Var('x'),
+                                   R.Int(k if i == 2 else i)))
+                  for i in range(5)]
+            return R.Program(fs, R.Call(R.Fname('f4'), R.Read()))
+        store = cache.Cache(self.directory)
+        for k in (2, 2, 7):
+            program = prog(k)
+            unique, flat = flatten_program(program, store)
+            self.assertEqual(str(unique), str(uniquify(program)))
+            self.assertEqual(serialize.dumps(flat),
+                             serialize.dumps(circleFlatten(uniquify(program))))
+        # five functions and main, then all hits, then only f2 again
+        self.assertEqual(store.stats()['misses'], 7)
+        self.assertEqual(store.stats()['hits'], 11)
+        with mock.patch('_sys.readInt', return_value = 1):
+            self.assertEqual(flat.interpret(), program.interpret())
+
+    def testIncremental(self):
+        ''' Editing a function main does not call reuses main's lowering.'''
+        def prog(k):
+            f = R.Function(R.Fname('f'), [R.Var('x')],
+                           R.Sum(R.Var('x'), R.Int(k)))
+            return R.Program([f], R.Let((R.Var('y'), R.Int(4)),
+                                        R.Negative(R.Var('y'))))
+        store = cache.Cache(self.directory)
+        pipeline(prog(1), cache = store)
+        timings = []
+        results = pipeline(prog(2), cache = store, timings = timings)
+        self.assertEqual([step for step, seconds in timings],
+                         ['flatten_program'])
+        # four misses the first time; then the program and f miss again,
+        # but main and its lowering are hits
+        self.assertEqual(store.stats()['hits'], 2)
+        self.assertEqual(store.stats()['misses'], 6)
+        self.assertEqual([serialize.dumps(p) for p in results],
+                         [serialize.dumps(p) for p in pipeline(prog(2))])
+        self.assertEqual(results[-1].interpret(), -4)
+
+################################
+# Parallel Compilation Tests
+
+class TestParallel(unittest.TestCase):
+
+    def program(self, n):
+        fs = [R.Function(R.Fname('f%d' % i), [R.Var('x'), R.Var('y')],
+                         R.Let((R.Var('x'), R.Sum(R.Var('x'), R.Int(i))),
+                               R.Call(R.Fname('f%d' % (i-1)), R.Var('y'),
+                                      R.Var('x'))
+                               if i else R.Negative(R.Var('x'))))
+              for i in range(n)]
+        return R.Program(fs, R.Call(R.Fname('f%d' % (n-1)), R.Int(1), R.Int(2)))
+
+    def testFlatten(self):
+        program = self.program(12)
+        serial = flatten_program(program)
+        parallel = flatten_program(program, workers = 2)
+        self.assertEqual(str(parallel[0]), str(serial[0]))
+        self.assertEqual(serialize.dumps(parallel[1]),
+                         serialize.dumps(serial[1]))
+        self.assertEqual(parallel[1].interpret(), program.interpret())
+
+    def testPipeline(self):
+        # main does not call the functions, since X has no calls yet
+        program = self.program(6)
+        program.body = R.Sum(R.Int(2), R.Negative(R.Int(5)))
+        timings = []
+        results = pipeline(program, workers = 2, timings = timings)
+        self.assertEqual([step for step, seconds in timings],
+                         ['flatten_program', 'select_instr', 'assign_homes',
+                          'patch'])
+        self.assertEqual([type(result) for result in results],
+                         [R.Program, R_uniq.Program, C_flat.Program,
+                          X_var.Program, X_approx.Program, X.Program])
+        self.assertEqual([serialize.dumps(result) for result in results],
+                         [serialize.dumps(result)
+                          for result in pipeline(program)])
+        self.assertEqual(results[-1].interpret(), -3)
+
+    def testErrors(self):
+        program = self.program(4)
+        program.functions[2].body = R.Var('z')
+        with self.assertRaises(R.VarNotDefined):
+            flatten_program(program, workers = 2)
+
+################################
+# Batch Compilation Tests
+
+class TestBatch(unittest.TestCase):
+
+    sources = {'sum.r': '(program () (+ 1 (- 5)))',
+               'undefined.r': '(program () (+ 1 x))',
+               'unbalanced.r': '(program (+ 1',
+               'calls.r': '(program ((function f (x) x)) (f 1))',
+               'notes.txt': 'not a program',
+               # Python sources are not run
+               'script.py': 'program = R.Program([], R.Int(1))'}
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.src = os.path.join(tmp.name, 'src')
+        self.out = os.path.join(tmp.name, 'out')
+        os.mkdir(self.src)
+        for name, source in self.sources.items():
+            with open(os.path.join(self.src, name), 'w') as fi:
+                fi.write(source)
+
+    def run_batch(self, jobs):
+        lines = []
+        failures = batch(self.src, self.out, jobs = jobs,
+                         report = lines.append)
+        self.assertEqual(failures, 3)
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[-1].startswith('1 compiled, 3 failed'))
+        report = {line.split()[0]: line for line in lines[:-1]}
+        self.assertTrue(report[os.path.join(self.src, 'sum.r')].endswith('ok'))
+        self.assertIn('failed in uniquify: VarNotDefined',
+                      report[os.path.join(self.src, 'undefined.r')])
+        self.assertIn('failed in readIn',
+                      report[os.path.join(self.src, 'unbalanced.r')])
+        # X has no calls yet
+        self.assertIn('failed in select_instr: TypeError',
+                      report[os.path.join(self.src, 'calls.r')])
+        self.assertEqual(os.listdir(self.out), ['sum.s'])
+        with open(os.path.join(self.out, 'sum.s')) as fi:
+            self.assertIn('retq', fi.read())
+
+    def testSerial(self):
+        self.run_batch(1)
+
+    def testJobs(self):
+        self.run_batch(2)
+
+################################
+# Logging Tests
+
+class TestLog(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'compilation.log')
+        self.program = R.Program([], R.Sum(R.Int(1), R.Negative(R.Int(3))))
+
+    def read(self):
+        with open(self.path) as fi:
+            return [json.loads(line) for line in fi]
+
+    def testLevels(self):
+        timings = []
+        results, error = partial_pipeline(self.program, timings)
+        self.assertIsNone(error)
+        self.assertEqual([step for step, seconds in timings],
+                         ['uniquify', 'circleFlatten', 'select_instr',
+                          'assign_homes', 'patch'])
+        summary = log_record(results, 'in.r', 'out.s', LOG_SUMMARY, timings)
+        self.assertEqual(len(summary['steps']), 5)
+        self.assertNotIn('ir', summary)
+        self.assertNotIn('error', summary)
+        full = log_record(results, 'in.r', 'out.s', LOG_INTERPRET, timings)
+        self.assertEqual(full['ir'][0], str(self.program))
+        self.assertEqual(full['ir'][-1], str(results[-1]))
+        self.assertEqual(full['values'], [-2] * 6)
+
+    def testCommandLine(self):
+        ''' The compiler's default log level writes a complete entry.'''
+        directory = os.path.dirname(self.path)
+        with open(os.path.join(directory, 'in.r'), 'w') as fi:
+            fi.write(str(self.program))
+        compiler = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'compiler.py')
+        for level in ('summary', 'interpret'):
+            subprocess.run([sys.executable, compiler, 'in.r', 'out.s',
+                            '--log', level], cwd = directory, check = True)
+        summary, full = self.read()
+        self.assertEqual([step['step'] for step in full['steps']],
+                         ['uniquify', 'circleFlatten', 'select_instr',
+                          'assign_homes', 'patch'])
+        self.assertEqual(len(summary['steps']), 5)
+        self.assertNotIn('values', summary)
+        self.assertEqual(full['values'], [-2] * 6)
+        with open(os.path.join(directory, 'out.s')) as fi:
+            self.assertEqual(fi.read(), full['ir'][-1])
+
+    def testNoInterpretation(self):
+        results, error = partial_pipeline(self.program)
+        with mock.patch('_sys.readInt') as read, \
+             mock.patch.object(R.Program, 'interpret') as r, \
+             mock.patch.object(R_uniq.Program, 'interpret') as r_uniq, \
+             mock.patch.object(C_flat.Program, 'interpret') as c_flat:
+            with CompilationLog(self.path, LOG_IR) as compilation_log:
+                compilation_log.write(log_record(results, 'in', 'out', LOG_IR))
+        for interpret in (read, r, r_uniq, c_flat):
+            interpret.assert_not_called()
+        self.assertEqual(len(self.read()), 1)
+
+    def testBuffered(self):
+        compilation_log = CompilationLog(self.path, LOG_SUMMARY, buffer = 3)
+        for i in range(4):
+            compilation_log.write({'i': i})
+        self.assertEqual(self.read(), [{'i': 0}, {'i': 1}, {'i': 2}])
+        compilation_log.close()
+        self.assertEqual(len(self.read()), 4)
+        with CompilationLog(self.path, LOG_NONE) as compilation_log:
+            compilation_log.write({'i': 4})
+        self.assertEqual(len(self.read()), 4)
+
+################################
+# Profiling Tests
+
+class TestProfile(unittest.TestCase):
+
+    def testSteps(self):
+        program = R.Program([], R.Let((R.Var('a'), R.Int(4)),
+                                      R.Sum(R.Var('a'), R.Negative(R.Int(3)))))
+        profiler = profiling.Profiler()
+        timings = []
+        results = pipeline(program, timings = timings, hooks = (profiler,))
+        profiler.close()
+        self.assertEqual(len(profiler.records), 5)
+        self.assertEqual([record['step'] for record in profiler.records],
+                         [step for step, seconds in timings])
+        for record, before, after in zip(profiler.records, results, results[1:]):
+            self.assertEqual(record['size_in'], profiling.size(before))
+            self.assertEqual(record['size_out'], profiling.size(after))
+            self.assertGreaterEqual(record['peak_memory'], 0)
+        self.assertEqual(profiling.size(program), 6)
+        homes = profiler.records[3]
+        self.assertEqual(homes['step'], 'assign_homes')
+        self.assertEqual(homes['spills'], 0)
+        self.assertEqual(json.loads(profiler.to_json()), profiler.records)
+        self.assertEqual(len(profiler.table().splitlines()), 6)
+
+    def testSpills(self):
+        names = [R.Var(c) for c in string.ascii_lowercase]
+        body = names[0]
+        for var in names[1:]:
+            body = R.Sum(body, var)
+        for i, var in enumerate(reversed(names)):
+            body = R.Let((var, R.Int(i)), body)
+        profiler = profiling.Profiler(memory = False)
+        pipeline(R.Program([], body), hooks = (profiler,))
+        homes = profiler.records[3]
+        self.assertGreaterEqual(homes['variables'], 26)
+        self.assertGreater(homes['spills'], 0)
+        self.assertGreater(homes['interference_edges'], 0)
+        self.assertEqual(homes['frame_size'] % 16, 0)
+
+    def testReported(self):
+        ''' The stats are those of the run being profiled, not worked out
+        again.'''
+        names = [R.Var(c) for c in 'abcdef']
+        body = names[0]
+        for var in names[1:]:
+            body = R.Sum(body, var)
+        for i, var in enumerate(reversed(names)):
+            body = R.Let((var, R.Int(i)), body)
+        program = R.Program([], body)
+        profiler = profiling.Profiler(memory = False)
+        with mock.patch('compiler.coalesce', wraps = coalesce) as merge, \
+             mock.patch('optimize.peephole') as again:
+            results = pipeline(program, hooks = (profiler,), optimize = True)
+        self.assertEqual(merge.call_count, 1)
+        again.assert_not_called()
+        stats = {}
+        assign_homes(results[7], stats = stats)
+        homes, = [r for r in profiler.records if r['step'] == 'assign_homes']
+        for key, value in stats.items():
+            self.assertEqual(homes[key], value)
+        rules = {}
+        self.assertEqual(str(peephole(results[-2], rules)), str(results[-1]))
+        self.assertEqual(profiler.records[-1]['rules'], rules)
+        self.assertTrue(rules)
+        # without coalescing, the allocator sees every variable
+        profiler = profiling.Profiler(memory = False)
+        homes = lambda program, stats: assign_homes(program, False, stats)
+        homes.__name__ = 'assign_homes'
+        with mock.patch('compiler.assign_homes', homes):
+            pipeline(program, hooks = (profiler,))
+        stats = {}
+        assign_homes(select_instr(circleFlatten(uniquify(program))), False,
+                     stats)
+        self.assertEqual(profiler.records[3]['variables'], stats['variables'])
+        self.assertEqual(stats['variables'], 12)
+
+    def testFailure(self):
+        calls = []
+        class Hook(profiling.Hook):
+            def after(self, step, program, result):
+                calls.append((step, result))
+        program = R.Program([], R.Sum(R.Int(1), R.Var('x')))
+        results, error = partial_pipeline(program, hooks = (Hook(),))
+        self.assertIsNotNone(error)
+        self.assertIsNone(calls[-1][1])
+        self.assertEqual(len(calls), len(results))
+
+    def testCommandLine(self):
+        ''' --profile takes no argument, so it cannot swallow the source
+        file; the JSON goes where --profile-json says.'''
+        compiler = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'compiler.py')
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'in.r'), 'w') as fi:
+                fi.write('(program () (+ 4 (- 3)))')
+            command = [sys.executable, compiler, '--log', 'none']
+            out = subprocess.run(command + ['--profile', 'in.r', 'out.s'],
+                                 cwd = tmp, check = True,
+                                 capture_output = True, text = True)
+            self.assertEqual(len(out.stdout.splitlines()), 6)
+            self.assertTrue(os.path.exists(os.path.join(tmp, 'out.s')))
+            subprocess.run(command + ['in.r', 'out.s',
+                                      '--profile-json', 'profile.json'],
+                           cwd = tmp, check = True, capture_output = True)
+            with open(os.path.join(tmp, 'profile.json')) as fi:
+                self.assertEqual(len(json.load(fi)), 5)
+            # without both files there is nothing to do
+            missing = subprocess.run(command + ['--profile', 'in.r'],
+                                     cwd = tmp, capture_output = True)
+            self.assertNotEqual(missing.returncode, 0)
+            self.assertIn(b'target_file', missing.stderr)
+
+################################
+# Partial Evaluation Tests
+
+class TestPartialEval(unittest.TestCase):
+
+    def optimize(self, program):
+        unique = uniquify(program)
+        out = partial_eval(unique)
+        out.checkForm()
+        reads = list(range(3, 100))
+        with mock.patch('_sys.readInt', side_effect = reads):
+            expected = unique.interpret()
+        with mock.patch('_sys.readInt', side_effect = reads):
+            self.assertEqual(out.interpret(), expected)
+        return out
+
+    def testFold(self):
+        program = R.Program([], R.Sum(R.Int(1), R.Negative(R.Int(5))))
+        self.assertEqual(str(self.optimize(program).body), '-4')
+
+    def testPropagate(self):
+        x, y = R.Var('x'), R.Var('y')
+        program = R.Program([], R.Let((x, R.Int(3)),
+                                      R.Let((y, x), R.Sum(y, R.Read()))))
+        self.assertEqual(str(self.optimize(program).body), '(+ (read) 3)')
+
+    def testReassociate(self):
+        program = R.Program([], R.Sum(R.Int(1),
+                                      R.Negative(R.Sum(R.Read(), R.Int(2)))))
+        self.assertEqual(str(self.optimize(program).body), '(+ (- (read)) -1)')
+
+    def testReadOrder(self):
+        a = R.Var('a')
+        program = R.Program([], R.Let((a, R.Read()),
+                                      R.Sum(R.Negative(a), R.Read())))
+        out = self.optimize(program)
+        self.assertEqual(str(out.body), '(let ([a-v0 (read)]) (+ (- a-v0) (read)))')
+
+    def testInline(self):
+        a, b = R.Var('a'), R.Var('b')
+        f = R.Function(R.Fname('f'), [a, b], R.Sum(a, R.Negative(b)))
+        g = R.Function(R.Fname('g'), [a], R.Call(R.Fname('g'), a))
+        program = R.Program([f, g], R.Sum(R.Call(R.Fname('f'), R.Read(), R.Int(2)),
+                                          R.Call(R.Fname('f'), R.Int(7), R.Read())))
+        out = self.optimize(program)
+        self.assertEqual(out.functions, [])
+        self.assertEqual(str(out.body), '(+ (+ (read) (- (read))) 5)')
+        # recursive functions are kept as they are
+        program = R.Program([f, g], R.Call(R.Fname('g'), R.Int(1)))
+        out = partial_eval(uniquify(program))
+        self.assertEqual([str(f.name) for f in out.functions], ['g-f1'])
+
+    def testDeep(self):
+        body = R.Read()
+        for i in range(20000):
+            body = R.Let((R.Var('x'), R.Int(i)), R.Sum(R.Var('x'), body))
+        out = partial_eval(uniquify(R.Program([], body)))
+        self.assertEqual(str(out.body), '(+ (read) %d)' % sum(range(20000)))
+
+    def testPipeline(self):
+        x = R.Var('x')
+        program = R.Program([], R.Let((x, R.Sum(R.Int(2), R.Int(3))),
+                                      R.Sum(x, R.Negative(x))))
+        plain = pipeline(program)
+        optimized = pipeline(program, optimize = True)
+        languages = (R, R_uniq, R_uniq, C_flat, C_flat, C_flat, X_var, X_var,
+                     X_approx, X, X)
+        self.assertEqual(len(optimized), len(languages))
+        for language, result in zip(languages, optimized):
+            self.assertIsInstance(result, language.Program)
+            self.assertEqual(result.interpret(), 0)
+        self.assertLess(len(optimized[-1].instrs), len(plain[-1].instrs))
+
+    def testCommandLine(self):
+        ''' -O compiles a source file whose calls can be inlined, which X
+        could not run otherwise.'''
+        source = ('(program ((function f (a b) (+ a (- b)))) '
+                  '(let ([x (f 7 2)]) (f x (f 1 x))))')
+        compiler = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'compiler.py')
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'in.r'), 'w') as fi:
+                fi.write(source)
+            command = [sys.executable, compiler, 'in.r', 'out.s',
+                       '--log', 'none']
+            plain = subprocess.run(command, cwd = tmp, capture_output = True)
+            self.assertNotEqual(plain.returncode, 0)
+            self.assertIn(b'select_instr', plain.stderr)
+            subprocess.run(command + ['-O'], cwd = tmp, check = True)
+            with open(os.path.join(tmp, 'out.s')) as fi:
+                out = fi.read()
+        program = parsers.parse_R_from_string(source)
+        results = pipeline(program, optimize = True)
+        self.assertEqual(out, str(results[-1]))
+        self.assertEqual(results[-1].interpret(), program.interpret())
+        self.assertEqual(results[-1].interpret(), 9)
+
+################################
+# Dead Code Tests
+
+class TestDeadCode(unittest.TestCase):
+
+    def testUnusedLet(self):
+        program = uniquify(R.Program([], R.Let((R.Var('x'), R.Int(1)),
+                                               R.Int(1))))
+        flat = circleFlatten(program)
+        out = eliminate_dead_assigns(flat)
+        self.assertEqual(len(out.main.instrs), len(flat.main.instrs) - 1)
+        self.assertEqual(out.main.variables, {'retvar'})
+        self.assertEqual(out.interpret(), 1)
+
+    def testRead(self):
+        x, y = R.Var('x'), R.Var('y')
+        program = uniquify(R.Program([], R.Let((x, R.Read()),
+                                               R.Let((y, R.Read()), y))))
+        out = eliminate_dead_assigns(circleFlatten(program))
+        self.assertEqual([str(instr.expr) for instr in out.main.instrs[:-1]],
+                         ['(read)', '(read)', 'y-v0'])
+        with mock.patch('_sys.readInt', side_effect = [1, 2]):
+            self.assertEqual(out.interpret(), 2)
+
+    def testInstrs(self):
+        a, b, ret = X_var.Var('a'), X_var.Var('b'), X_var.Var('retvar')
+        program = X_var.Program(X_var.Movq(X_var.Int(1), a),
+                                X_var.Movq(X_var.Int(2), b),
+                                X_var.Addq(a, b),
+                                X_var.Negq(b),
+                                X_var.Movq(a, a),
+                                X_var.Movq(a, ret),
+                                X_var.Retq())
+        out = eliminate_dead_instrs(program)
+        self.assertEqual([str(instr) for instr in out.instrs],
+                         ['movq $1, a', 'movq a, retvar', 'retq'])
+        self.assertEqual(out.interpret(), 1)
+
+    def testPipeline(self):
+        program = parsers.parse_R_from_string(
+            '(program () (let ([x 4]) (let ([y (+ x 1)]) (- x))))')
+        results = pipeline(program)
+        out = eliminate_dead_instrs(results[3])
+        self.assertLess(len(out.instrs), len(results[3].instrs))
+        self.assertEqual(out.interpret(), -4)
+        self.assertEqual(patch(assign_homes(out)).interpret(), -4)
+        # and as a step of -O, after select_instr
+        timings = []
+        results = pipeline(program, timings = timings, optimize = True)
+        steps = [step for step, seconds in timings]
+        self.assertEqual(steps[steps.index('select_instr') + 1],
+                         'eliminate_dead_instrs')
+        self.assertEqual(results[-1].interpret(), -4)
+
+################################
+# Common Subexpression Tests
+
+class TestCommonSubexprs(unittest.TestCase):
+
+    def function(self, *instrs):
+        C = C_flat
+        names = {instr.var.name for instr in instrs
+                 if type(instr) == C.Assign}
+        return C.Function(None, set(), names | {'retvar'}, *instrs,
+                          C.Return(C.Var('retvar')))
+
+    def check(self, function, reads = ()):
+        out = eliminate_common_subexprs(function)
+        with mock.patch('_sys.readInt', side_effect = list(reads)):
+            before = function.interpret({})
+        with mock.patch('_sys.readInt', side_effect = list(reads)):
+            self.assertEqual(out.interpret({}), before)
+        return [str(instr) for instr in out.instrs[:-1]]
+
+    def testShared(self):
+        program = uniquify(parsers.parse_R_from_string(
+            '(program () (let ([x (read)]) (let ([y (+ x 1)])'
+            ' (+ (+ x 1) (- (+ 1 x))))))'))
+        flat = circleFlatten(program)
+        out = eliminate_common_subexprs(flat)
+        with mock.patch('_sys.readInt', return_value = 4):
+            self.assertEqual(out.interpret(), flat.interpret())
+        sums = lambda f: sum(type(instr.expr) == C_flat.Sum
+                             for instr in f.main.instrs[:-1])
+        self.assertEqual(sums(flat), 4)
+        self.assertEqual(sums(out), 2)
+        self.assertLess(len(eliminate_dead_assigns(out).main.instrs),
+                        len(eliminate_dead_assigns(flat).main.instrs))
+
+    def testReads(self):
+        C = C_flat
+        a, b, r = C.Var('a'), C.Var('b'), C.Var('retvar')
+        instrs = self.check(self.function(C.Assign(a, C.Read()),
+                                          C.Assign(b, C.Read()),
+                                          C.Assign(r, C.Sum(a, b))),
+                            reads = [1, 2])
+        self.assertEqual(instrs, ['(:= a (read))', '(:= b (read))',
+                                  '(:= retvar (+ a b))'])
+
+    def testClobbered(self):
+        C = C_flat
+        a, b, s, t, r = (C.Var(name) for name in ('a', 'b', 's', 't', 'retvar'))
+        # an operand changes between the two sums
+        instrs = self.check(self.function(C.Assign(a, C.Int(1)),
+                                          C.Assign(b, C.Int(2)),
+                                          C.Assign(s, C.Sum(a, b)),
+                                          C.Assign(a, C.Int(5)),
+                                          C.Assign(t, C.Sum(b, a)),
+                                          C.Assign(r, C.Sum(s, t))))
+        self.assertEqual(instrs[4], '(:= t (+ b a))')
+        # the variable holding the sum changes, but another still has it
+        instrs = self.check(self.function(C.Assign(a, C.Int(1)),
+                                          C.Assign(s, C.Negative(a)),
+                                          C.Assign(t, C.Var('s')),
+                                          C.Assign(s, C.Int(0)),
+                                          C.Assign(r, C.Negative(a)),
+                                          C.Assign(r, C.Sum(r, s))))
+        self.assertEqual(instrs[4], '(:= retvar t)')
+        # or nothing does
+        instrs = self.check(self.function(C.Assign(a, C.Int(1)),
+                                          C.Assign(s, C.Negative(a)),
+                                          C.Assign(s, C.Int(0)),
+                                          C.Assign(r, C.Negative(a)),
+                                          C.Assign(r, C.Sum(r, s))))
+        self.assertEqual(instrs[3], '(:= retvar (- a))')
+
+    def testRedundant(self):
+        C = C_flat
+        a, b, r = C.Var('a'), C.Var('b'), C.Var('retvar')
+        instrs = self.check(self.function(C.Assign(a, C.Int(3)),
+                                          C.Assign(r, C.Negative(a)),
+                                          C.Assign(b, C.Int(3)),
+                                          C.Assign(r, C.Negative(b)),
+                                          C.Assign(a, C.Var('b'))))
+        self.assertEqual(instrs, ['(:= a 3)', '(:= retvar (- a))',
+                                  '(:= b 3)'])
+
+    def testPipeline(self):
+        program = parsers.parse_R_from_string(
+            '(program () (let ([x 4]) (+ (+ x 1) (- (+ x 1)))))')
+        flat = circleFlatten(uniquify(program))
+        out = eliminate_common_subexprs(flat)
+        lowered = [select_instr(p) for p in (flat, out)]
+        self.assertLess(sum(type(instr) == X_var.Addq
+                            for instr in lowered[1].instrs),
+                        sum(type(instr) == X_var.Addq
+                            for instr in lowered[0].instrs))
+        self.assertEqual(patch(assign_homes(lowered[1])).interpret(), 0)
+        # and as a step of -O
+        timings = []
+        results = pipeline(program, timings = timings, optimize = True)
+        steps = [step for step, seconds in timings]
+        self.assertEqual(steps[steps.index('circleFlatten') + 1],
+                         'eliminate_common_subexprs')
+        self.assertEqual(results[-1].interpret(), 0)
+
+################################
+# Peephole Tests
+
+class TestPeephole(unittest.TestCase):
+
+    def check(self, instrs, expected, rule):
+        program = X.Program(X.Pushq(X.Reg.RBP),
+                            X.Movq(X.Reg.RSP, X.Reg.RBP),
+                            X.Subq(X.Int(8), X.Reg.RSP),
+                            *instrs,
+                            X.Movq(X.Reg.RAX, X.Reg.R15),
+                            X.Addq(X.Int(8), X.Reg.RSP),
+                            X.Popq(X.Reg.RBP),
+                            X.Retq())
+        stats = {}
+        out = peephole(program, stats)
+        self.assertEqual([str(instr) for instr in out.instrs[3:-4]], expected)
+        self.assertEqual(out.interpret(), program.interpret())
+        self.assertIn(rule, stats)
+
+    def testSelfMove(self):
+        self.check([X.Movq(X.Int(1), X.Reg.RAX),
+                    X.Movq(X.Reg.RAX, X.Reg.RAX)],
+                   ['movq $1, %rax'], 'self_move')
+
+    def testFoldNeg(self):
+        self.check([X.Movq(X.Int(3), X.Reg.RAX), X.Negq(X.Reg.RAX)],
+                   ['movq $-3, %rax'], 'fold_neg')
+
+    def testOverwritten(self):
+        self.check([X.Movq(X.Int(3), X.Reg.RAX),
+                    X.Movq(X.Int(4), X.Reg.RAX)],
+                   ['movq $4, %rax'], 'overwritten')
+
+    def testMoveBack(self):
+        a = X.Addr(X.Reg.RBP, -8)
+        self.check([X.Movq(X.Int(5), a),
+                    X.Movq(a, X.Reg.RAX),
+                    X.Movq(X.Reg.RAX, a)],
+                   ['movq $5, -8(%rbp)', 'movq -8(%rbp), %rax'], 'move_back')
+
+    def testReload(self):
+        a, b = X.Addr(X.Reg.RBP, -8), X.Addr(X.Reg.RBP, -16)
+        self.check([X.Movq(X.Int(2), a),
+                    X.Movq(a, X.Reg.R15),
+                    X.Movq(X.Reg.R15, b),
+                    X.Movq(a, X.Reg.R15),
+                    X.Addq(X.Reg.R15, b),
+                    X.Movq(b, X.Reg.RAX)],
+                   ['movq $2, -8(%rbp)', 'movq -8(%rbp), %r15',
+                    'movq %r15, -16(%rbp)', 'addq %r15, -16(%rbp)',
+                    'movq -16(%rbp), %rax'], 'reload')
+
+    def testEmptyFrame(self):
+        program = X.Program(X.Pushq(X.Reg.RBP),
+                            X.Movq(X.Reg.RSP, X.Reg.RBP),
+                            X.Subq(X.Int(0), X.Reg.RSP),
+                            X.Movq(X.Int(7), X.Reg.RAX),
+                            X.Movq(X.Reg.RAX, X.Reg.R15),
+                            X.Addq(X.Int(0), X.Reg.RSP),
+                            X.Popq(X.Reg.RBP),
+                            X.Retq())
+        stats = {}
+        out = peephole(program, stats)
+        self.assertEqual(stats, {'empty_frame': 2})
+        self.assertEqual(len(out.instrs), 6)
+
+    def testPipeline(self):
+        program = R.Program([], R.Negative(R.Sum(R.Int(1), R.Int(2))))
+        timings = []
+        results = pipeline(program, timings = timings, optimize = True)
+        self.assertEqual(timings[-1][0], 'peephole')
+        self.assertEqual(results[-1].interpret(), -3)
+        self.assertLess(len(results[-1].instrs), len(results[-2].instrs))
+        # on patch's output for code partial_eval has not folded away
+        program = parsers.parse_R_from_string(
+            '(program () (let ([x 4]) (let ([y (- x)]) (+ y (+ x y)))))')
+        patched = pipeline(program)[-1]
+        stats = {}
+        out = peephole(patched, stats)
+        self.assertEqual(stats, {'empty_frame': 2, 'self_move': 1})
+        self.assertEqual(out.interpret(), patched.interpret())
+        self.assertEqual(out.compile_to_closure()(), -4)
+
 if __name__ == '__main__':
     unittest.main()
@@ -167,6 +167,120 @@ def saferPrograms(draw):
     assume(assignVarNames(out.body, vars_=set(), fcns=fnames))
     return out
 
+####
+# Well-scoped programs
+#
+# These are drawn knowing which variables are bound and how many arguments
+# each function takes, so every one is well-formed as it is built and no
+# draw has to be thrown away. Expressions are built without recursion: a
+# stack of holes is filled in left to right, then the nodes are put together.
+
+_FILL, _BUILD = range(2)
+_INT, _READ, _VAR, _NEGATIVE, _SUM, _LET, _CALL = range(7)
+
+# strategies are made once, rather than at every draw
+_letters = sampled_from('abcdefghijklmnopqrstuvwxyz')
+_indices = {}
+
+def _index(n):
+    # drawing one of n things
+    if n not in _indices:
+        _indices[n] = integers(0, n-1)
+    return _indices[n]
+
+@composite
+def scoped_expressions(draw, variables = (), arities = {}, max_size = 24):
+    ''' An expression of at most max_size nodes using only the variables in
+    scope where it is used, and calling the functions in arities (a dict from
+    Fname to number of arguments) with the right number of arguments.'''
+    fnames = sorted(arities, key = lambda f: f.name)
+    budget = draw(_index(max_size))
+    work = [(_FILL, frozenset(variables))]
+    values = []
+    while work:
+        op, item = work.pop()
+        if op == _FILL:
+            # budget is the number of nodes that may still be added
+            scope = item
+            kinds = [_INT, _READ]
+            if scope:
+                kinds.append(_VAR)
+            if budget >= 1:
+                kinds.append(_NEGATIVE)
+            if budget >= 2:
+                kinds += [_SUM, _LET]
+            callable = [f for f in fnames if arities[f] <= budget]
+            if callable:
+                kinds.append(_CALL)
+            kind = kinds[draw(_index(len(kinds)))]
+            if kind == _INT:
+                values.append(R.Int(draw(integers())))
+            elif kind == _READ:
+                values.append(R.Read())
+            elif kind == _VAR:
+                names = sorted(scope)
+                values.append(R.Var(names[draw(_index(len(names)))]))
+            elif kind == _NEGATIVE:
+                budget -= 1
+                work += [(_BUILD, (_NEGATIVE,)), (_FILL, scope)]
+            elif kind == _SUM:
+                budget -= 2
+                work += [(_BUILD, (_SUM,)), (_FILL, scope), (_FILL, scope)]
+            elif kind == _LET:
+                budget -= 2
+                var = draw(_letters)
+                # the bound expression is filled first, in the outer scope
+                work += [(_BUILD, (_LET, var)), (_FILL, scope | {var}),
+                         (_FILL, scope)]
+            else:
+                fname = callable[draw(_index(len(callable)))]
+                n = arities[fname]
+                budget -= n
+                work.append((_BUILD, (_CALL, fname, n)))
+                work += [(_FILL, scope)] * n
+        else:
+            kind = item[0]
+            if kind == _SUM:
+                rhs = values.pop()
+                lhs = values.pop()
+                values.append(R.Sum(lhs, rhs))
+            elif kind == _NEGATIVE:
+                values.append(R.Negative(values.pop()))
+            elif kind == _LET:
+                body = values.pop()
+                expr = values.pop()
+                values.append(R.Let((R.Var(item[1]), expr), body))
+            else:
+                n = item[2]
+                args = values[len(values)-n:]
+                del values[len(values)-n:]
+                values.append(R.Call(item[1], *args))
+    assert len(values) == 1
+    return values[0]
+
+@composite
+def scoped_programs(draw, max_functions = 4, max_size = 24,
+                    recursion = False):
+    ''' A program whose variables are all bound and whose calls all match a
+    function's arity. Without recursion, each function only calls the ones
+    before it, so that running the program always finishes.'''
+    names = draw(lists(_letters, unique = True, max_size = max_functions))
+    functions = [R.Function(R.Fname(name),
+                            draw(lists(builds(R.Var, _letters),
+                                       max_size = 4)),
+                            None)
+                 for name in names]
+    arities = {}
+    if recursion:
+        arities = {f.name: len(f.arguments) for f in functions}
+    for function in functions:
+        function.body = draw(scoped_expressions(
+            [arg.name for arg in function.arguments], dict(arities),
+            max_size))
+        arities[function.name] = len(function.arguments)
+    body = draw(scoped_expressions((), arities, max_size))
+    return R.Program(functions, body)
+
 ####
 # main
 if __name__ == '__main__':
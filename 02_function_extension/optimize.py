@@ -0,0 +1,507 @@
+################################
+# Optimization passes
+#
+# partial_eval runs on R_uniq, between uniquify and circleFlatten. Every
+# expression is evaluated to a linear form: a constant plus a list of terms,
+# each one an expression that can't be evaluated at compile time, possibly
+# negated. Terms keep their left-to-right order, so reads and calls happen in
+# the same order as before; only the constants are moved, and added up.
+
+from collections import deque
+
+from Languages import R_uniq, C_flat, X_var, X
+
+# bodies of at most this many nodes, after optimization, are inlined
+INLINE_SIZE = 32
+
+def expr_size(expr):
+    ''' The number of nodes in an R_uniq expression.'''
+    count = 0
+    work = [expr]
+    while work:
+        expr = work.pop()
+        count += 1
+        ty = type(expr)
+        if ty == R_uniq.Negative or ty == R_uniq.Sum:
+            work.extend(expr)
+        elif ty == R_uniq.Let:
+            work.append(expr.binding[1])
+            work.append(expr.body)
+        elif ty == R_uniq.Call:
+            work.extend(expr.args)
+    return count
+
+def _residual(const, terms):
+    ''' The expression for a linear form: its terms added up in order, then
+    the constant.'''
+    expr = None
+    for term, negated in terms:
+        if negated:
+            term = R_uniq.Negative(term)
+        expr = term if expr is None else R_uniq.Sum(expr, term)
+    if expr is None:
+        return R_uniq.Int(const)
+    if const:
+        expr = R_uniq.Sum(expr, R_uniq.Int(const))
+    return expr
+
+def _called(expr):
+    ''' Names of the functions called in an R_uniq expression.'''
+    names = set()
+    work = [expr]
+    while work:
+        expr = work.pop()
+        ty = type(expr)
+        if ty == R_uniq.Call:
+            names.add(expr.fname)
+            work.extend(expr.args)
+        elif ty == R_uniq.Negative or ty == R_uniq.Sum:
+            work.extend(expr)
+        elif ty == R_uniq.Let:
+            work.append(expr.binding[1])
+            work.append(expr.body)
+    return names
+
+# work items for _Evaluator.run
+_VISIT, _BUILD, _BIND, _LET, _INLINE, _RETURN = range(6)
+
+class _Evaluator:
+    ''' Partially evaluates expressions, inlining the functions in inline.
+
+    env maps a variable to its value: an int if it is known, or else the name
+    of the variable holding it in the output. Inlined bodies are visited
+    again with their arguments bound, and every variable they keep is given a
+    fresh name, so that nothing they bind can capture a variable of the
+    caller's.'''
+
+    def __init__(self, inline):
+        self.inline = inline
+        self.fresh = 0
+
+    def run(self, expr, arguments = ()):
+        env = {arg: arg.name for arg in arguments}
+        shadows = []
+        kept = []
+        values = []
+        inlining = 0
+        work = [(_VISIT, expr)]
+        while work:
+            op, item = work.pop()
+            if op == _VISIT:
+                ty = type(item)
+                if ty == R_uniq.Int:
+                    values.append((item.val, deque()))
+                elif ty == R_uniq.Read:
+                    values.append((0, deque([(R_uniq.Read(), False)])))
+                elif ty == R_uniq.Var:
+                    value = env[item]
+                    if type(value) == int:
+                        values.append((value, deque()))
+                    else:
+                        values.append((0, deque([(R_uniq.Var(value), False)])))
+                elif ty == R_uniq.Negative:
+                    work.append((_BUILD, item))
+                    work.append((_VISIT, item.expr))
+                elif ty == R_uniq.Sum:
+                    work.append((_BUILD, item))
+                    work.append((_VISIT, item.rhs))
+                    work.append((_VISIT, item.lhs))
+                elif ty == R_uniq.Let:
+                    # the binding is evaluated in the enclosing scope, the
+                    # body in the new one
+                    var, subexpr = item.binding
+                    work.append((_LET, None))
+                    work.append((_VISIT, item.body))
+                    work.append((_BIND, var))
+                    work.append((_VISIT, subexpr))
+                elif ty == R_uniq.Call:
+                    work.append((_BUILD, item))
+                    for arg in reversed(item.args):
+                        work.append((_VISIT, arg))
+                else:
+                    raise TypeError('partial_eval: %s' % str(item))
+            elif op == _BIND:
+                const, terms = values.pop()
+                shadows.append((item, env.get(item)))
+                if not terms:
+                    # constants are propagated
+                    env[item] = const
+                    kept.append(None)
+                elif (not const and len(terms) == 1 and not terms[0][1]
+                      and type(terms[0][0]) == R_uniq.Var):
+                    # and so are copies
+                    env[item] = terms[0][0].name
+                    kept.append(None)
+                else:
+                    name = item.name
+                    if inlining:
+                        self.fresh += 1
+                        name = '%s-i%d' % (name, self.fresh)
+                    env[item] = name
+                    kept.append((name, const, terms))
+            elif op == _LET:
+                var, old = shadows.pop()
+                if old is None:
+                    del env[var]
+                else:
+                    env[var] = old
+                binding = kept.pop()
+                if binding is None:
+                    continue
+                name, b_const, b_terms = binding
+                const, terms = values.pop()
+                if (len(terms) == 1 and type(terms[0][0]) == R_uniq.Var and
+                    terms[0][0].name == name):
+                    # (let ([x e]) x) is just e, and (let ([x e]) (- x)) is
+                    # (- e)
+                    if terms[0][1]:
+                        b_const = -b_const
+                        b_terms = deque((term, not negated)
+                                        for term, negated in b_terms)
+                    values.append((b_const + const, b_terms))
+                    continue
+                let = R_uniq.Let((R_uniq.Var(name), _residual(b_const, b_terms)),
+                                 _residual(0 if terms else const, terms))
+                values.append((const if terms else 0, deque([(let, False)])))
+            elif op == _INLINE:
+                inlining += 1
+            elif op == _RETURN:
+                inlining -= 1
+            else:
+                ty = type(item)
+                if ty == R_uniq.Negative:
+                    const, terms = values.pop()
+                    values.append((-const, deque((term, not negated)
+                                                 for term, negated in terms)))
+                elif ty == R_uniq.Sum:
+                    r_const, r_terms = values.pop()
+                    l_const, l_terms = values.pop()
+                    # the shorter list is added to the longer one
+                    if len(l_terms) >= len(r_terms):
+                        l_terms.extend(r_terms)
+                        terms = l_terms
+                    else:
+                        r_terms.extendleft(reversed(l_terms))
+                        terms = r_terms
+                    values.append((l_const + r_const, terms))
+                else:
+                    n = len(item.args)
+                    args = values[len(values)-n:]
+                    del values[len(values)-n:]
+                    f = self.inline.get(item.fname)
+                    if f is None or len(f.arguments) != n:
+                        call = R_uniq.Call(item.fname,
+                                           *[_residual(*arg) for arg in args])
+                        values.append((0, deque([(call, False)])))
+                        continue
+                    # bind the arguments in order, as nested lets would
+                    values.extend(reversed(args))
+                    work.append((_RETURN, None))
+                    work.extend([(_LET, None)] * n)
+                    work.append((_VISIT, f.body))
+                    work.extend((_BIND, arg) for arg in reversed(f.arguments))
+                    work.append((_INLINE, None))
+        assert len(values) == 1
+        return _residual(*values[0])
+
+def partial_eval(program):
+    ''' Fold constants in an R_uniq program, propagate constants and copies
+    bound by lets, and inline small functions that aren't recursive.
+    Functions no longer called are dropped.'''
+    if type(program) != R_uniq.Program:
+        return _Evaluator({}).run(program)
+    functions = {f.name: f for f in program.functions}
+    calls = {name: _called(f.body) & functions.keys()
+             for name, f in functions.items()}
+    callers = {name: [] for name in functions}
+    for name, called in calls.items():
+        for callee in called:
+            callers[callee].append(name)
+
+    # functions are optimized after everything they call, so that their
+    # callees are ready to inline. Whatever is left over is recursive, or
+    # calls something that is.
+    inline = {}
+    evaluator = _Evaluator(inline)
+    optimized = {}
+    waiting = {name: len(called) for name, called in calls.items()}
+    ready = [name for name, count in waiting.items() if not count]
+    while ready:
+        name = ready.pop()
+        f = functions[name]
+        body = evaluator.run(f.body, f.arguments)
+        optimized[name] = R_uniq.Function(name, f.arguments, body)
+        if expr_size(body) <= INLINE_SIZE:
+            inline[name] = optimized[name]
+        for caller in callers[name]:
+            waiting[caller] -= 1
+            if not waiting[caller]:
+                ready.append(caller)
+    for name, f in functions.items():
+        if name not in optimized:
+            optimized[name] = R_uniq.Function(name, f.arguments,
+                                              evaluator.run(f.body, f.arguments))
+    body = evaluator.run(program.body)
+
+    # keep the functions main can still reach
+    reached = set()
+    work = list(_called(body))
+    while work:
+        name = work.pop()
+        if name in reached or name not in optimized:
+            continue
+        reached.add(name)
+        work.extend(_called(optimized[name].body))
+    return R_uniq.Program([optimized[f.name] for f in program.functions
+                           if f.name in reached], body)
+
+
+########
+# Dead code elimination
+#
+# Both passes walk the code backwards, keeping the set of variables live at
+# each point, and drop instructions that only write variables which aren't.
+# Since the instructions are removed as they are found, the operands of a
+# dead instruction don't become live, and chains of dead code go in one pass.
+
+def _flat_uses(expr):
+    ty = type(expr)
+    if ty == C_flat.Var:
+        return (expr.name,)
+    if ty == C_flat.Negative or ty == C_flat.Sum:
+        return tuple(arg.name for arg in expr if type(arg) == C_flat.Var)
+    if ty == C_flat.Call:
+        return tuple(arg.name for arg in expr.args if type(arg) == C_flat.Var)
+    return ()
+
+def eliminate_dead_assigns(program):
+    ''' Remove the assignments in a C_flat.Program, or Function, whose values
+    are never used. Reads and calls are kept, for their side effects.'''
+    if type(program) == C_flat.Program:
+        return C_flat.Program(eliminate_dead_assigns(program.main),
+                              *[eliminate_dead_assigns(f)
+                                for f in program.funcs])
+    live = set()
+    kept = []
+    for instr in reversed(program.instrs):
+        if type(instr) == C_flat.Assign:
+            dest, expr = instr.var.name, instr.expr
+            ty = type(expr)
+            if ty == C_flat.Var and expr.name == dest:
+                continue
+            if dest not in live and ty != C_flat.Read and ty != C_flat.Call:
+                continue
+            live.discard(dest)
+            live.update(_flat_uses(expr))
+        elif type(instr) == C_flat.Return:
+            live.update(_flat_uses(instr.out))
+        kept.append(instr)
+    kept.reverse()
+    used = set()
+    for instr in kept:
+        if type(instr) == C_flat.Assign:
+            used.add(instr.var.name)
+            used.update(_flat_uses(instr.expr))
+        else:
+            used.update(_flat_uses(instr.out))
+    return C_flat.Function(program.name, program.arguments,
+                           program.variables & used, *kept)
+
+def eliminate_dead_instrs(program):
+    ''' Remove the instructions in an X_var.Program whose results are never
+    used, and moves from a variable to itself.'''
+    live = set()
+    kept = []
+    for instr in reversed(program.instrs):
+        ty = type(instr)
+        if ty == X_var.Retq:
+            live.add(X_var.Retq.RETURN_VAR)
+        else:
+            dest = instr.dest.name if type(instr.dest) == X_var.Var else None
+            if dest is not None and dest not in live:
+                continue
+            if ty == X_var.Movq:
+                if type(instr.src) == X_var.Var and instr.src.name == dest:
+                    continue
+                live.discard(dest)
+            if ty != X_var.Negq and type(instr.src) == X_var.Var:
+                live.add(instr.src.name)
+        kept.append(instr)
+    kept.reverse()
+    return X_var.Program(*kept)
+
+########
+# Common subexpression elimination
+#
+# Local value numbering: going forwards through a function, each variable is
+# given the number of the value it holds, with constants, and sums and
+# negations of the same numbers, numbered alike. A sum or negation whose
+# number some variable still holds is replaced by a copy of that variable;
+# what computed its operands is then usually dead, for eliminate_dead_assigns
+# to remove. A read or call always gets a new number, so none is shared.
+
+def eliminate_common_subexprs(program):
+    ''' Replace each sum or negation in a C_flat.Program, or Function, whose
+    value a variable already holds with a copy of that variable.'''
+    if type(program) == C_flat.Program:
+        return C_flat.Program(eliminate_common_subexprs(program.main),
+                              *[eliminate_common_subexprs(f)
+                                for f in program.funcs])
+    values = {}     # constant or expression -> its number
+    numbers = {}    # variable -> number of the value it holds
+    holders = {}    # number -> variables holding it, oldest first
+
+    def number(key):
+        # a new number for a value equal to no other if key is None
+        if key is None:
+            key = object()
+        return values.setdefault(key, len(values))
+
+    def operand(arg):
+        if type(arg) == C_flat.Int:
+            return number(arg)
+        if arg.name not in numbers:
+            # an argument, or a variable used before it is set
+            n = numbers[arg.name] = number(None)
+            holders[n] = {arg.name: None}
+        return numbers[arg.name]
+
+    kept = []
+    for instr in program.instrs:
+        if type(instr) != C_flat.Assign:
+            kept.append(instr)
+            continue
+        dest, expr = instr.var.name, instr.expr
+        ty = type(expr)
+        if ty == C_flat.Var or ty == C_flat.Int:
+            n = operand(expr)
+        elif ty == C_flat.Negative or ty == C_flat.Sum:
+            n = number((ty,) + tuple(sorted(operand(arg) for arg in expr)))
+            source = next(iter(holders.get(n, ())), None)
+            if source is not None:
+                instr = C_flat.Assign(instr.var, C_flat.Var(source))
+        else:
+            n = number(None)
+        if numbers.get(dest) == n:
+            continue
+        if dest in numbers:
+            del holders[numbers[dest]][dest]
+        numbers[dest] = n
+        holders.setdefault(n, {})[dest] = None
+        kept.append(instr)
+    return C_flat.Function(program.name, program.arguments,
+                           set(program.variables), *kept)
+
+########
+# Peephole optimization
+#
+# Each rule is (name, width, rewrite): rewrite takes a window of width
+# instructions and returns the instructions to replace them with, or None
+# if the rule doesn't apply. Every rewrite makes the code shorter, so
+# applying them until none match always finishes.
+
+def _same(a, b):
+    ''' Whether two X operands are the same register, address or constant.'''
+    if type(a) != type(b):
+        return False
+    if type(a) == X.Addr:
+        return a.base is b.base and a.offset == b.offset
+    if type(a) == X.Int:
+        return a.val == b.val
+    return a is b
+
+def _reads(src, dest):
+    ''' Whether reading src reads dest, or the register it's addressed by.'''
+    if _same(src, dest):
+        return True
+    return type(src) == X.Addr and src.base is dest
+
+def _self_move(movq):
+    # movq a, a
+    if type(movq) == X.Movq and _same(movq.src, movq.dest):
+        return []
+
+def _empty_frame(instr):
+    # subq $0, %rsp and addq $0, %rsp, when nothing is spilled
+    if (type(instr) in (X.Subq, X.Addq) and instr.dest is X.Reg.RSP and
+        type(instr.src) == X.Int and instr.src.val == 0):
+        return []
+
+def _add_zero(instr):
+    # addq $0, a and subq $0, a
+    if (type(instr) in (X.Subq, X.Addq) and type(instr.src) == X.Int and
+        instr.src.val == 0):
+        return []
+
+def _fold_neg(movq, negq):
+    # movq $n, a; negq a  =>  movq $-n, a
+    if (type(movq) == X.Movq and type(negq) == X.Negq and
+        type(movq.src) == X.Int and _same(movq.dest, negq.dest)):
+        return [X.Movq(X.Int(-movq.src.val), movq.dest)]
+
+def _double_neg(first, second):
+    # negq a; negq a
+    if (type(first) == X.Negq and type(second) == X.Negq and
+        _same(first.dest, second.dest)):
+        return []
+
+def _move_back(first, second):
+    # movq a, b; movq b, a  =>  movq a, b
+    if (type(first) == X.Movq and type(second) == X.Movq and
+        _same(first.src, second.dest) and _same(first.dest, second.src) and
+        not _reads(first.src, first.dest)):
+        return [first]
+
+def _overwritten(first, second):
+    # movq a, b; movq c, b  =>  movq c, b, if c doesn't use b
+    if (type(first) == X.Movq and type(second) == X.Movq and
+        _same(first.dest, second.dest) and
+        not _reads(second.src, second.dest)):
+        return [second]
+
+def _reload(load, op, reload):
+    # movq a, %r15; op %r15, b; movq a, %r15: the second load is redundant
+    # as long as op didn't write a
+    if (type(load) == X.Movq and load.dest is X.Reg.R15 and
+        type(op) in (X.Movq, X.Addq, X.Subq) and op.src is X.Reg.R15 and
+        type(reload) == X.Movq and reload.dest is X.Reg.R15 and
+        _same(load.src, reload.src) and not _same(op.dest, load.src) and
+        op.dest is not X.Reg.R15 and not _reads(load.src, op.dest)):
+        return [load, op]
+
+PEEPHOLE_RULES = [
+    ('self_move', 1, _self_move),
+    ('empty_frame', 1, _empty_frame),
+    ('add_zero', 1, _add_zero),
+    ('fold_neg', 2, _fold_neg),
+    ('double_neg', 2, _double_neg),
+    ('move_back', 2, _move_back),
+    ('overwritten', 2, _overwritten),
+    ('reload', 3, _reload),
+]
+
+def peephole(program, stats = None, rules = PEEPHOLE_RULES):
+    ''' Rewrite an X.Program with rules until none apply. If stats is a
+    dict, the number of times each rule was applied is added to it.
+
+    Instructions are moved one at a time onto the output, and the rules are
+    tried on the windows ending at the last one. Whatever a rule replaces a
+    window with is moved back onto the input, so that it is looked at again
+    together with what comes before it.'''
+    pending = list(reversed(program.instrs[:-1]))
+    out = []
+    while pending:
+        out.append(pending.pop())
+        for name, width, rewrite in rules:
+            if len(out) < width:
+                continue
+            replacement = rewrite(*out[len(out)-width:])
+            if replacement is None:
+                continue
+            del out[len(out)-width:]
+            pending.extend(reversed(replacement))
+            if stats is not None:
+                stats[name] = stats.get(name, 0) + 1
+            break
+    out.append(program.instrs[-1])
+    return X.Program(*out)
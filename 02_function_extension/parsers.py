@@ -1,70 +1,166 @@
 
+import re
+
 from Languages import R
 
-r_dict = {
-    'program' : R.Program,
-    '+' : R.Sum,
-    '-' : R.Negative,
-    'let': R.Let
-    }
     
+# a bracket, or a run of anything that is neither a bracket nor whitespace
+_TOKEN = re.compile(r'[()\[\]]|[^\s()\[\]]+')
+
+CHUNK_SIZE = 1 << 16
+
+def _tokenize_chunks(chunks):
+    ''' Yield the tokens of the concatenation of chunks, scanning each chunk
+    with a single findall.'''
+    rest = ''
+    for chunk in chunks:
+        source = rest + chunk
+        tokens = _TOKEN.findall(source)
+        rest = ''
+        # an atom at the very end may carry on into the next chunk
+        if tokens and not source[-1].isspace() and source[-1] not in '()[]':
+            rest = tokens.pop()
+        yield from tokens
+    if rest:
+        yield rest
+
+def tokenize(source, chunk_size = CHUNK_SIZE):
+    ''' Lazily yield the brackets and atoms of source.'''
+    return _tokenize_chunks(source[i:i+chunk_size]
+                            for i in range(0, len(source), chunk_size))
+
+def tokenize_file(path, chunk_size = CHUNK_SIZE):
+    ''' Like tokenize, but reads the file chunk_size characters at a time
+    instead of all at once.'''
+    with open(path, 'r') as fi:
+        yield from _tokenize_chunks(iter(lambda: fi.read(chunk_size), ''))
+
+def build_sexpr(tokens):
+    stack = []
+    top = []
+    for token in tokens:
+        if token == '(' or token == '[':
+            stack.append(top)
+            top = []
+        elif token == ')' or token == ']':
+            # a closing bracket with nothing open
+            assert stack
+            l = top
+            top = stack.pop()
+            top.append(l)
+        else:
+            top.append(token)
+    assert not stack
+    return top
+
 def parse_sexpr(source):
-    out = [[]]
-    token = ''
-    for char in source:
-        if char in '([':
-            if token:
-                out[-1].append(token)
-            out.append([])
-            token = ''
-        elif char in '])':
-            if token:
-                out[-1].append(token)
-            l = out.pop()
-            out[-1].append(l)
-            token = ''
+    return build_sexpr(tokenize(source))
+
+_VISIT, _BUILD = range(2)
+
+def parse_R(ast, interner = None):
+    ''' Build an R syntax tree from the nested lists given by parse_sexpr.
+
+    The tree is built with an explicit stack rather than by recursion, so
+    deeply nested programs parse in time linear in their size. A list
+    headed by anything other than a keyword is a call to that function.
+    With a Languages.interning.Interner, equal nodes are shared.'''
+    L = R if interner is None else interner
+    work = [(_VISIT, ast)]
+    values = []
+    while work:
+        op, ast = work.pop()
+        if op == _VISIT:
+            if isinstance(ast, str):
+                try:
+                    values.append(L.Int(int(ast)))
+                except ValueError:
+                    values.append(L.Var(ast))
+                continue
+            if not ast or not isinstance(ast[0], str):
+                raise ValueError(ast)
+            head, rest = ast[0], ast[1:]
+            work.append((_BUILD, ast))
+            if head == 'program':
+                # the original grammar had no function list
+                assert len(rest) in (1, 2)
+                work.append((_VISIT, rest[-1]))
+                if len(rest) == 2:
+                    assert isinstance(rest[0], list)
+                    assert all(isinstance(f, list) and f[:1] == ['function']
+                               for f in rest[0])
+                    for f in reversed(rest[0]):
+                        work.append((_VISIT, f))
+            elif head == 'function':
+                assert len(rest) == 3
+                name, args, body = rest
+                assert isinstance(name, str) and isinstance(args, list)
+                assert all(isinstance(arg, str) for arg in args)
+                work.append((_VISIT, body))
+            elif head == 'read':
+                assert len(rest) == 0
+            elif head == '+':
+                assert len(rest) == 2
+                work.append((_VISIT, rest[1]))
+                work.append((_VISIT, rest[0]))
+            elif head == '-':
+                assert len(rest) == 1
+                work.append((_VISIT, rest[0]))
+            elif head == 'let':
+                assert len(rest) == 2
+                bindings, body = rest
+                assert len(bindings) == 1
+                binding = bindings[0]
+                assert len(binding) == 2 and isinstance(binding[0], str)
+                work.append((_VISIT, body))
+                work.append((_VISIT, binding[1]))
+            else:
+                for arg in reversed(rest):
+                    work.append((_VISIT, arg))
         else:
-            if char in ' \t\n':
-                if token:
-                    out[-1].append(token)
-                    token = ''
+            head, rest = ast[0], ast[1:]
+            if head == 'program':
+                body = values.pop()
+                n = len(rest[0]) if len(rest) == 2 else 0
+                functions = values[len(values)-n:]
+                del values[len(values)-n:]
+                values.append(L.Program(functions, body))
+            elif head == 'function':
+                name, args, body = rest
+                values.append(L.Function(L.Fname(name),
+                                         [L.Var(arg) for arg in args],
+                                         values.pop()))
+            elif head == 'read':
+                values.append(L.Read())
+            elif head == '+':
+                rhs = values.pop()
+                lhs = values.pop()
+                values.append(L.Sum(lhs, rhs))
+            elif head == '-':
+                values.append(L.Negative(values.pop()))
+            elif head == 'let':
+                var = rest[0][0][0]
+                body = values.pop()
+                values.append(L.Let(binding = (L.Var(var), values.pop()),
+                                    body = body))
             else:
-                token += char
-    if token:
-        out[-1].append(token)
-    assert len(out) == 1
-    return out[0]
-
-def parse_R(ast):
-    if isinstance(ast, str):
-        try:
-            return R.Int(int(ast))
-        except ValueError:
-            return R.Var(ast)
-    head, rest = ast[0], ast[1:]
-    if head == 'program':
-        assert len(rest) == 1
-        return R.Program(parse_R(rest[0]))
-    elif head == '+':
-        assert len(rest) == 2
-        return R.Sum(parse_R(rest[0]), parse_R(rest[1]))
-    elif head == '-':
-        assert len(rest) == 1
-        return R.Negative(parse_R(rest[0]))
-    elif head == 'let':
-        assert len(rest) == 2
-        bindings, body = rest
-        assert len(bindings) == 1
-        binding = bindings[0]
-        assert len(binding) == 2
-        return R.Let(binding = (parse_R(binding[0]), parse_R(binding[1])),
-                     body = parse_R(body))
-    else:
-        raise ValueError (head)
+                n = len(rest)
+                args = values[len(values)-n:]
+                del values[len(values)-n:]
+                values.append(L.Call(L.Fname(head), *args))
+    assert len(values) == 1
+    return values[0]
 
-def parse_R_from_string(source):
+def parse_R_from_string(source, interner = None):
     asts = parse_sexpr(source)
     assert len(asts) == 1
     ast = asts[0]
     assert ast[0] == 'program'
-    return parse_R(ast)
+    return parse_R(ast, interner)
+
+def parse_R_from_file(path, interner = None):
+    asts = build_sexpr(tokenize_file(path))
+    assert len(asts) == 1
+    ast = asts[0]
+    assert ast[0] == 'program'
+    return parse_R(ast, interner)
@@ -0,0 +1,144 @@
+################################
+# Hooks for instrumenting compiler.pipeline
+#
+# pipeline and partial_pipeline call hook.before(step, program) and
+# hook.after(step, program, result) around every step, where step is the
+# step's name. result is None if the step raised. Steps that keep stats
+# (assign_homes and peephole) hand them to hook.report(step, stats) just
+# before hook.after.
+
+import json
+import time
+import tracemalloc
+
+from Languages import R, R_uniq, C_flat
+
+class Hook:
+    ''' A hook that does nothing, to subclass.'''
+
+    def before(self, step, program):
+        pass
+
+    def report(self, step, stats):
+        pass
+
+    def after(self, step, program, result):
+        pass
+
+_TREES = {}
+for _lang in (R, R_uniq):
+    _TREES.update({_lang.Function: lambda f: [f.body],
+                   _lang.Call: lambda e: list(e.args),
+                   _lang.Negative: list,
+                   _lang.Sum: list,
+                   _lang.Let: lambda e: [e.binding[1], e.body]})
+
+def size(program):
+    ''' The number of nodes in an R or R_uniq program, or of instructions in
+    any later one.'''
+    if isinstance(program, tuple):
+        return sum(size(p) for p in program)
+    if type(program) == C_flat.Program:
+        return sum(len(f.instrs) for f in (program.main,) + program.funcs)
+    if hasattr(program, 'instrs'):
+        return len(program.instrs)
+    if type(program) in (R.Program, R_uniq.Program):
+        work = list(program.functions) + [program.body]
+    else:
+        work = [program]
+    count = 0
+    while work:
+        node = work.pop()
+        count += 1
+        children = _TREES.get(type(node))
+        if children:
+            work.extend(children(node))
+    return count
+
+class Profiler(Hook):
+    ''' Records, for every step: wall and CPU time, the peak memory allocated
+    during it, and the size of its input and output, along with whatever the
+    step reports: for assign_homes, what the allocator decided, and for
+    peephole, the number of times each rule applied.
+
+    Memory is measured with tracemalloc, which slows everything down while
+    it runs; pass memory=False for more accurate times.'''
+
+    COLUMNS = [('step', '%-22s', '%-22s'),
+               ('wall', '%10s', '%8.2fms'),
+               ('cpu', '%10s', '%8.2fms'),
+               ('peak_memory', '%12s', '%10.1fkB'),
+               ('size_in', '%8s', '%8d'),
+               ('size_out', '%8s', '%8d'),
+               ('variables', '%9s', '%9d'),
+               ('interference_edges', '%8s', '%8d'),
+               ('spills', '%6s', '%6d'),
+               ('frame_size', '%6s', '%6d')]
+    HEADINGS = {'peak_memory': 'peak', 'size_in': 'in', 'size_out': 'out',
+                'variables': 'vars', 'interference_edges': 'edges',
+                'frame_size': 'frame'}
+
+    def __init__(self, memory = True):
+        self.memory = memory
+        self.records = []
+        self.tracing = False
+
+    def before(self, step, program):
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing = True
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+        self.stats = None
+        self.start = time.perf_counter(), time.process_time()
+
+    def report(self, step, stats):
+        self.stats = stats
+
+    def after(self, step, program, result):
+        wall = time.perf_counter() - self.start[0]
+        cpu = time.process_time() - self.start[1]
+        record = {'step': step, 'wall': wall, 'cpu': cpu}
+        if self.memory:
+            record['peak_memory'] = tracemalloc.get_traced_memory()[1] - self.base
+        record['size_in'] = size(program)
+        if result is not None:
+            record['size_out'] = size(result)
+        if self.stats is not None:
+            if step == 'peephole':
+                record['rules'] = self.stats
+            else:
+                record.update(self.stats)
+        self.records.append(record)
+
+    def close(self):
+        ''' Stop tracemalloc, if this profiler started it.'''
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    def to_json(self):
+        return json.dumps(self.records, indent = 1)
+
+    def table(self):
+        ''' The records as a table, one line per step.'''
+        lines = [' '.join(heading % self.HEADINGS.get(key, key)
+                          for key, heading, cell in self.COLUMNS)]
+        for record in self.records:
+            cells = []
+            for key, heading, cell in self.COLUMNS:
+                value = record.get(key)
+                if value is None:
+                    cells.append(heading % '-')
+                elif key in ('wall', 'cpu'):
+                    cells.append(cell % (value * 1e3))
+                elif key == 'peak_memory':
+                    cells.append(cell % (value / 1e3))
+                else:
+                    cells.append(cell % value)
+            lines.append(' '.join(cells))
+            if record.get('rules'):
+                lines.append('%22s %s' % ('', ', '.join(
+                    '%s %d' % rule for rule in sorted(record['rules'].items()))))
+        return '\n'.join(lines)
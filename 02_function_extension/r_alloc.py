@@ -1,4 +1,5 @@
 
+import heapq
 from enum import Enum
 
 from Languages import X_var, X_approx
@@ -44,116 +45,438 @@ def simpleAlloc(variables):
 ### Saturation Algorithm
 ########
 
+def bits(mask):
+    ''' Iterate over the indices of the set bits of mask, lowest first.'''
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
 class Graph:
-    def __init__(self, nodes=set()):
-        self.data = dict.fromkeys(nodes, set())
+    ''' Undirected graph over dense integer ids. Each node's neighbours are
+    stored as an integer bitmask, so adding and testing an edge are single
+    bitwise operations.'''
+
+    def __init__(self, nodes=()):
+        self.index = {}
+        self.nodes = []
+        self.rows = []
+        self.check_nodes(*nodes)
 
     def __str__(self):
-        return str(self.data)
+        return str({node: self.get_adjacent(node) for node in self.nodes})
+
+    def id(self, node):
+        ''' Return the id of node, adding it to the graph if necessary.'''
+        try:
+            return self.index[node]
+        except KeyError:
+            self.index[node] = len(self.nodes)
+            self.nodes.append(node)
+            self.rows.append(0)
+            return self.index[node]
 
     def check_nodes(self, *nodes):
         for node in nodes:
-            if node not in self.data.keys():
-                self.data[node] = set()
+            self.id(node)
 
     def add_edge(self, start, end, directed = False):
-        self.check_nodes(start, end)
-        self.data[start] |= {end}
+        start, end = self.id(start), self.id(end)
+        self.rows[start] |= 1 << end
         if not directed:
-            self.data[end] |= {start}
+            self.rows[end] |= 1 << start
 
     def remove_edge(self, start, end, directed = False):
-        self.data[start] -= {end}
+        start, end = self.id(start), self.id(end)
+        self.rows[start] &= ~(1 << end)
         if not directed:
-            self.data[end] -= {start}
+            self.rows[end] &= ~(1 << start)
+
+    def has_edge(self, start, end):
+        if start not in self.index or end not in self.index:
+            return False
+        return bool(self.rows[self.index[start]] >> self.index[end] & 1)
+
+    def degree(self, node):
+        if node not in self.index:
+            return 0
+        return self.rows[self.index[node]].bit_count()
+
+    def neighbour_ids(self, i):
+        ''' Iterate over the ids adjacent to the node with id i.'''
+        return bits(self.rows[i])
+
+    def neighbours(self, node):
+        if node not in self.index:
+            return
+        for i in self.neighbour_ids(self.index[node]):
+            yield self.nodes[i]
 
     def get_adjacent(self, node):
-        if node in self.data:
-            return self.data[node]
-        return set()
+        return set(self.neighbours(node))
+
+class Liveness:
+    ''' Liveness analysis for a straight-line list of X_var instructions.
+
+    Each variable is given a bit in a table, and the live sets are stored as
+    integer bitsets in a preallocated list filled in a single backward pass.
+    Since the code is straight-line, the set live after instruction i is the
+    set live before instruction i+1, so live[i] and live[i+1] give the sets
+    before and after instruction i.'''
+
+    def __init__(self, instrs):
+        self.instrs = instrs
+        self.index = {}
+        self.variables = []
+        self.live = [0] * (len(instrs)+1)
+
+        live = 0
+        for i in range(len(instrs)-1, -1, -1):
+            instr = instrs[i]
+
+            # compute liveness for previous instruction
+            ty = type(instr)
+
+            # Retq
+            if ty == X_var.Retq:
+                # retvar must be live
+                live |= self.bit(X_var.Var(X_var.Retq.RETURN_VAR))
+
+            # Dest
+            if ty in (X_var.Movq,):
+                # These instructions overwrite dest, so dest cannot be live before them
+                if type(instr.dest) == X_var.Var:
+                    bit = self.bit(instr.dest)
+                    if live & bit:
+                        live ^= bit
+            elif ty in (X_var.Negq, X_var.Addq, X_var.Subq):
+                # These instructions use dest as input, so dest must be live before them
+                if type(instr.dest) == X_var.Var:
+                    live |= self.bit(instr.dest)
+
+            # Src
+            if ty in (X_var.Movq, X_var.Addq, X_var.Subq):
+                # Src must be live
+                if type(instr.src) == X_var.Var:
+                    live |= self.bit(instr.src)
+            self.live[i] = live
+
+    def bit(self, var):
+        ''' Return the bitmask for var, adding it to the table if necessary.'''
+        try:
+            return 1 << self.index[var]
+        except KeyError:
+            self.index[var] = len(self.variables)
+            self.variables.append(var)
+            return 1 << self.index[var]
+
+    def decode(self, bits):
+        ''' Return the set of variables in a bitset.'''
+        out = set()
+        while bits:
+            low = bits & -bits
+            out.add(self.variables[low.bit_length()-1])
+            bits ^= low
+        return out
+
+    def live_before(self, i):
+        return self.decode(self.live[i])
+
+    def live_after(self, i):
+        return self.decode(self.live[i+1])
 
 def annotate_liveness(instrs):
     ''' Return a list of tuples containing the instructions along with the set of variables
     live after the instruction.'''
-    out = []
-    live = set()
-    for instr in reversed(instrs):
-        # add instruction along with liveness annotation to output
-        out.insert(0, (instr, live.copy()))
+    liveness = Liveness(instrs)
+    return [(instr, liveness.live_after(i)) for i, instr in enumerate(instrs)]
 
-        # compute liveness for previous instruction
-        ty = type(instr)
+def _interfering(liveness, i):
+    ''' Return the id of the variable written by instruction i and the bitset
+    of variables it interferes with, or None and the live-after set if the
+    instruction writes nothing.'''
+    instruction = liveness.instrs[i]
+    mask = liveness.live[i+1]
+    ty = type(instruction)
+    if ty not in (X_var.Movq, X_var.Negq, X_var.Addq, X_var.Subq):
+        return None, mask
+    dest = liveness.index[instruction.dest]
+    if mask >> dest & 1:
+        mask ^= 1 << dest
+    # Mov is a special case, because it doesn't change the value at all
+    if ty == X_var.Movq and type(instruction.src) == X_var.Var:
+        src = liveness.index[instruction.src]
+        if mask >> src & 1:
+            mask ^= 1 << src
+    return dest, mask
 
-        # Retq
-        if ty == X_var.Retq:
-            # retvar must be live
-            live |= {X_var.Var('retvar')}
-        
-        # Dest
-        if ty in (X_var.Movq,):
-            # These instructions overwrite dest, so dest cannot be live before them
-            if type(instr.dest) == X_var.Var:
-                live -= {instr.dest}
-        elif ty in (X_var.Negq, X_var.Addq, X_var.Subq):
-            # These instructions use dest as input, so dest must be live before them
-            if type(instr.dest) == X_var.Var:
-                live |= {instr.dest}
+def calc_interference(liveness):
+    ''' Given the liveness analysis of a list of instructions, compute the interference graph.
 
-        # Src
-        if ty in (X_var.Movq, X_var.Addq, X_var.Subq):
-            # Src must be live
-            if type(instr.src) == X_var.Var:
-                live |= {instr.src}
-    return out
+    Instruction i adds an edge between its destination d_i and every variable
+    in its interfering set m_i. The row of d_i is the union of the m_i, one OR
+    per instruction. For the reverse edges, the row of v gains {d_i} for every
+    i in a run of instructions with v in m_i; those unions are range queries
+    over the sequence of destinations, answered with a Fenwick tree of XORed
+    bits in which each destination is kept only at its latest definition, so
+    the XOR of a range is the union of the destinations defined in it. No
+    step iterates over individual edges.'''
 
-def calc_interference(instrs):
-    ''' Given a list of instructions annotated with their liveness, compute the interference graph.'''
+    n = len(liveness.instrs)
+    out = Graph(liveness.variables)
+    rows = out.rows
+    tree = [0] * (n+1)
+    latest = {}
+    started = {}
 
-    out = Graph()
-    for instr in instrs:
-        instruction, live_after = instr
-        ty = type(instr[0])
-        # Mov is a special case, because it doesn't change the value at all
-        if ty == X_var.Movq:
-            for var in live_after:
-                if var not in instruction:
-                    out.add_edge(instruction.dest, var)
-        # normal cases
-        elif ty in (X_var.Negq, X_var.Addq, X_var.Subq):
-            for var in live_after:
-                if var != instruction.dest:
-                    out.add_edge(instruction.dest, var)
+    def update(pos, bits):
+        while pos <= n:
+            tree[pos] ^= bits
+            pos += pos & -pos
+
+    def prefix(pos):
+        bits = 0
+        while pos > 0:
+            bits ^= tree[pos]
+            pos -= pos & -pos
+        return bits
+
+    def close(run, end):
+        ''' Add the destinations of instructions [started, end] to the rows in run.'''
+        while run:
+            low = run & -run
+            var = low.bit_length() - 1
+            run ^= low
+            rows[var] |= prefix(end) ^ prefix(started.pop(var) - 1)
+
+    previous = 0
+    for i in range(n):
+        pos = i + 1
+        dest, mask = _interfering(liveness, i)
+        close(previous & ~mask, pos - 1)
+        if dest is not None:
+            rows[dest] |= mask
+            if dest in latest:
+                update(latest[dest], 1 << dest)
+            latest[dest] = pos
+            update(pos, 1 << dest)
+        run = mask & ~previous
+        while run:
+            low = run & -run
+            started[low.bit_length() - 1] = pos
+            run ^= low
+        previous = mask
+    close(previous, n)
     return out
 
+def choose_spills(nodes, keep, interference, k):
+    ''' Pick the variables to keep out of registers, Chaitin style.
+
+    Variables with fewer than k neighbours left can always be given a
+    register, so they are set aside; when none remain, the variable with the
+    most neighbours left is spilled. Variables in keep are never spilled.'''
+    rows = interference.rows
+    remaining = 0
+    for i in nodes:
+        remaining |= 1 << i
+    degree = {i: (rows[i] & remaining).bit_count() for i in nodes}
+    for i in keep:
+        remaining ^= 1 << i
+    low = [i for i in bits(remaining) if degree[i] < k]
+    high = [(-degree[i], i) for i in bits(remaining) if degree[i] >= k]
+    heapq.heapify(high)
+    spilled = set()
+    while remaining:
+        if low:
+            i = low.pop()
+            if not remaining >> i & 1:
+                continue
+        else:
+            d, i = heapq.heappop(high)
+            if not remaining >> i & 1 or -d != degree[i]:
+                continue
+            spilled.add(i)
+        remaining ^= 1 << i
+        for j in bits(rows[i] & remaining):
+            degree[j] -= 1
+            if degree[j] == k - 1:
+                low.append(j)
+            elif degree[j] >= k:
+                heapq.heappush(high, (-degree[j], j))
+    return spilled
+
+def dsatur(nodes, interference, precolored={}, limit=None):
+    ''' Color nodes in order of saturation (the number of distinct colors among
+    their neighbours), ties broken by degree, taking the lowest free color.
+
+    Candidates are kept in a heap with lazy updates: when a node's saturation
+    grows a new entry is pushed, and stale entries are skipped when popped.
+    Neighbours outside nodes are ignored, apart from the precolored ones. Nodes
+    for which no color below limit is free are left uncolored.
+
+    Return the coloring and the list of uncolored nodes.'''
+    rows = interference.rows
+    mask = 0
+    for i in nodes:
+        mask |= 1 << i
+    saturation = {i: set() for i in nodes}
+    degree = {i: (rows[i] & mask).bit_count() for i in nodes}
+    colors = {}
+    failed = []
+
+    def assign(i, color):
+        colors[i] = color
+        for j in bits(rows[i] & mask):
+            if j not in colors and color not in saturation[j]:
+                saturation[j].add(color)
+                heapq.heappush(heap, (-len(saturation[j]), -degree[j], j))
+
+    heap = []
+    for i, color in precolored.items():
+        assign(i, color)
+    heap += [(-len(saturation[i]), -degree[i], i)
+             for i in nodes if i not in colors]
+    heapq.heapify(heap)
+    while heap:
+        sat, _, i = heapq.heappop(heap)
+        if i in colors or -sat != len(saturation[i]):
+            continue
+        color = 0
+        while color in saturation[i]:
+            color += 1
+        if limit is not None and color >= limit:
+            failed.append(i)
+            mask ^= 1 << i
+            colors[i] = None
+            continue
+        assign(i, color)
+    return {i: c for i, c in colors.items() if c is not None}, failed
+
 def saturationAlloc(variables, interference):
-    ''' Allocate using graph coloring via the saturation method.
+    ''' Allocate using graph coloring via the saturation (DSatur) method.
+
+    Spill candidates are chosen first (see choose_spills), so that the
+    variables conflicting with the most others are the ones kept in memory.
+    The rest are colored with registers by dsatur, and any that still cannot
+    get one are spilled too. Spilled variables are then colored with stack
+    slots in the same way, so spilled variables that do not interfere share
+    a slot.
 
-    interference: a dictionary representing the interference graph
+    interference: a Graph representing the interference graph
     '''
-    saturation = {var:set() for var in variables}
-    out = {}
+    registers = [X_approx.Reg(i) for i in range(3, 16)]
+    ids = {var: interference.id(var) for var in variables}
 
     # Start by allocating retvar
-    rvar = X_var.Var('retvar') 
+    rvar = X_var.Var('retvar')
     assert rvar in variables
-    out[rvar] = X_approx.Reg.RAX
-    for var in interference.get_adjacent(rvar):
-        saturation[var] |= {X_approx.Reg.RAX}
-    variables -= {rvar}
-
-    stackIndex=0
-    for var in variables:
-        # Allocate a register if possible
-        for i in range(3, 16):
-            reg = X_approx.Reg(i)
-            if reg not in saturation[var]:
-                out[var] = reg
-                for v in interference.get_adjacent(var):
-                    saturation[v] |= {reg}
-                break
-        # Use stack if necessary
-        if var not in out.keys():
-            out[var] = X_approx.Addr(X_approx.Reg.RBP, stackIndex)
-            stackIndex -= X_approx.Addr.WORD_SIZE
-    return out, stackIndex // -X_approx.Addr.WORD_SIZE
+    assert registers[0] == X_approx.Reg.RAX
+    retvar = ids[rvar]
+
+    nodes = set(ids.values())
+    spilled = choose_spills(nodes, {retvar}, interference, len(registers))
+    in_registers, failed = dsatur(nodes - spilled, interference,
+                                  precolored={retvar: 0},
+                                  limit=len(registers))
+    # Use stack if necessary
+    on_stack, _ = dsatur(spilled | set(failed), interference)
+
+    out = {}
+    for var, i in ids.items():
+        if i in in_registers:
+            out[var] = registers[in_registers[i]]
+        else:
+            out[var] = X_approx.Addr(X_approx.Reg.RBP,
+                                     -(on_stack[i]+1) * X_approx.Addr.WORD_SIZE)
+    return out, max(on_stack.values(), default=-1) + 1
+
+########
+### Coalescing
+########
+
+def coalesce(program, k=13):
+    ''' Merge move-related variables that do not interfere, and delete the
+    moves that become self-moves.
+
+    A pair is only merged when coloring cannot get harder: either the merged
+    variable has fewer than k neighbours of significant degree (Briggs), or
+    every neighbour of one variable already interferes with the other or has
+    insignificant degree (George). retvar always keeps its name.'''
+    instrs = program.instrs
+    liveness = Liveness(instrs)
+    interference = calc_interference(liveness)
+    rows = interference.rows
+
+    parent = {}
+    members = {}
+    neighbours = {}
+    def find(i):
+        root = i
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while i != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def class_row(i):
+        return neighbours.get(i, rows[i])
+
+    def class_bits(i):
+        return members.get(i, 1 << i)
 
+    def significant(i):
+        # counts every member of a neighbouring class, so this can only
+        # overestimate the degree, which keeps the tests conservative
+        return class_row(i).bit_count() >= k
+
+    def briggs(a, b):
+        seen = set()
+        count = 0
+        for j in bits(class_row(a) | class_row(b)):
+            t = find(j)
+            if t not in seen:
+                seen.add(t)
+                count += significant(t)
+                if count >= k:
+                    return False
+        return True
+
+    def george(a, b):
+        for j in bits(class_row(a)):
+            t = find(j)
+            if not class_row(b) & class_bits(t) and significant(t):
+                return False
+        return True
+
+    retvar = X_var.Var(X_var.Retq.RETURN_VAR)
+    for instr in instrs:
+        if not (type(instr) == X_var.Movq and
+                type(instr.src) == X_var.Var and
+                type(instr.dest) == X_var.Var):
+            continue
+        a = find(liveness.index[instr.src])
+        b = find(liveness.index[instr.dest])
+        if a == b or class_row(a) & class_bits(b):
+            continue
+        if interference.nodes[a] == retvar:
+            a, b = b, a
+        if briggs(a, b) or george(a, b):
+            # merge a into b
+            parent[a] = b
+            members[b] = class_bits(b) | class_bits(a)
+            neighbours[b] = class_row(b) | class_row(a)
+
+    out = []
+    for instr in instrs:
+        if type(instr) == X_var.Retq:
+            out.append(instr)
+            continue
+        args = []
+        for arg in instr:
+            if type(arg) == X_var.Var:
+                arg = interference.nodes[find(liveness.index[arg])]
+            args.append(arg)
+        if type(instr) == X_var.Movq and args[0] == args[1]:
+            continue
+        out.append(type(instr)(*args))
+    return X_var.Program(*out)
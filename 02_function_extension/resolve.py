@@ -0,0 +1,162 @@
+################################
+# Resolved interpreter for R and R_uniq
+#
+# Program.interpret() copies the environment at every let and rebuilds the
+# function environment at every call, so it is quadratic in the nesting depth.
+# resolve() instead gives every variable a slot in its function's frame, ahead
+# of time, and compiles the program into a flat list of stack-machine
+# instructions. Functions are referred to by index, and running the program
+# takes time linear in the number of instructions executed.
+
+import sys
+
+import _sys
+from Languages import R, R_uniq
+
+_PUSH, _READ, _LOAD, _STORE, _NEG, _ADD, _CALL, _RET, _RAISE = range(9)
+
+_KINDS = {}
+for _lang in (R, R_uniq):
+    _KINDS.update({_lang.Int: _PUSH,
+                   _lang.Read: _READ,
+                   _lang.Var: _LOAD,
+                   _lang.Let: _STORE,
+                   _lang.Negative: _NEG,
+                   _lang.Sum: _ADD,
+                   _lang.Call: _CALL})
+
+class Code:
+    ''' The compiled body of a function, or of the program itself.'''
+
+    def __init__(self, size, instrs):
+        self.size = size
+        self.instrs = instrs
+
+_VISIT, _BIND, _UNBIND, _EMIT = range(4)
+
+def _compile_expr(expr, arguments, functions, lang):
+    ''' Compile expr, evaluated in a frame holding arguments, into a Code.
+
+    A let binds its variable in the slot after those of every enclosing
+    binding, so the slot number is the depth of the binding and is free again
+    once the let's body is done.'''
+    scope = {arg.name: i for i, arg in enumerate(arguments)}
+    depth = size = len(arguments)
+    shadows = []
+    instrs = []
+    work = [(_VISIT, expr)]
+    while work:
+        op, item = work.pop()
+        if op == _EMIT:
+            instrs.append(item)
+        elif op == _BIND:
+            shadows.append((item, scope.get(item)))
+            scope[item] = depth
+            instrs.append((_STORE, depth))
+            depth += 1
+            size = max(size, depth)
+        elif op == _UNBIND:
+            name, old = shadows.pop()
+            if old is None:
+                del scope[name]
+            else:
+                scope[name] = old
+            depth -= 1
+        else:
+            kind = _KINDS.get(type(item))
+            if kind == _PUSH:
+                instrs.append((_PUSH, item.val))
+            elif kind == _READ:
+                instrs.append((_READ, None))
+            elif kind == _LOAD:
+                if item.name in scope:
+                    instrs.append((_LOAD, scope[item.name]))
+                else:
+                    instrs.append((_RAISE, (lang.VarNotDefined, item.name)))
+            elif kind == _NEG:
+                work.append((_EMIT, (_NEG, None)))
+                work.append((_VISIT, item.expr))
+            elif kind == _ADD:
+                work.append((_EMIT, (_ADD, None)))
+                work.append((_VISIT, item.rhs))
+                work.append((_VISIT, item.lhs))
+            elif kind == _STORE:
+                # the binding is evaluated in the enclosing scope, the body
+                # in the new one
+                var, subexpr = item.binding
+                work.append((_UNBIND, None))
+                work.append((_VISIT, item.body))
+                work.append((_BIND, var.name))
+                work.append((_VISIT, subexpr))
+            elif kind == _CALL:
+                # errors are raised when the call is reached, as interpret()
+                # would, rather than when the program is resolved
+                if item.fname not in functions:
+                    instrs.append((_RAISE, (lang.FunctionNotDefined,
+                                            item.fname)))
+                    continue
+                index, f = functions[item.fname]
+                if len(f.arguments) != len(item.args):
+                    instrs.append((_RAISE, (lang.WrongNumberOfArgs,
+                                            item.fname, len(item.args))))
+                    continue
+                work.append((_EMIT, (_CALL, (index, len(item.args)))))
+                for arg in reversed(item.args):
+                    work.append((_VISIT, arg))
+            else:
+                raise TypeError('resolve: %s' % str(item))
+    instrs.append((_RET, None))
+    return Code(size, instrs)
+
+def resolve(program):
+    ''' Compile an R or R_uniq program, returning a function that runs it and
+    gives the same result as program.interpret().
+
+    Unlike interpret(), nothing here recurses over the syntax tree, so deeply
+    nested programs can be run as well.'''
+    lang = R if type(program) == R.Program else R_uniq
+    functions = {}
+    for f in program.functions:
+        functions[f.name] = f
+    functions = {name: (i, f) for i, (name, f) in enumerate(functions.items())}
+    codes = [_compile_expr(f.body, f.arguments, functions, lang)
+             for i, f in functions.values()]
+    main = _compile_expr(program.body, [], functions, lang)
+    return lambda: _run(main, codes)
+
+def _run(main, codes):
+    limit = sys.getrecursionlimit()
+    instrs, frame = main.instrs, [None] * main.size
+    stack, calls = [], []
+    pc = 0
+    while True:
+        op, arg = instrs[pc]
+        pc += 1
+        if op == _LOAD:
+            stack.append(frame[arg])
+        elif op == _PUSH:
+            stack.append(arg)
+        elif op == _ADD:
+            rhs = stack.pop()
+            stack[-1] += rhs
+        elif op == _STORE:
+            frame[arg] = stack.pop()
+        elif op == _NEG:
+            stack[-1] = -stack[-1]
+        elif op == _CALL:
+            index, n = arg
+            if len(calls) >= limit:
+                raise RecursionError('maximum recursion depth exceeded')
+            calls.append((instrs, pc, frame))
+            code = codes[index]
+            instrs, pc = code.instrs, 0
+            frame = stack[len(stack)-n:] + [None] * (code.size - n)
+            del stack[len(stack)-n:]
+        elif op == _RET:
+            if not calls:
+                return stack.pop()
+            instrs, pc, frame = calls.pop()
+        elif op == _READ:
+            stack.append(_sys.readInt())
+        else:
+            raise arg[0](*arg[1:])
@@ -0,0 +1,251 @@
+################################
+# Binary serialization for every language in the pipeline
+#
+# Layout:  MAGIC, VERSION byte, string table, then the nodes in prefix order.
+# The string table is a varint count followed by varint-length-prefixed UTF-8
+# strings; every name in the program is stored once and referred to by index.
+# A node is an opcode byte, its scalar fields, a varint count of children, and
+# then the children themselves. Integers are zigzag varints, so arbitrarily
+# large values round-trip. Opcode 0 stands for None.
+#
+# Neither dumping nor loading recurses over the syntax tree.
+
+import mmap
+
+from Languages import R, R_uniq, C_flat, X_var, X_approx, X
+
+MAGIC = b'IRB'
+VERSION = 1
+
+class FormatError(Exception):
+    pass
+
+####
+# Node table
+#
+# Each entry is (class, scalar fields, get, build): get returns an object's
+# scalars and children, and build makes the object from them again. Scalar
+# fields are 'i' for an integer, 's' for a string and 'c' for a list or set
+# of strings.
+
+def _R_entries(L):
+    return [
+        (L.Program, '', lambda p: ((), list(p.functions) + [p.body]),
+         lambda s, c: L.Program(c[:-1], c[-1])),
+        (L.Function, '', lambda f: ((), [f.name] + list(f.arguments) + [f.body]),
+         lambda s, c: L.Function(c[0], c[1:-1], c[-1])),
+        (L.Fname, 's', lambda f: ((f.name,), ()),
+         lambda s, c: L.Fname(*s)),
+        (L.Call, '', lambda e: ((), (e.fname,) + tuple(e.args)),
+         lambda s, c: L.Call(*c)),
+        (L.Read, '', lambda e: ((), ()),
+         lambda s, c: L.Read()),
+        (L.Int, 'i', lambda e: ((e.val,), ()),
+         lambda s, c: L.Int(*s)),
+        (L.Negative, '', lambda e: ((), e),
+         lambda s, c: L.Negative(*c)),
+        (L.Sum, '', lambda e: ((), e),
+         lambda s, c: L.Sum(*c)),
+        (L.Let, '', lambda e: ((), e.binding + (e.body,)),
+         lambda s, c: L.Let((c[0], c[1]), c[2])),
+        (L.Var, 's', lambda e: ((e.name,), ()),
+         lambda s, c: L.Var(*s)),
+    ]
+
+def _C_flat_entries(L):
+    return [
+        (L.Program, '', lambda p: ((), (p.main,) + tuple(p.funcs)),
+         lambda s, c: L.Program(*c)),
+        (L.Function, 'cc', lambda f: ((f.arguments, f.variables),
+                                      [f.name] + f.instrs),
+         lambda s, c: L.Function(c[0], s[0], s[1], *c[1:])),
+        (L.Call, '', lambda e: ((), (e.name,) + tuple(e.args)),
+         lambda s, c: L.Call(*c)),
+        (L.Return, '', lambda e: ((), (e.out,)),
+         lambda s, c: L.Return(*c)),
+        (L.Read, '', lambda e: ((), ()),
+         lambda s, c: L.Read()),
+        (L.Int, 'i', lambda e: ((e.val,), ()),
+         lambda s, c: L.Int(*s)),
+        (L.Negative, '', lambda e: ((), e),
+         lambda s, c: L.Negative(*c)),
+        (L.Sum, '', lambda e: ((), e),
+         lambda s, c: L.Sum(*c)),
+        (L.Assign, '', lambda e: ((), e),
+         lambda s, c: L.Assign(*c)),
+        (L.Var, 's', lambda e: ((e.name,), ()),
+         lambda s, c: L.Var(*s)),
+    ]
+
+def _X_entries(L):
+    entries = [
+        (L.Program, '', lambda p: ((), p.instrs),
+         lambda s, c: L.Program(*c)),
+        (L.Retq, '', lambda e: ((), ()),
+         lambda s, c: L.Retq()),
+        (L.Int, 'i', lambda e: ((e.val,), ()),
+         lambda s, c: L.Int(*s)),
+    ]
+    for cls in (L.Movq, L.Negq, L.Subq, L.Addq):
+        entries.append((cls, '', lambda e: ((), e),
+                        lambda s, c, cls=cls: cls(*c)))
+    if L is X_var:
+        entries.append((L.Var, 's', lambda e: ((e.name,), ()),
+                        lambda s, c: L.Var(*s)))
+        return entries
+    for cls in (L.Pushq, L.Popq):
+        entries.append((cls, '', lambda e: ((), e),
+                        lambda s, c, cls=cls: cls(*c)))
+    entries.append((L.Reg, 'i', lambda e: ((e.value,), ()),
+                    lambda s, c: L.Reg(*s)))
+    entries.append((L.Addr, 'ii', lambda e: ((e.base.value, e.offset), ()),
+                    lambda s, c: L.Addr(L.Reg(s[0]), s[1])))
+    return entries
+
+# opcodes are positions in this list, so it may only be appended to without
+# changing VERSION. Plain strings are nodes too, since C_flat function names
+# may be either strings or Fnames.
+_ENTRIES = [None, (str, 's', lambda s: ((s,), ()), lambda s, c: s[0])]
+for _entries in (_R_entries(R), _R_entries(R_uniq), _C_flat_entries(C_flat),
+                 _X_entries(X_var), _X_entries(X_approx), _X_entries(X)):
+    _ENTRIES.extend(_entries)
+_OPCODES = {entry[0]: i for i, entry in enumerate(_ENTRIES) if entry}
+assert len(_ENTRIES) <= 256
+
+####
+# Encoding
+
+def _write_varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+def dumps(program):
+    ''' Serialize program, or any node of any language, to bytes.'''
+    strings = {}
+    body = bytearray()
+    work = [program]
+    while work:
+        node = work.pop()
+        if node is None:
+            body.append(0)
+            continue
+        try:
+            opcode = _OPCODES[type(node)]
+        except KeyError:
+            raise TypeError('dumps: %s' % type(node)) from None
+        cls, fields, get, build = _ENTRIES[opcode]
+        scalars, children = get(node)
+        body.append(opcode)
+        for field, value in zip(fields, scalars):
+            if field == 'i':
+                _write_varint(body, value << 1 if value >= 0 else ~value << 1 | 1)
+            elif field == 's':
+                _write_varint(body, strings.setdefault(value, len(strings)))
+            else:
+                # sets are written in sorted order, so equal programs give
+                # equal bytes
+                is_set = isinstance(value, (set, frozenset))
+                _write_varint(body, len(value) << 1 | is_set)
+                for name in sorted(value) if is_set else value:
+                    _write_varint(body, strings.setdefault(name, len(strings)))
+        _write_varint(body, len(children))
+        work.extend(reversed(children))
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    _write_varint(out, len(strings))
+    for string in strings:
+        data = string.encode('utf-8')
+        _write_varint(out, len(data))
+        out += data
+    return bytes(out + body)
+
+def dump(program, path):
+    with open(path, 'wb') as fi:
+        fi.write(dumps(program))
+
+####
+# Decoding
+
+def loads(data):
+    ''' Rebuild a program from bytes, or any buffer such as an mmap.'''
+    if data[:len(MAGIC)] != MAGIC:
+        raise FormatError('not a serialized program')
+    if data[len(MAGIC)] != VERSION:
+        raise FormatError('unsupported version %d' % data[len(MAGIC)])
+    pos = len(MAGIC) + 1
+
+    def varint():
+        nonlocal pos
+        byte = data[pos]
+        pos += 1
+        n = byte & 0x7f
+        shift = 7
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            n |= (byte & 0x7f) << shift
+            shift += 7
+        return n
+
+    strings = []
+    for _ in range(varint()):
+        n = varint()
+        strings.append(bytes(data[pos:pos+n]).decode('utf-8'))
+        pos += n
+
+    # nodes waiting on their children: (build, scalars, base, count), where
+    # the children are values[base:]
+    pending = []
+    values = []
+    while True:
+        opcode = data[pos]
+        pos += 1
+        if opcode == 0:
+            values.append(None)
+        else:
+            try:
+                cls, fields, get, build = _ENTRIES[opcode]
+            except (IndexError, TypeError):
+                raise FormatError('bad opcode %d' % opcode) from None
+            scalars = []
+            for field in fields:
+                if field == 'i':
+                    n = varint()
+                    scalars.append(~(n >> 1) if n & 1 else n >> 1)
+                elif field == 's':
+                    scalars.append(strings[varint()])
+                else:
+                    n = varint()
+                    names = [strings[varint()] for _ in range(n >> 1)]
+                    scalars.append(set(names) if n & 1 else names)
+            count = data[pos]
+            if count < 0x80:
+                pos += 1
+            else:
+                count = varint()
+            if count:
+                pending.append((build, scalars, len(values), count))
+                continue
+            values.append(build(scalars, ()))
+        # build every node whose last child this was
+        while pending:
+            build, scalars, base, count = pending[-1]
+            if len(values) - base != count:
+                break
+            pending.pop()
+            children = values[base:]
+            del values[base:]
+            values.append(build(scalars, children))
+        else:
+            break
+    if pos != len(data):
+        raise FormatError('trailing data')
+    return values[0]
+
+def load(path):
+    ''' Load a program from a file, decoding straight from an mmap of it.'''
+    with open(path, 'rb') as fi:
+        with mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return loads(data)